@@ -0,0 +1,1077 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+from quiz.aliases import _question_aliases
+from quiz.analysis import (
+    get_low_accuracy_question_keys,
+    get_low_accuracy_questions,
+    item_analysis,
+    save_statistics_to_csv,
+)
+from quiz.bank import build_bank, load_questions, open_bank, sample_questions
+from quiz.constants import BANK_CACHE_SUFFIX, STATS_INDEX_FILE
+from quiz.database import _databases, open_database
+from quiz.dedup import find_near_duplicates, minhash_signatures
+from quiz.deps import np
+from quiz.grading import CompactExam, QuestionTable, grade_answer_sheets
+from quiz.history import (
+    _adaptive_samplers,
+    _question_masks,
+    _scanned_exams,
+    get_adaptive_positions,
+    get_due_question_keys,
+    get_questions_from_done_tests,
+    history_question_stats,
+    history_version,
+    load_stats_index,
+    scan_history,
+    update_adaptive_sampler,
+)
+from quiz.importer import import_questions
+from quiz.journal import AnswerJournal
+from quiz.model import grade_results
+from quiz.scheduling import ReviewQueue
+from quiz.search import _search_indexes, build_search_index, open_search_index
+from quiz.storage import (
+    _catalogs,
+    _history_logs,
+    _question_stores,
+    append_exams_to_history,
+    get_done_tests,
+    load_exam,
+    store_questions,
+)
+from quiz.terminal import KeyReader, Screen, run_session
+from quiz.workers import scan_workers
+
+WORDS = (
+    "cloud policy node project folder identity access storage network bucket "
+    "instance cluster region zone service account role permission billing "
+    "quota log metric alert query table dataset pipeline function container"
+).split()
+
+
+def random_text(rng, num_words):
+    """Generate a random sentence of the given number of words."""
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def generate_bank(
+    data_file, num_questions, answers_per_question=4, text_length=40, seed=0
+):
+    """
+    Write a synthetic question bank in the data.json format.
+    :param data_file: File to write.
+    :param num_questions: Number of questions.
+    :param answers_per_question: Number of answers per question.
+    :param text_length: Number of words in each description; answers get a third of it.
+    :param seed: Random seed, so runs are comparable.
+    """
+    rng = random.Random(seed)
+    with open(data_file, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for i in range(num_questions):
+            correct = rng.sample(range(answers_per_question), rng.choice([1, 1, 1, 2]))
+            question = {
+                "description": f"Question {i}: {random_text(rng, text_length)}?",
+                "answers": [
+                    {
+                        "value": f"Answer {i}.{j}: {random_text(rng, max(1, text_length // 3))}",
+                        "correct": j in correct,
+                    }
+                    for j in range(answers_per_question)
+                ],
+            }
+            f.write(
+                ("," if i else "") + json.dumps(question, ensure_ascii=False) + "\n"
+            )
+        f.write("]\n")
+
+
+def generate_exam(rng, questions, questions_per_exam, timestamp):
+    """Build one synthetic completed test from a list of questions."""
+    results = []
+    for question in rng.sample(questions, min(questions_per_exam, len(questions))):
+        # Answer about two thirds of the questions correctly
+        if rng.random() < 0.67:
+            user_answer = [ans["id"] for ans in question["answers"] if ans["correct"]]
+        else:
+            user_answer = [rng.choice(question["answers"])["id"]]
+        results.append({"question": question, "user_answer": user_answer})
+    score = sum(
+        set(result["user_answer"])
+        == {ans["id"] for ans in result["question"]["answers"] if ans["correct"]}
+        for result in results
+    )
+    return {
+        "timestamp": timestamp.isoformat(),
+        "questions": results,
+        "score": score,
+        "total": len(results),
+        "percentage": score / len(results) * 100,
+        "passed": score / len(results) >= 0.7,
+        "pass_condition": "70%",
+        "elapsed_time": "10:00",
+        "time_limit": 30,
+    }
+
+
+def generate_history(
+    exams_dir, questions, num_exams, questions_per_exam=20, history_format="log", seed=0
+):
+    """
+    Write a synthetic test history.
+    :param exams_dir: Directory to write the tests to.
+    :param questions: Questions to draw the tests from.
+    :param num_exams: Number of completed tests.
+    :param questions_per_exam: Number of questions in each test.
+    :param history_format: "log" for the compact exam log, "files" for one JSON file
+        per test, "sqlite" for the SQLite database.
+    :param seed: Random seed, so runs are comparable.
+    """
+    rng = random.Random(seed)
+    os.makedirs(exams_dir, exist_ok=True)
+    start = datetime.datetime(2024, 1, 1)
+    batch = []
+    for i in range(num_exams):
+        timestamp = start + datetime.timedelta(minutes=i)
+        exam_data = generate_exam(rng, questions, questions_per_exam, timestamp)
+        name = f"exam_{timestamp.strftime('%Y%m%d_%H%M%S')}_{i:06d}"
+        if history_format == "files":
+            path = os.path.join(exams_dir, f"{name}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(exam_data, f, ensure_ascii=False, indent=4)
+            os.utime(path, (timestamp.timestamp(), timestamp.timestamp()))
+        elif history_format == "sqlite":
+            batch.append((name, exam_data, timestamp.timestamp()))
+            if len(batch) == 1000:
+                open_database(exams_dir, create=True).add_exams(batch)
+                batch = []
+        else:
+            keys = store_questions(
+                exams_dir, [result["question"] for result in exam_data["questions"]]
+            )
+            batch.append((name, exam_data, timestamp.timestamp(), keys))
+            if len(batch) == 1000:
+                append_exams_to_history(exams_dir, batch)
+                batch = []
+    if history_format == "sqlite":
+        open_database(exams_dir, create=True).add_exams(batch)
+    elif history_format == "log" and batch:
+        append_exams_to_history(exams_dir, batch)
+
+
+def reset_caches():
+    """Forget everything the app caches in memory between calls."""
+    _history_logs.clear()
+    _question_stores.clear()
+    _question_masks.clear()
+    _catalogs.clear()
+    _question_aliases.clear()
+    _scanned_exams.clear()
+    for database in _databases.values():
+        database.close()
+    _databases.clear()
+
+
+def remove_files(*paths):
+    """Remove files that may not exist."""
+    for path in paths:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+@contextlib.contextmanager
+def devnull_output():
+    """Send stdout and stderr to /dev/null, including those of child processes."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        os.dup2(devnull.fileno(), 2)
+        try:
+            with contextlib.redirect_stdout(devnull):
+                yield devnull
+        finally:
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            for fd in saved:
+                os.close(fd)
+
+
+def measure(name, size, func, setup=None):
+    """
+    Run func once for wall time and once under tracemalloc for peak memory.
+    :param name: Name of the benchmark.
+    :param size: Problem size reported with the result.
+    :param func: Function to measure.
+    :param setup: Function run before each measured call, not measured itself.
+    :return: Result dict.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        wall_time = time.perf_counter() - start
+
+        if setup:
+            setup()
+        tracemalloc.start()
+        try:
+            func()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    result = {
+        "name": name,
+        "size": size,
+        "wall_time": round(wall_time, 6),
+        "peak_memory": peak_memory,
+    }
+    print(
+        f"{name:<40} {size:>10} {wall_time * 1000:>12.2f} ms {peak_memory / 1e6:>10.2f} MB",
+        file=sys.stderr,
+    )
+    return result
+
+
+def bench_bank(workdir, num_questions, args):
+    """Benchmark loading and sampling a question bank of the given size."""
+    data_file = os.path.join(workdir, f"bank_{num_questions}.json")
+    generate_bank(data_file, num_questions, args.answers, args.text_length, args.seed)
+    cache_file = data_file + BANK_CACHE_SUFFIX
+    results = [
+        measure(
+            "load_questions[cold]",
+            num_questions,
+            lambda: load_questions(data_file),
+            setup=lambda: remove_files(cache_file),
+        ),
+        measure(
+            "load_questions[cached]",
+            num_questions,
+            lambda: load_questions(data_file),
+        ),
+        measure(
+            "sample_questions[stream]",
+            num_questions,
+            lambda: sample_questions(data_file, args.test_size),
+        ),
+        measure("build_bank", num_questions, lambda: build_bank(data_file)),
+    ]
+
+    def sample_mapped():
+        with open_bank(data_file) as bank:
+            positions = random.sample(bank.positions(), min(args.test_size, len(bank)))
+            return [bank.question(position) for position in positions]
+
+    results.append(measure("open_bank+sample", num_questions, sample_mapped))
+
+    results.append(
+        measure(
+            "build_search_index",
+            num_questions,
+            lambda: build_search_index(data_file),
+        )
+    )
+    results.append(
+        measure(
+            "open_search_index",
+            num_questions,
+            lambda: open_search_index(data_file),
+            setup=_search_indexes.clear,
+        )
+    )
+    index = open_search_index(data_file)
+    for name, query in [
+        ("rare", f"question {num_questions // 2}"),
+        ("and_not", "bucket quota -billing"),
+        ("or_prefix", "(dataset OR table) AND clu*"),
+    ]:
+        results.append(
+            measure(f"search[{name}]", num_questions, lambda: index.search(query))
+        )
+    return results
+
+
+def bench_history(workdir, num_exams, args):
+    """Benchmark the history readers on a synthetic history of the given size."""
+    data_file = os.path.join(workdir, "history_bank.json")
+    if not os.path.exists(data_file):
+        generate_bank(
+            data_file, args.history_bank_size, args.answers, args.text_length, args.seed
+        )
+    questions = load_questions(data_file)
+    exams_dir = os.path.join(workdir, f"exams_{args.history_format}_{num_exams}")
+    generate_history(
+        exams_dir, questions, num_exams, args.test_size, args.history_format, args.seed
+    )
+    index_file = os.path.join(exams_dir, STATS_INDEX_FILE)
+    output_file = os.path.join(workdir, "statistics.csv")
+
+    def cold():
+        reset_caches()
+        remove_files(index_file)
+
+    results = [
+        measure(
+            "get_done_tests",
+            num_exams,
+            lambda: get_done_tests(exams_dir),
+            reset_caches,
+        ),
+        measure(
+            "get_questions_from_done_tests[cold]",
+            num_exams,
+            lambda: get_questions_from_done_tests(exams_dir),
+            cold,
+        ),
+        measure(
+            "get_questions_from_done_tests[indexed]",
+            num_exams,
+            lambda: get_questions_from_done_tests(exams_dir),
+            reset_caches,
+        ),
+        measure(
+            "get_low_accuracy_questions[indexed]",
+            num_exams,
+            lambda: get_low_accuracy_questions(exams_dir, 70),
+            reset_caches,
+        ),
+        measure(
+            "save_statistics_to_csv[wide]",
+            num_exams,
+            lambda: save_statistics_to_csv(exams_dir, output_file),
+            reset_caches,
+        ),
+        measure(
+            "save_statistics_to_csv[long]",
+            num_exams,
+            lambda: save_statistics_to_csv(exams_dir, output_file, "long"),
+            reset_caches,
+        ),
+    ]
+
+    done_tests = get_done_tests(exams_dir)
+    for workers in sorted({1, scan_workers()}):
+        results.append(
+            measure(
+                f"scan_history[workers={workers}]",
+                num_exams,
+                lambda: scan_history(done_tests, workers),
+                reset_caches,
+            )
+        )
+
+    exams = [load_exam(test) for test in done_tests[: args.grading_exams]]
+    results.append(
+        measure(
+            "grading",
+            sum(len(exam["questions"]) for exam in exams),
+            lambda: [grade_results(exam["questions"]) for exam in exams],
+        )
+    )
+
+    sheets = [
+        {
+            "questions": [result["question"]["id"] for result in exam["questions"]],
+            "answers": {
+                result["question"]["id"]: result["user_answer"]
+                for result in exam["questions"]
+            },
+        }
+        for exam in exams
+    ]
+    results.append(
+        measure(
+            "grade_answer_sheets",
+            sum(len(sheet["questions"]) for sheet in sheets),
+            lambda: grade_answer_sheets(questions, sheets, "70%"),
+        )
+    )
+    return results
+
+
+def bench_analysis(workdir, num_exams, args):
+    """Benchmark the item analysis of a synthetic history of the given size."""
+    data_file = os.path.join(workdir, f"analysis_bank_{args.analysis_bank_size}.json")
+    if not os.path.exists(data_file):
+        generate_bank(
+            data_file,
+            args.analysis_bank_size,
+            args.answers,
+            args.text_length,
+            args.seed,
+        )
+    questions = load_questions(data_file)
+    exams_dir = os.path.join(workdir, f"exams_analysis_{num_exams}")
+    generate_history(exams_dir, questions, num_exams, args.test_size, "log", args.seed)
+    return [
+        measure(
+            "item_analysis",
+            num_exams,
+            lambda: list(item_analysis(exams_dir)),
+            reset_caches,
+        ),
+        measure(
+            "item_analysis[2pl]",
+            num_exams,
+            lambda: list(item_analysis(exams_dir, "2pl")),
+            reset_caches,
+        ),
+    ]
+
+
+def held_memory(build):
+    """Bytes allocated by build that are still in use once it has returned."""
+    tracemalloc.start()
+    try:
+        kept = build()  # Alive until the memory is read
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_model(workdir, num_questions, args):
+    """Benchmark the compact question and test model against plain dicts."""
+    data_file = os.path.join(workdir, f"model_bank_{num_questions}.json")
+    generate_bank(data_file, num_questions, args.answers, args.text_length, args.seed)
+    questions = load_questions(data_file)
+    rng = random.Random(args.seed)
+    start = datetime.datetime(2024, 1, 1)
+    # Tests are decoded separately, as load_exam returns them
+    exam_texts = [
+        json.dumps(
+            generate_exam(rng, questions, args.test_size, start + datetime.timedelta(i))
+        )
+        for i in range(args.grading_exams)
+    ]
+    exams = [json.loads(text) for text in exam_texts]
+    compact_exams = [CompactExam.from_exam(exam) for exam in exams]
+    num_results = sum(len(exam["questions"]) for exam in exams)
+
+    builds = {
+        ("model_questions[dict]", num_questions): lambda: load_questions(data_file),
+        ("model_questions[table]", num_questions): lambda: QuestionTable(questions),
+        ("model_exams[dict]", num_results): lambda: [
+            json.loads(text) for text in exam_texts
+        ],
+        ("model_exams[compact]", num_results): lambda: [
+            CompactExam.from_exam(json.loads(text)) for text in exam_texts
+        ],
+    }
+    results = []
+    for (name, size), build in builds.items():
+        results.append(measure(name, size, build))
+        # What the model keeps once built, besides the peak while building it
+        results[-1]["held_memory"] = held_memory(build)
+        print(
+            f"{'':<40} {'held':>10} {results[-1]['held_memory'] / 1e6:>26.2f} MB",
+            file=sys.stderr,
+        )
+
+    results.extend(
+        [
+            measure(
+                "grading[dict]",
+                num_results,
+                lambda: [grade_results(exam["questions"]) for exam in exams],
+            ),
+            measure(
+                "grading[compact]",
+                num_results,
+                lambda: [exam.score() for exam in compact_exams],
+            ),
+            measure(
+                "CompactExam.to_exam",
+                num_results,
+                lambda: [exam.to_exam() for exam in compact_exams],
+            ),
+        ]
+    )
+    return results
+
+
+def bench_reviews(workdir, num_questions, args):
+    """
+    Benchmark picking the questions due for review from a bank of the given size.
+    The history has one test per test-size questions of the bank, so most
+    questions have a review state.
+    """
+    data_file = os.path.join(workdir, f"review_bank_{num_questions}.json")
+    generate_bank(data_file, num_questions, args.answers, args.text_length, args.seed)
+    questions = load_questions(data_file)
+    num_exams = max(1, num_questions // args.test_size)
+    now = datetime.datetime(2025, 1, 1).timestamp()  # Every question is due
+    results = []
+    for history_format in ("log", "sqlite"):
+        exams_dir = os.path.join(workdir, f"reviews_{history_format}_{num_questions}")
+        generate_history(
+            exams_dir, questions, num_exams, args.test_size, history_format, args.seed
+        )
+        if history_format == "log":
+            index = load_stats_index(exams_dir)
+            results.append(
+                measure(
+                    "review_queue[build]",
+                    num_questions,
+                    lambda: ReviewQueue(index["questions"]),
+                )
+            )
+            queue = ReviewQueue(index["questions"])
+            results.append(
+                measure(
+                    "review_queue.due",
+                    num_questions,
+                    lambda: queue.due(index["questions"], args.test_size, now),
+                )
+            )
+        results.extend(
+            [
+                measure(
+                    f"get_due_question_keys[{history_format}]",
+                    num_questions,
+                    lambda: get_due_question_keys(exams_dir, args.test_size, now),
+                ),
+                measure(
+                    f"get_low_accuracy_question_keys[{history_format}]",
+                    num_questions,
+                    lambda: get_low_accuracy_question_keys(exams_dir, 70),
+                ),
+            ]
+        )
+    return results
+
+
+def bench_adaptive(workdir, num_questions, args):
+    """
+    Benchmark assembling adaptive tests from a bank of the given size. As for the
+    review benchmark, the history has one test per test-size questions of the bank.
+    """
+    data_file = os.path.join(workdir, f"adaptive_bank_{num_questions}.json")
+    generate_bank(data_file, num_questions, args.answers, args.text_length, args.seed)
+    questions = load_questions(data_file)
+    exams_dir = os.path.join(workdir, f"adaptive_{num_questions}")
+    num_exams = max(1, num_questions // args.test_size)
+    generate_history(exams_dir, questions, num_exams, args.test_size, "log", args.seed)
+    test_size = args.adaptive_test_size
+    # Kept up to date as tests are saved, not built per test; the bank cache was
+    # written by load_questions above
+    load_stats_index(exams_dir)
+
+    def assemble():
+        return get_adaptive_positions(data_file, exams_dir, test_size)
+
+    results = [
+        measure(
+            "adaptive_sampler[build]",
+            num_questions,
+            assemble,
+            setup=_adaptive_samplers.clear,
+        ),
+        measure(f"adaptive_test[{test_size}]", num_questions, assemble),
+    ]
+    answered = [question["id"] for question in random.sample(questions, test_size)]
+    stats = history_question_stats(exams_dir, answered)
+    results.append(
+        measure(
+            f"adaptive_sampler.update[{test_size}]",
+            num_questions,
+            lambda: update_adaptive_sampler(
+                exams_dir, history_version(exams_dir), stats
+            ),
+        )
+    )
+    # What menu options 1 and 4 do: filter the questions, then sample them
+    seen = get_questions_from_done_tests(exams_dir)
+    results.append(
+        measure(
+            f"filter+random.sample[{test_size}]",
+            num_questions,
+            lambda: random.sample(
+                [question for question in questions if question["id"] not in seen],
+                test_size,
+            ),
+        )
+    )
+    return results
+
+
+def generate_descriptions(num_questions, text_length=40, seed=0):
+    """
+    Generate question descriptions from a large vocabulary of made-up words, one
+    in a hundred being a copy of another with one character changed. Unlike the
+    few WORDS, unrelated descriptions share about as little text as real ones.
+    """
+    rng = random.Random(seed)
+    syllables = "ka lo mi ter vun pra sel dor gi fu nex qua ro bi zan tul".split()
+    vocabulary = [
+        "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+        for _ in range(30000)
+    ]
+    descriptions = []
+    for i in range(num_questions):
+        if i % 100 == 99:
+            edited = list(rng.choice(descriptions))
+            edited[rng.randrange(len(edited))] = "x"
+            descriptions.append("".join(edited))
+        else:
+            words = (rng.choice(vocabulary) for _ in range(text_length))
+            descriptions.append(" ".join(words) + "?")
+    return descriptions
+
+
+def bench_dedup(num_questions, args):
+    """Benchmark finding the near-duplicates among descriptions of a bank."""
+    descriptions = generate_descriptions(num_questions, args.text_length, args.seed)
+    return [
+        measure(
+            "minhash_signatures",
+            num_questions,
+            lambda: minhash_signatures(descriptions),
+        ),
+        measure(
+            "find_near_duplicates",
+            num_questions,
+            lambda: find_near_duplicates(descriptions),
+        ),
+    ]
+
+
+def bench_render(num_frames, args):
+    """
+    Benchmark redrawing a question screen, as a test session does on every key.
+    Output goes to /dev/null, so this measures the cost of producing frames and
+    not of the terminal displaying them.
+    """
+    rng = random.Random(args.seed)
+    body = ["=" * 40, "Question 1/20", "", "", random_text(rng, args.text_length)]
+    body += ["", "", "*" * 40, "", ""]
+    for i in range(args.answers):
+        body += [
+            f"{chr(65 + i)}. {random_text(rng, max(1, args.text_length // 3))}",
+            "",
+        ]
+    prompt = ["", "Select answer: "]
+
+    def timer(frame):
+        return ["*" * 40, "", f"Remaining time: {frame // 60 % 60:02}:{frame % 60:02}"]
+
+    def redraw_clear():
+        with devnull_output():
+            for frame in range(num_frames):
+                os.system("cls" if os.name == "nt" else "clear")
+                for line in body + timer(frame) + prompt:
+                    print(line)
+
+    def redraw_ansi(full, stream=None):
+        with devnull_output() as f:
+            screen = Screen(stream or f, ansi=True)
+            for frame in range(num_frames):
+                if full:
+                    screen.clear()
+                screen.draw(
+                    [("body", body), ("timer", timer(frame)), ("prompt", prompt)]
+                )
+
+    def frame_bytes(full):
+        stream = io.StringIO()
+        redraw_ansi(full, stream)
+        return len(stream.getvalue().encode("utf-8")) // num_frames
+
+    results = []
+    # A terminal large enough for the frame, so regions can be redrawn in place
+    with mock.patch.dict(os.environ, {"COLUMNS": "120", "LINES": "50"}):
+        # Bytes written per frame; for clear, without the child's escape sequence
+        text_bytes = len("\n".join(body + timer(0) + prompt).encode("utf-8")) + 1
+        for name, func, size in [
+            ("render[clear]", redraw_clear, lambda: text_bytes),
+            ("render[ansi,full]", lambda: redraw_ansi(True), lambda: frame_bytes(True)),
+            ("render[ansi]", lambda: redraw_ansi(False), lambda: frame_bytes(False)),
+        ]:
+            result = measure(name, num_frames, func)
+            result["fps"] = round(num_frames / max(result["wall_time"], 1e-9), 1)
+            result["bytes_per_frame"] = size()
+            results.append(result)
+    return results
+
+
+class FrameRecorder(io.StringIO):
+    """Screen stream that notes when a frame is written."""
+
+    def __init__(self):
+        super().__init__()
+        self.written = asyncio.Event()
+
+    def write(self, text):
+        self.written.set()
+        return len(text)
+
+
+def bench_session(workdir, num_keys, args):
+    """
+    Benchmark the latency of keystrokes in a test session while its timer ticks.
+    Keys are typed into a pseudo-terminal every 10 ms; the latency of a key is the
+    time until the session has drawn the frame showing it. The result's wall time
+    is the 99th percentile latency, so it can be compared with a baseline.
+    """
+    import pty
+
+    questions = [
+        {
+            "id": str(i),
+            "description": random_text(random.Random(i), args.text_length),
+            "answers": [
+                {"id": f"{i}.{j}", "value": f"Answer {j}", "correct": j == 0}
+                for j in range(args.answers)
+            ],
+        }
+        for i in range(args.test_size)
+    ]
+
+    async def type_keys(typed, journaled):
+        master, slave = pty.openpty()
+        with os.fdopen(slave, "r") as stream:
+            keys = KeyReader(stream)
+            output = FrameRecorder()
+            screen = Screen(output, ansi=True)
+            results = [{"question": q, "user_answer": []} for q in questions]
+            journal = None
+            if journaled:
+                exams_dir = os.path.join(workdir, "session_exams")
+                journal = AnswerJournal.start(exams_dir, results, 60, "70%")
+            # Long enough to outlast the keys, so the timer keeps ticking
+            session = asyncio.ensure_future(
+                run_session(results, 60, time.time(), keys, screen, journal)
+            )
+            latencies = []
+            try:
+                for i in range(num_keys):
+                    await asyncio.sleep(0.01)
+                    output.written.clear()
+                    start = time.perf_counter()
+                    os.write(master, typed[i % len(typed)])
+                    await output.written.wait()
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                session.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await session
+                os.close(master)
+                if journal is not None:
+                    journal.close()
+            return latencies
+
+    results = []
+    for name, typed, journaled in [
+        # Type and erase a letter, so no answer is submitted
+        ("session_keystroke", [b"A", b"\x7f"], False),
+        # Answer the first question and go back to it, journaling every answer
+        ("session_keystroke[journal]", [b"A", b"\n", *b"back", b"\n"], True),
+    ]:
+        typed = [bytes([key]) if isinstance(key, int) else key for key in typed]
+        with mock.patch.dict(os.environ, {"COLUMNS": "120", "LINES": "50"}):
+            latencies = sorted(asyncio.run(type_keys(typed, journaled)))
+
+        def percentile(p):
+            return round(latencies[int(p * (len(latencies) - 1))], 6)
+
+        result = {
+            "name": name,
+            "size": num_keys,
+            "wall_time": percentile(0.99),
+            "latency_p50": percentile(0.5),
+            "latency_p99": percentile(0.99),
+            "latency_max": round(latencies[-1], 6),
+        }
+        print(
+            f"{name:<40} {num_keys:>10} p50 {result['latency_p50'] * 1000:.3f} ms"
+            f" p99 {result['latency_p99'] * 1000:.3f} ms"
+            f" max {result['latency_max'] * 1000:.3f} ms",
+            file=sys.stderr,
+        )
+        results.append(result)
+    return results
+
+
+def bench_startup(workdir, runs):
+    """
+    Benchmark the cold start of the interactive app: the time from starting a new
+    process until the main menu asks for a choice. The result's wall time is the
+    median over the runs, so it can be compared with a baseline and the budget.
+    """
+    # Start the app the way the installed quiz command does, from compiled bytecode
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for run in range(runs + 1):
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "import sys; from quiz.cli import main; sys.exit(main())",
+            ],
+            cwd=workdir,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        output = b""
+        while b"Your choice" not in output:
+            chunk = process.stdout.read1(4096)
+            if not chunk:
+                sys.exit(f"The app exited before showing the menu: {output!r}")
+            output += chunk
+        elapsed = time.perf_counter() - start
+        process.communicate(b"5\n")
+        if run:  # The first run compiles the app
+            times.append(elapsed)
+    result = {
+        "name": "startup_to_menu",
+        "size": runs,
+        "wall_time": round(statistics.median(times), 6),
+        "max_time": round(max(times), 6),
+    }
+    print(
+        f"{'startup_to_menu':<40} {runs:>10} {result['wall_time'] * 1000:>12.2f} ms "
+        f"(max {result['max_time'] * 1000:.2f} ms)",
+        file=sys.stderr,
+    )
+    return result
+
+
+def compare(results, baseline_file, tolerance):
+    """
+    Compare wall times with a previous run.
+    :return: List of benchmarks that got slower than the tolerance allows.
+    """
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = {
+            (result["name"], result["size"]): result
+            for result in json.load(f)["results"]
+        }
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["name"], result["size"]))
+        if previous and result["wall_time"] > previous["wall_time"] * (1 + tolerance):
+            regressions.append(
+                f"{result['name']} [{result['size']}]: {previous['wall_time']:.4f}s -> "
+                f"{result['wall_time']:.4f}s"
+            )
+    return regressions
+
+
+def bench_import(workdir, num_questions, args):
+    """Benchmark importing a question file of the given size into an empty bank."""
+    source_file = os.path.join(workdir, f"import_{num_questions}.json")
+    generate_bank(source_file, num_questions, args.answers, args.text_length, args.seed)
+    data_file = os.path.join(workdir, "imported.json")
+    return [
+        measure(
+            f"import_questions[{workers} workers]",
+            num_questions,
+            lambda: import_questions(data_file, [source_file], workers=workers),
+            setup=lambda: remove_files(data_file),
+        )
+        for workers in sorted({1, os.cpu_count() or 1})
+    ]
+
+
+def parse_sizes(text):
+    return [int(size) for size in text.split(",") if size]
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the quiz application on synthetic question banks and histories."
+    )
+    parser.add_argument("--bank-sizes", type=parse_sizes, default=[1000, 10000, 100000])
+    parser.add_argument("--history-sizes", type=parse_sizes, default=[100, 1000, 10000])
+    parser.add_argument(
+        "--history-format", choices=["log", "files", "sqlite"], default="log"
+    )
+    parser.add_argument("--history-bank-size", type=int, default=2000)
+    parser.add_argument("--answers", type=int, default=4, help="Answers per question.")
+    parser.add_argument(
+        "--text-length", type=int, default=40, help="Words per description."
+    )
+    parser.add_argument("--test-size", type=int, default=20, help="Questions per test.")
+    parser.add_argument("--grading-exams", type=int, default=1000)
+    parser.add_argument(
+        "--model-sizes",
+        type=parse_sizes,
+        default=[10000, 200000],
+        help="Bank sizes for the compact model benchmark.",
+    )
+    parser.add_argument(
+        "--import-sizes",
+        type=parse_sizes,
+        default=[100000],
+        help="Source sizes for the question import benchmark.",
+    )
+    parser.add_argument(
+        "--review-sizes",
+        type=parse_sizes,
+        default=[100000],
+        help="Bank sizes for the review scheduling benchmark.",
+    )
+    parser.add_argument(
+        "--adaptive-sizes",
+        type=parse_sizes,
+        default=[200000],
+        help="Bank sizes for the adaptive test assembly benchmark.",
+    )
+    parser.add_argument(
+        "--adaptive-test-size",
+        type=int,
+        default=100,
+        help="Questions per adaptive test.",
+    )
+    parser.add_argument(
+        "--analysis-sizes",
+        type=parse_sizes,
+        default=[10000],
+        help="History sizes for the item analysis benchmark.",
+    )
+    parser.add_argument("--analysis-bank-size", type=int, default=20000)
+    parser.add_argument(
+        "--dedup-sizes",
+        type=parse_sizes,
+        default=[20000],
+        help="Bank sizes for the near-duplicate detection benchmark.",
+    )
+    parser.add_argument(
+        "--render-frames",
+        type=int,
+        default=200,
+        help="Question redraws in the rendering benchmark (0 to skip).",
+    )
+    parser.add_argument(
+        "--session-keys",
+        type=int,
+        default=500,
+        help="Keys typed in the session latency benchmark (0 to skip).",
+    )
+    parser.add_argument(
+        "--startup-runs",
+        type=int,
+        default=20,
+        help="Cold starts of the app to the main menu to time (0 to skip).",
+    )
+    parser.add_argument(
+        "--startup-budget",
+        type=float,
+        default=0.1,
+        help="Most seconds the median cold start to the main menu may take.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Keep the generated data in this directory.")
+    parser.add_argument(
+        "--output", help="Write the JSON report to this file instead of stdout."
+    )
+    parser.add_argument(
+        "--baseline", help="JSON report of a previous run to compare with."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown against the baseline (0.25 = 25%%).",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="quiz-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = []
+        for size in args.bank_sizes:
+            results.extend(bench_bank(workdir, size, args))
+        for size in args.history_sizes:
+            results.extend(bench_history(workdir, size, args))
+        for size in args.model_sizes:
+            results.extend(bench_model(workdir, size, args))
+        for size in args.import_sizes:
+            results.extend(bench_import(workdir, size, args))
+        for size in args.review_sizes:
+            results.extend(bench_reviews(workdir, size, args))
+        for size in args.adaptive_sizes:
+            results.extend(bench_adaptive(workdir, size, args))
+        # Item analysis needs NumPy
+        for size in args.analysis_sizes if np is not None else []:
+            results.extend(bench_analysis(workdir, size, args))
+        for size in args.dedup_sizes:
+            results.extend(bench_dedup(size, args))
+        if args.render_frames:
+            results.extend(bench_render(args.render_frames, args))
+        if args.startup_runs:
+            results.append(bench_startup(workdir, args.startup_runs))
+        # Pseudo-terminals are not available on Windows
+        if args.session_keys and os.name != "nt":
+            results.extend(bench_session(workdir, args.session_keys, args))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {
+                k: v for k, v in vars(args).items() if k not in ("output", "baseline")
+            },
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    failures = []
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        failures.extend(regressions)
+    for result in results:
+        if result["name"] == "startup_to_menu":
+            if result["wall_time"] > args.startup_budget:
+                failures.append(result["name"])
+                print(
+                    f"Over budget: starting to the menu took "
+                    f"{result['wall_time']:.3f}s, the budget is "
+                    f"{args.startup_budget:.3f}s",
+                    file=sys.stderr,
+                )
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
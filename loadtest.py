@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark import generate_bank
+from quiz.server import open_server_connection, receive_message, send_message
+
+
+async def candidate(number, connection, args, latencies, errors):
+    """Take one test like a candidate would, timing every request."""
+    rng = random.Random(args.seed * 100003 + number)
+    # Spread the candidates' arrival over the ramp-up time
+    await asyncio.sleep(rng.uniform(0, args.ramp_up))
+    reader, writer = await open_server_connection(**connection)
+    try:
+
+        async def request(message):
+            start = time.perf_counter()
+            await send_message(writer, message)
+            response = await receive_message(reader)
+            latencies[message["op"]].append(time.perf_counter() - start)
+            if response is None or not response["ok"]:
+                errors.append(response and response["error"])
+            return response
+
+        response = await request(
+            {
+                "op": "start",
+                "questions": args.questions,
+                "time_limit": args.time_limit,
+                "pass_condition": "70%",
+            }
+        )
+        if response is None or not response["ok"]:
+            return
+        for index, question in enumerate(response["questions"]):
+            await asyncio.sleep(rng.expovariate(1 / args.think_time))
+            answer = [rng.choice(question["answers"])["id"]]
+            await request({"op": "answer", "index": index, "answer": answer})
+        await request({"op": "submit"})
+    finally:
+        writer.close()
+
+
+def summarize(latencies):
+    """Count, percentiles and maximum of latencies, in milliseconds."""
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"count": 0}
+
+    def percentile(p):
+        return round(latencies[int(p * (len(latencies) - 1))] * 1000, 3)
+
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+async def run_candidates(connection, args):
+    latencies = {"start": [], "answer": [], "submit": []}
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            candidate(number, connection, args, latencies, errors)
+            for number in range(args.candidates)
+        )
+    )
+    duration = time.perf_counter() - start
+    return {
+        "duration": round(duration, 3),
+        "answers_per_second": round(len(latencies["answer"]) / duration, 1),
+        "errors": len(errors),
+        "latency": {op: summarize(values) for op, values in latencies.items()},
+    }
+
+
+def start_server(workdir, args):
+    """Start a quiz server on a synthetic bank, and wait until it accepts tests."""
+    data_file = os.path.join(workdir, "data.json")
+    generate_bank(data_file, args.bank_size, seed=args.seed)
+    socket_path = os.path.join(workdir, "quiz.sock")
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"),
+            "serve",
+            "--data-file",
+            data_file,
+            "--exams-dir",
+            os.path.join(workdir, "exams"),
+            "--socket",
+            socket_path,
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    # The server prints a line once it is listening
+    if not server.stdout.readline():
+        sys.exit("The quiz server did not start.")
+    return server, {"socket_path": socket_path}
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Load test the quiz server with many simulated candidates."
+    )
+    parser.add_argument("--candidates", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=20, help="Per test.")
+    parser.add_argument("--time-limit", type=int, default=30, help="Minutes.")
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.2,
+        help="Mean seconds a candidate takes per answer.",
+    )
+    parser.add_argument(
+        "--ramp-up",
+        type=float,
+        default=2.0,
+        help="Seconds over which the candidates arrive.",
+    )
+    parser.add_argument("--bank-size", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", help="Test a running server instead of starting one.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="Test a running server on a Unix socket.")
+    parser.add_argument("--workdir", help="Keep the generated data in this directory.")
+    parser.add_argument(
+        "--output", help="Write the JSON report to this file instead of stdout."
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="quiz-load-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        if args.socket:
+            connection = {"socket_path": args.socket}
+        elif args.host:
+            connection = {"host": args.host, "port": args.port}
+        else:
+            server, connection = start_server(workdir, args)
+        results = asyncio.run(run_candidates(connection, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""
+Terminal quiz application.
+
+Modules are imported by what they are used for, e.g. ``quiz.bank`` for the
+question bank, ``quiz.history`` for the test history and ``quiz.cli`` for the
+command line. Importing the package does not start the menu.
+"""
@@ -0,0 +1,5 @@
+"""Run the quiz with ``python -m quiz``."""
+
+from .cli import main
+
+main()
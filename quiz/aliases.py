@@ -0,0 +1,44 @@
+"""Links between changed questions and their older versions."""
+
+import json
+import os
+
+from .constants import ALIASES_FILE
+
+# Links from old to new question ids keyed by aliases file, with the file's mtime
+_question_aliases = {}
+
+
+def load_question_aliases(exams_dir):
+    """
+    Load the links from old question ids to the ids of their new versions.
+    Chains of links are followed to the newest id.
+    :param exams_dir: Directory containing completed tests.
+    :return: Dict of old question id -> newest question id.
+    """
+    mtime_ns = question_aliases_version(exams_dir)
+    if mtime_ns is None:
+        return {}
+    aliases_path = os.path.join(exams_dir, ALIASES_FILE)
+    cached = _question_aliases.get(aliases_path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    with open(aliases_path, "r", encoding="utf-8") as f:
+        links = json.load(f)
+    aliases = {}
+    for old_id in links:
+        new_id, seen = links[old_id], {old_id}
+        while new_id in links and new_id not in seen:
+            seen.add(new_id)
+            new_id = links[new_id]
+        aliases[old_id] = new_id
+    _question_aliases[aliases_path] = (mtime_ns, aliases)
+    return aliases
+
+
+def question_aliases_version(exams_dir):
+    """Value that changes whenever the question aliases change, None without any."""
+    try:
+        return os.stat(os.path.join(exams_dir, ALIASES_FILE)).st_mtime_ns
+    except OSError:
+        return None
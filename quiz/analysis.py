@@ -0,0 +1,496 @@
+"""Per-question statistics, CSV export and item analysis."""
+
+import json
+import array
+import contextlib
+from collections import OrderedDict
+
+from .aliases import load_question_aliases
+from .constants import (
+    ANALYSIS_BATCH_KEYS,
+    ANALYSIS_BATCH_TESTS,
+    IRT_DISCRIMINATION_RANGE,
+    IRT_ITERATIONS,
+    IRT_TOLERANCE,
+    SCAN_CACHE_SIZE,
+    STATISTICS_BATCH_SIZE,
+)
+from .database import open_database
+from .deps import csv, np
+from .grading import answer_bits
+from .history import load_stats_index, scan_history
+from .instrument import timed
+from .model import canonical_question, question_key, selected_positions
+from .storage import (
+    add_to_question_store,
+    get_done_tests,
+    load_exam,
+    load_stored_questions,
+    read_history_log,
+)
+
+
+def get_low_accuracy_questions(exams_dir, threshold):
+    """
+    Get a list of questions with a correct answer rate below the threshold.
+    :param exams_dir: Directory containing completed tests.
+    :param threshold: Correct answer rate threshold (0 - 100).
+    :return: List of questions.
+    """
+    keys = get_low_accuracy_question_keys(exams_dir, threshold)
+    return load_stored_questions(exams_dir, keys)
+
+
+def get_low_accuracy_question_keys(exams_dir, threshold):
+    """
+    Get the store keys of questions with a correct answer rate below the threshold.
+    Only the statistics index is read; no question is decoded.
+    :param exams_dir: Directory containing completed tests.
+    :param threshold: Correct answer rate threshold (0 - 100).
+    :return: List of question store keys.
+    """
+    database = open_database(exams_dir)
+    if database is not None:
+        return database.low_accuracy_keys(threshold)
+    index = load_stats_index(exams_dir)
+
+    # Filter questions with a correct answer rate below the threshold
+    low_accuracy_keys = []
+    for stats in index["questions"].values():
+        attempts = stats["attempts"]
+        correct_count = stats["correct_count"]
+        accuracy = (correct_count / attempts) * 100 if attempts > 0 else 0
+        if accuracy < threshold:
+            low_accuracy_keys.append(stats["key"])
+
+    return low_accuracy_keys
+
+
+def format_question_for_csv(question):
+    """Render a question, its answers and the correct answers as one CSV cell."""
+    question_desc = question["description"]
+    answers = question["answers"]
+
+    # Create answer string A, B, C, D
+    answer_str = "\n".join(
+        f"{chr(65 + i)}. {ans['value']}" for i, ans in enumerate(answers)
+    )
+
+    correct_answers = [
+        f"\n{chr(65 + i)}. {ans['value']}"
+        for i, ans in enumerate(answers)
+        if ans["correct"]
+    ]
+    correct_answers_str = "Correct answers: " + ", ".join(correct_answers)
+    return f"{question_desc}\n{answer_str}\n\n{correct_answers_str}"
+
+
+@timed("statistics_export")
+def save_statistics_to_csv(
+    exams_dir="exams", output_file="statistics.csv", layout="wide"
+):
+    """
+    Export the result of every attempt at every question to a CSV file.
+    Rows are written as they are produced, so memory use does not grow with
+    the size of the history.
+    :param exams_dir: Directory containing completed tests.
+    :param output_file: CSV file to write.
+    :param layout: "wide" for one row per question with a column per attempt,
+        "long" for one row per question and attempt.
+    """
+    with open(output_file, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        if layout == "long":
+            write_long_statistics(writer, exams_dir)
+        else:
+            write_wide_statistics(writer, exams_dir)
+
+    print(f"\nStatistics exported to file: {output_file}")
+
+
+def write_wide_statistics(writer, exams_dir):
+    """Write one row per question, with the outcome of each attempt in order."""
+    database = open_database(exams_dir)
+    if database is not None:
+        max_attempts = database.max_attempts()
+        question_results = database.question_results()
+    else:
+        index = load_stats_index(exams_dir)
+        max_attempts = max(
+            (stats["attempts"] for stats in index["questions"].values()), default=0
+        )
+        question_results = (
+            (load_stored_questions(exams_dir, [stats["key"]])[0], stats["results"])
+            for stats in index["questions"].values()
+        )
+
+    # Create headers for the CSV file; the attempt counts give the width up front
+    headers = ["Question"]
+    headers.extend([f"Attempt {i+1}" for i in range(max_attempts)])
+    writer.writerow(headers)
+
+    # Decode and render one question at a time
+    for question, results in question_results:
+        row = [format_question_for_csv(question)]
+        row.extend("Correct" if outcome == "1" else "Incorrect" for outcome in results)
+        row.extend([""] * (max_attempts - len(results)))
+        writer.writerow(row)
+
+
+def write_long_statistics(writer, exams_dir):
+    """Write one row per question and attempt, in a single pass over the history."""
+    writer.writerow(
+        ["Question ID", "Question", "Attempt", "Test", "Timestamp", "Result"]
+    )
+    database = open_database(exams_dir)
+    attempts = {}
+    rendered = OrderedDict()  # Recently rendered questions, keyed by store key
+    for question_id, key, name, timestamp, is_correct in (
+        database.responses() if database is not None else scan_responses(exams_dir)
+    ):
+        attempts[question_id] = attempts.get(question_id, 0) + 1
+        if key in rendered:
+            rendered.move_to_end(key)
+        else:
+            question = load_stored_questions(exams_dir, [key])[0]
+            rendered[key] = format_question_for_csv(question)
+            if len(rendered) > SCAN_CACHE_SIZE:
+                rendered.popitem(last=False)
+        writer.writerow(
+            [
+                question_id,
+                rendered[key],
+                attempts[question_id],
+                name,
+                timestamp,
+                "Correct" if is_correct else "Incorrect",
+            ]
+        )
+
+
+def scan_responses(exams_dir):
+    """
+    Scan the test history in batches, oldest test first.
+    :param exams_dir: Directory containing completed tests.
+    :return: Iterator of (question id, store key, test name, timestamp, correct)
+        per answered question.
+    """
+    done_tests = get_done_tests(exams_dir, order="oldest")
+    for start in range(0, len(done_tests), STATISTICS_BATCH_SIZE):
+        for scanned in scan_history(done_tests[start : start + STATISTICS_BATCH_SIZE]):
+            if scanned["questions"]:
+                add_to_question_store(exams_dir, scanned["questions"])
+            name, timestamp = scanned["name"], scanned["timestamp"]
+            for question_id, key, is_correct in scanned["results"]:
+                yield question_id, key, name, timestamp, is_correct
+
+
+def iter_answer_sheets(exams_dir):
+    """
+    Read the selected answers of every completed test, without grading them.
+    Each file of the exam log is read once, from start to end.
+    :param exams_dir: Directory containing completed tests.
+    :return: Iterator of one list per test of (question store key, positions of
+        the selected answers in the stored question).
+    """
+    database = open_database(exams_dir)
+    if database is not None:
+        yield from database.answer_sheets()
+        return
+    exam_files = []
+    offsets = {}
+    for exam_path in get_done_tests(exams_dir, order="oldest"):
+        log_path, _, name = exam_path.rpartition("#")
+        if log_path:
+            offsets.setdefault(log_path, set()).add(read_history_log(log_path)[name][0])
+        else:
+            exam_files.append(exam_path)
+    if exam_files:
+        # Indexing the statistics adds the questions of these tests to the store
+        load_stats_index(exams_dir)
+    for exam_path in exam_files:
+        sheet = []
+        for result in load_exam(exam_path)["questions"]:
+            question = canonical_question(result["question"])
+            answer_ids = [ans["id"] for ans in question["answers"]]
+            positions = selected_positions(answer_ids, result["user_answer"])
+            sheet.append((question_key(question), positions))
+        yield sheet
+    for log_path, wanted in offsets.items():
+        with open(log_path, "rb") as f:
+            lines = []
+            offset = 0
+            for line in f:
+                if offset in wanted:
+                    lines.append(line)
+                    if len(lines) == ANALYSIS_BATCH_TESTS:
+                        yield from decode_sheets(lines)
+                        lines = []
+                offset += len(line)
+            yield from decode_sheets(lines)
+
+
+def decode_sheets(lines):
+    """Answers of exam log records, decoded as one JSON array for speed."""
+    records = json.loads(b"[" + b",".join(lines) + b"]")
+    return [record["questions"] for record in records]
+
+
+def response_matrix(exams_dir):
+    """
+    Sparse test x question matrix of the answers in the test history, in
+    coordinate form with one entry per answered question. Columns are question
+    store keys, so each version of a question has its own.
+    :param exams_dir: Directory containing completed tests.
+    :return: Dict with "tests", the number of rows, "keys", the store key of each
+        column, and NumPy arrays of the entries' "rows" and "columns" (int32) and
+        "selected" answers (uint64 bitmask of their positions).
+    """
+    columns = {}
+    rows = array.array("i")
+    entry_columns = array.array("i")
+    selected = array.array("Q")
+    tests = 0
+    for row, sheet in enumerate(iter_answer_sheets(exams_dir)):
+        tests = row + 1
+        for key, positions in sheet:
+            mask = 0
+            for i in positions:
+                mask |= 1 << i
+            rows.append(row)
+            entry_columns.append(columns.setdefault(key, len(columns)))
+            selected.append(mask)
+    return {
+        "tests": tests,
+        "keys": list(columns),
+        "rows": np.frombuffer(rows, dtype=np.int32),
+        "columns": np.frombuffer(entry_columns, dtype=np.int32),
+        "selected": np.frombuffer(selected, dtype=np.uint64),
+    }
+
+
+def fit_irt(rows, items, correct, num_rows, num_items, model, iterations):
+    """
+    Fit a 1PL (Rasch) or 2PL IRT model to sparse responses by joint maximum a
+    posteriori estimation: alternating Newton steps for the abilities, the
+    difficulties and, for 2PL, the discriminations, each aggregated over the
+    responses with bincount. Standard normal priors keep the estimates finite for
+    tests and questions answered all right or all wrong.
+    :param rows: Test of each response.
+    :param items: Question of each response.
+    :param correct: Whether each response is correct.
+    :param model: "1pl" or "2pl".
+    :param iterations: Most rounds of updates; fitting stops earlier once no
+        estimate moves by more than IRT_TOLERANCE.
+    :return: Tuple of (difficulties, discriminations) per question.
+    """
+    x = correct.astype(np.float64)
+    ability = np.zeros(num_rows)
+    difficulty = np.zeros(num_items)
+    discrimination = np.ones(num_items)
+
+    def residuals():
+        distance = ability[rows] - difficulty[items]
+        p = 1 / (1 + np.exp(-discrimination[items] * distance))
+        return distance, x - p, p * (1 - p)
+
+    for _ in range(iterations):
+        _, residual, information = residuals()
+        a = discrimination[items]
+        step = (np.bincount(rows, a * residual, num_rows) - ability) / (
+            np.bincount(rows, a * a * information, num_rows) + 1
+        )
+        ability += step
+        change = np.abs(step).max()
+
+        _, residual, information = residuals()
+        step = (-np.bincount(items, a * residual, num_items) - difficulty) / (
+            np.bincount(items, a * a * information, num_items) + 1
+        )
+        difficulty += step
+        change = max(change, np.abs(step).max())
+
+        if model == "2pl":
+            distance, residual, information = residuals()
+            step = (
+                np.bincount(items, residual * distance, num_items)
+                - (discrimination - 1)
+            ) / (np.bincount(items, information * distance * distance, num_items) + 1)
+            discrimination = np.clip(discrimination + step, *IRT_DISCRIMINATION_RANGE)
+            change = max(change, np.abs(step).max())
+        if change < IRT_TOLERANCE:
+            break
+    return difficulty, discrimination
+
+
+@timed("item_analysis")
+def item_analysis(exams_dir, irt=None, iterations=IRT_ITERATIONS):
+    """
+    Analyse how the questions of the test history perform, with NumPy.
+    Answers to old question ids linked to new ones are counted under the new id.
+    :param exams_dir: Directory containing completed tests.
+    :param irt: None, or "1pl" or "2pl" to also fit an IRT model.
+    :param iterations: Most rounds of IRT updates.
+    :return: Iterator of dicts, one per question id in the order of first attempts,
+        with "question_id", "attempts", "difficulty" (proportion answered
+        correctly), "discrimination" (point-biserial correlation of answering it
+        correctly with the rest of the test's score; None if undefined), with
+        irt "irt_difficulty" and for 2PL "irt_discrimination", and "answers": per
+        id, whether it is "correct", how often it was "offered" and "selected",
+        and the selection "rate".
+    """
+    matrix = response_matrix(exams_dir)
+    rows, columns, selected = matrix["rows"], matrix["columns"], matrix["selected"]
+    keys = matrix["keys"]
+    if not len(rows):
+        return iter([])
+
+    # How often each answer position of each question version was selected
+    offered = np.bincount(columns, minlength=len(keys))
+    width = int(selected.max()).bit_length()
+    selections = np.empty((len(keys), width))
+    for bit in range(width):
+        selections[:, bit] = np.bincount(
+            columns,
+            weights=(selected >> np.uint64(bit)) & np.uint64(1),
+            minlength=len(keys),
+        )
+
+    # Decode each version once, folding its answers into its question's
+    aliases = load_question_aliases(exams_dir)
+    question_ids = {}
+    answers = []
+    key_items = np.empty(len(keys), dtype=np.int32)
+    key_masks = np.empty(len(keys), dtype=np.uint64)
+    for start in range(0, len(keys), ANALYSIS_BATCH_KEYS):
+        batch = keys[start : start + ANALYSIS_BATCH_KEYS]
+        for column, question in enumerate(
+            load_stored_questions(exams_dir, batch), start
+        ):
+            bits, correct_mask = answer_bits(question)
+            question_id = aliases.get(question["id"], question["id"])
+            item = question_ids.setdefault(question_id, len(question_ids))
+            if item == len(answers):
+                answers.append({})
+            key_items[column] = item
+            key_masks[column] = correct_mask
+            for answer_id, bit in bits.items():
+                position = bit.bit_length() - 1
+                counts = answers[item].setdefault(answer_id, [False, 0, 0])
+                # Versions are numbered by first attempt, so the newest decides
+                counts[0] = bool(correct_mask & bit)
+                counts[1] += int(offered[column])
+                if position < width:
+                    counts[2] += int(selections[column, position])
+
+    items = key_items[columns]
+    correct = selected == key_masks[columns]
+    num_items = len(question_ids)
+    attempts = np.bincount(items, minlength=num_items)
+    difficulty = np.bincount(items, correct, num_items) / attempts
+
+    # Point-biserial against the rest score: the test's proportion correct
+    # without the response itself, so the item does not correlate with itself
+    test_scores = np.bincount(rows, correct, matrix["tests"])
+    test_sizes = np.bincount(rows, minlength=matrix["tests"])
+    others = test_sizes[rows] - 1
+    valid = others > 0
+    x = correct[valid].astype(np.float64)
+    y = (test_scores[rows][valid] - x) / others[valid]
+    valid_items = items[valid]
+
+    def total(values):
+        return np.bincount(valid_items, values, num_items)
+
+    n = total(np.ones_like(x))
+    covariance = n * total(x * y) - total(x) * total(y)
+    variances = (n * total(x * x) - total(x) ** 2) * (n * total(y * y) - total(y) ** 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        discrimination = covariance / np.sqrt(variances)
+    discrimination[~(variances > 1e-12)] = np.nan
+
+    if irt is not None:
+        irt_difficulty, irt_discrimination = fit_irt(
+            rows, items, correct, matrix["tests"], num_items, irt, iterations
+        )
+
+    # Items are built as they are written, so they are never all in memory
+    def results():
+        for item, question_id in enumerate(question_ids):
+            result = {
+                "question_id": question_id,
+                "attempts": int(attempts[item]),
+                "difficulty": float(difficulty[item]),
+                "discrimination": (
+                    None
+                    if np.isnan(discrimination[item])
+                    else float(discrimination[item])
+                ),
+            }
+            if irt is not None:
+                result["irt_difficulty"] = float(irt_difficulty[item])
+            if irt == "2pl":
+                result["irt_discrimination"] = float(irt_discrimination[item])
+            result["answers"] = [
+                {
+                    "id": answer_id,
+                    "correct": is_correct,
+                    "offered": times_offered,
+                    "selected": times_selected,
+                    "rate": times_selected / times_offered,
+                }
+                for answer_id, (
+                    is_correct,
+                    times_offered,
+                    times_selected,
+                ) in answers[item].items()
+            ]
+            answers[item] = None
+            yield result
+
+    return results()
+
+
+def save_item_analysis(items, output_file, answers_file=None):
+    """
+    Export an item analysis as JSON, or as CSV with one row per question.
+    Items are written as they come, so they need not all be in memory at once.
+    :param items: Item analysis, as returned by item_analysis.
+    :param output_file: File to write; JSON if it ends in .json, CSV otherwise.
+    :param answers_file: CSV file for one row per answer of each question.
+    :return: Number of questions written.
+    """
+    count = 0
+    with contextlib.ExitStack() as stack:
+        f = stack.enter_context(
+            open(output_file, mode="w", newline="", encoding="utf-8")
+        )
+        if answers_file:
+            answers_writer = csv.writer(
+                stack.enter_context(
+                    open(answers_file, mode="w", newline="", encoding="utf-8")
+                )
+            )
+            answers_writer.writerow(
+                ["question_id", "answer_id", "correct", "offered", "selected", "rate"]
+            )
+        if output_file.endswith(".json"):
+            f.write("[")
+        else:
+            writer = csv.writer(f)
+        for item in items:
+            if output_file.endswith(".json"):
+                f.write(",\n" if count else "\n")
+                f.write(json.dumps(item, ensure_ascii=False))
+            else:
+                columns = [column for column in item if column != "answers"]
+                if not count:
+                    writer.writerow(columns)
+                writer.writerow(item[column] for column in columns)
+            if answers_file:
+                for answer in item["answers"]:
+                    answers_writer.writerow([item["question_id"], *answer.values()])
+            count += 1
+        if output_file.endswith(".json"):
+            f.write("\n]\n")
+    return count
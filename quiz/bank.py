@@ -0,0 +1,461 @@
+"""Loading, sampling and compiling the question bank."""
+
+import json
+import os
+import random
+import marshal
+import gc
+import mmap
+import struct
+
+from .constants import (
+    BANK_CACHE_SUFFIX,
+    BANK_CACHE_VERSION,
+    BANK_FILE_SUFFIX,
+    BANK_INDEX_HEADER,
+    BANK_INDEX_MAGIC,
+    BANK_INDEX_POSITION,
+    BANK_INDEX_RECORD,
+    BANK_INDEX_SUFFIX,
+    STREAMING_BANK_SIZE,
+    STREAM_CHUNK_SIZE,
+)
+from .deps import hashlib
+from .instrument import timed
+from .model import md5_hash
+
+
+def compile_questions(raw_data):
+    """Parse the question bank and calculate hash IDs."""
+    questions = json.loads(raw_data)
+    for question in questions:
+        question["id"] = md5_hash(question["description"])
+        for answer in question["answers"]:
+            answer["id"] = md5_hash(answer["value"])
+    return questions
+
+
+def write_bank_cache(cache_file, key, questions):
+    """Write the compiled question bank atomically."""
+    key_data = marshal.dumps(key)
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(len(key_data).to_bytes(4, "little"))
+        f.write(key_data)
+        f.write(marshal.dumps(questions))
+    os.replace(tmp_file, cache_file)
+
+
+def read_bank_cache(cache_file, key_only=False):
+    """Read the cache key and, unless key_only is set, the compiled bank."""
+    with open(cache_file, "rb") as f:
+        key = marshal.loads(f.read(int.from_bytes(f.read(4), "little")))
+        if key_only:
+            return key, None
+        data = f.read()
+    # Unmarshalling builds millions of containers; skip GC passes meanwhile
+    gc.disable()
+    try:
+        return key, marshal.loads(data)
+    finally:
+        gc.enable()
+
+
+@timed("bank_load")
+def load_questions(data_file):
+    """
+    Load questions from JSON file and calculate hash ID.
+    The compiled questions are cached next to the data file, keyed by its
+    size, modification time and MD5 digest, and recompiled when it changes.
+    """
+    cache_file = data_file + BANK_CACHE_SUFFIX
+    stat = os.stat(data_file)
+    try:
+        key, _ = read_bank_cache(cache_file, key_only=True)
+        if key.get("version") != BANK_CACHE_VERSION:
+            key = None
+    except (OSError, EOFError, ValueError, TypeError, AttributeError):
+        key = None
+    if key and key["size"] == stat.st_size and key["mtime_ns"] == stat.st_mtime_ns:
+        try:
+            return read_bank_cache(cache_file)[1]
+        except (OSError, EOFError, ValueError, TypeError):
+            key = None
+
+    with open(data_file, "rb") as f:
+        raw_data = f.read()
+    new_key = {
+        "version": BANK_CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "digest": hashlib.md5(raw_data).hexdigest(),
+    }
+
+    questions = None
+    if key and key["digest"] == new_key["digest"]:
+        # Only the timestamp changed: reuse the compiled bank under the new key
+        try:
+            questions = read_bank_cache(cache_file)[1]
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    if questions is None:
+        questions = compile_questions(raw_data)
+    try:
+        write_bank_cache(cache_file, new_key, questions)
+    except OSError:
+        pass  # A read-only bank directory just means no cache
+    return questions
+
+
+def iter_questions(data_file, with_answer_ids=True):
+    """
+    Parse the question bank incrementally, one question at a time.
+    :param data_file: JSON file containing an array of questions.
+    :param with_answer_ids: Also calculate the hash IDs of the answers.
+    :return: Generator of questions with hash IDs.
+    """
+    for question in iter_json_array(data_file):
+        question["id"] = md5_hash(question["description"])
+        if with_answer_ids:
+            for answer in question["answers"]:
+                answer["id"] = md5_hash(answer["value"])
+        yield question
+
+
+def iter_json_array(path):
+    """
+    Parse a JSON array incrementally, one element at a time.
+    :param path: JSON file containing an array.
+    :return: Generator of the elements.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(STREAM_CHUNK_SIZE).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} does not contain a JSON array")
+        pos = 1
+        eof = False
+        while True:
+            # Skip whitespace and the separator between elements
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                buffer, pos = f.read(STREAM_CHUNK_SIZE), 0
+                eof = not buffer
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element is split across chunks, read more of the file
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    raise
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            pos = end
+            yield element
+
+
+@timed("bank_stream")
+def sample_questions(data_file, num_questions, exclude=()):
+    """
+    Randomly select questions while streaming the bank, using reservoir sampling.
+    Memory use depends on num_questions only, not on the size of the bank.
+    :param data_file: JSON file containing an array of questions.
+    :param num_questions: Number of questions to select.
+    :param exclude: Question ids to skip.
+    :return: Tuple of (selected questions in random order, number of candidates).
+    """
+    reservoir = []
+    candidates = 0
+    for question in iter_questions(data_file, with_answer_ids=False):
+        if question["id"] in exclude:
+            continue
+        if len(reservoir) < num_questions:
+            reservoir.append(question)
+        else:
+            # Keep each candidate with probability num_questions / candidates
+            slot = random.randrange(candidates + 1)
+            if slot < num_questions:
+                reservoir[slot] = question
+        candidates += 1
+
+    # The reservoir order is not uniform; shuffle it as random.sample would
+    random.shuffle(reservoir)
+    for question in reservoir:
+        for answer in question["answers"]:
+            answer["id"] = md5_hash(answer["value"])
+    return reservoir, candidates
+
+
+def file_md5(path):
+    """MD5 digest of a file, read in chunks."""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def build_bank(data_file):
+    """
+    Compile the question bank into a bank file and an offset index.
+    The bank file holds one compact JSON question (with hash IDs) after another;
+    the index maps each question to its byte offset and length in that file.
+    :param data_file: JSON file containing an array of questions.
+    :return: Number of questions.
+    """
+    stat = os.stat(data_file)
+    digest = file_md5(data_file)
+    bank_file = data_file + BANK_FILE_SUFFIX
+    index_file = data_file + BANK_INDEX_SUFFIX
+
+    records = bytearray()
+    offset = 0
+    with open(f"{bank_file}.tmp", "wb") as f:
+        for question in iter_questions(data_file):
+            data = json.dumps(
+                question, ensure_ascii=False, separators=(",", ":")
+            ).encode("utf-8")
+            f.write(data)
+            records += BANK_INDEX_RECORD.pack(
+                bytes.fromhex(question["id"]), offset, len(data)
+            )
+            offset += len(data)
+    count = len(records) // BANK_INDEX_RECORD.size
+
+    # Positions sorted by question id, for binary search by id
+    record_ids = [
+        records[i * BANK_INDEX_RECORD.size : i * BANK_INDEX_RECORD.size + 16]
+        for i in range(count)
+    ]
+    by_id = sorted(range(count), key=record_ids.__getitem__)
+    del record_ids
+
+    with open(f"{index_file}.tmp", "wb") as f:
+        f.write(
+            BANK_INDEX_HEADER.pack(
+                BANK_INDEX_MAGIC, count, stat.st_size, stat.st_mtime_ns, digest
+            )
+        )
+        f.write(records)
+        f.write(b"".join(BANK_INDEX_POSITION.pack(position) for position in by_id))
+    os.replace(f"{bank_file}.tmp", bank_file)
+    os.replace(f"{index_file}.tmp", index_file)
+    return count
+
+
+class MappedBank:
+    """
+    Memory-mapped view of a bank built by build_bank.
+    Questions are decoded only when they are accessed.
+    """
+
+    def __init__(self, data_file):
+        self._files = []
+        self._maps = []
+        self.index = self._map(data_file + BANK_INDEX_SUFFIX)
+        self.bank = self._map(data_file + BANK_FILE_SUFFIX)
+        (
+            magic,
+            self.count,
+            self.source_size,
+            self.source_mtime_ns,
+            self.source_digest,
+        ) = BANK_INDEX_HEADER.unpack_from(self.index, 0)
+        if magic != BANK_INDEX_MAGIC:
+            self.close()
+            raise ValueError(f"{data_file}{BANK_INDEX_SUFFIX} is not a bank index")
+        self._records_start = BANK_INDEX_HEADER.size
+        self._positions_start = (
+            self._records_start + self.count * BANK_INDEX_RECORD.size
+        )
+
+    def _map(self, path):
+        f = open(path, "rb")
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""  # Empty files cannot be mapped
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for mapped in self._maps:
+            mapped.close()
+        for f in self._files:
+            f.close()
+        self._maps = []
+        self._files = []
+
+    def _record(self, position):
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        return BANK_INDEX_RECORD.unpack_from(
+            self.index, self._records_start + position * BANK_INDEX_RECORD.size
+        )
+
+    def question_id(self, position):
+        """Id of the question at a position, without decoding it."""
+        return self._record(position)[0].hex()
+
+    def question(self, position):
+        """Decode the question at a position."""
+        _, offset, length = self._record(position)
+        return json.loads(self.bank[offset : offset + length])
+
+    def find(self, question_id):
+        """Position of the question with the given id, or None."""
+        target = bytes.fromhex(question_id)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            position = BANK_INDEX_POSITION.unpack_from(
+                self.index, self._positions_start + middle * BANK_INDEX_POSITION.size
+            )[0]
+            record_id = self._record(position)[0]
+            if record_id == target:
+                return position
+            if record_id < target:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def question_ids(self):
+        """Ids of all questions in bank order, without decoding them."""
+        return [
+            record_id.hex()
+            for record_id, _, _ in BANK_INDEX_RECORD.iter_unpack(
+                self.index[self._records_start : self._positions_start]
+            )
+        ]
+
+    def positions(self, exclude=()):
+        """Positions of all questions whose id is not in exclude."""
+        if not exclude:
+            return list(range(self.count))
+        exclude = {bytes.fromhex(question_id) for question_id in exclude}
+        return [
+            position
+            for position, (record_id, _, _) in enumerate(
+                BANK_INDEX_RECORD.iter_unpack(
+                    self.index[self._records_start : self._positions_start]
+                )
+            )
+            if record_id not in exclude
+        ]
+
+    def is_current(self, data_file):
+        """Whether the bank was built from the current version of data_file."""
+        stat = os.stat(data_file)
+        return (
+            stat.st_size == self.source_size
+            and stat.st_mtime_ns == self.source_mtime_ns
+        )
+
+
+@timed("bank_load")
+def open_bank(data_file):
+    """
+    Open the memory-mapped bank for a question file, if one has been built.
+    A bank built from an older version of the file is rebuilt first.
+    :param data_file: JSON file containing an array of questions.
+    :return: MappedBank, or None when no bank has been built.
+    """
+    if not os.path.exists(data_file + BANK_INDEX_SUFFIX):
+        return None
+    try:
+        bank = MappedBank(data_file)
+    except (OSError, ValueError, struct.error):
+        bank = None
+    if bank is not None and bank.is_current(data_file):
+        return bank
+    if bank is not None:
+        bank.close()
+    build_bank(data_file)
+    return MappedBank(data_file)
+
+
+def verify_bank(data_file):
+    """
+    Check that the bank and its index match the question file.
+    :param data_file: JSON file containing an array of questions.
+    :return: List of problems found; empty if the bank is valid.
+    """
+    try:
+        bank = MappedBank(data_file)
+    except (OSError, ValueError, struct.error) as e:
+        return [f"Cannot open bank: {e}"]
+    problems = []
+    with bank:
+        if not bank.is_current(data_file) or bank.source_digest != file_md5(data_file):
+            problems.append(f"Bank was built from a different version of {data_file}")
+        count = 0
+        for position, question in enumerate(iter_questions(data_file)):
+            count += 1
+            if position >= len(bank):
+                continue
+            try:
+                stored = bank.question(position)
+            except ValueError:
+                problems.append(f"Question {position + 1} cannot be decoded")
+                continue
+            if stored != question or bank.question_id(position) != question["id"]:
+                problems.append(f"Question {position + 1} does not match {data_file}")
+            elif bank.find(question["id"]) is None:
+                problems.append(f"Question {position + 1} is missing from the id index")
+        if count != len(bank):
+            problems.append(f"Bank has {len(bank)} questions, {data_file} has {count}")
+    return problems
+
+
+def load_questions_at(data_file, positions):
+    """
+    Load the questions at the given positions of the bank, in the given order.
+    Only those questions are decoded when the bank is compiled or streamed.
+    """
+    bank = open_bank(data_file)
+    if bank is not None:
+        with bank:
+            return [bank.question(position) for position in positions]
+    if os.path.getsize(data_file) > STREAMING_BANK_SIZE:
+        wanted = set(positions)
+        found = {
+            position: question
+            for position, question in enumerate(iter_questions(data_file))
+            if position in wanted
+        }
+        return [found[position] for position in positions]
+    questions = load_questions(data_file)
+    return [questions[position] for position in positions]
+
+
+def load_question_ids(data_file):
+    """
+    Ids of the questions of the bank, in bank order. They are read from the
+    compiled bank or the load_questions cache when there is one, so no question
+    is decoded again.
+    """
+    bank = open_bank(data_file)
+    if bank is not None:
+        with bank:
+            return bank.question_ids()
+    if os.path.getsize(data_file) > STREAMING_BANK_SIZE:
+        return [
+            question["id"]
+            for question in iter_questions(data_file, with_answer_ids=False)
+        ]
+    return [question["id"] for question in load_questions(data_file)]
@@ -0,0 +1,663 @@
+"""Command-line interface."""
+
+import json
+import os
+import random
+import argparse
+import sys
+import contextlib
+
+from .analysis import (
+    get_low_accuracy_question_keys,
+    item_analysis,
+    save_item_analysis,
+    save_statistics_to_csv,
+)
+from .bank import (
+    build_bank,
+    iter_questions,
+    load_questions,
+    load_questions_at,
+    open_bank,
+    sample_questions,
+    verify_bank,
+)
+from .constants import (
+    BANK_FILE_SUFFIX,
+    CATALOG_FILE,
+    DATABASE_FILE,
+    EXAM_PAGE_SIZE,
+    HISTORY_DIR,
+    IRT_ITERATIONS,
+    STREAMING_BANK_SIZE,
+)
+from .dedup import DEDUP_THRESHOLD, find_near_duplicates
+from .deps import asyncio, np
+from .grading import grade_answer_sheets, read_answer_sheets
+from .history import (
+    get_adaptive_positions,
+    get_due_question_keys,
+    get_questions_from_done_tests,
+    import_database,
+    link_changed_questions,
+    save_exams,
+)
+from .importer import import_questions
+from .instrument import phase, run_instrumented
+from .journal import AnswerJournal, get_interrupted_tests
+from .search import open_search_index
+from .server import run_client, serve
+from .storage import (
+    get_test_catalog,
+    load_exam,
+    load_stored_questions,
+    migrate_exams,
+    repair_catalog,
+)
+from .terminal import clear_screen, format_catalog_entry, main_menu, run_test, take_test
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Terminal quiz application.")
+    parser.add_argument(
+        "--instrument",
+        metavar="REPORT",
+        help="Record the time spent in each phase of the session to a JSON file "
+        "(or set QUIZ_INSTRUMENT).",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Also run cProfile and tracemalloc over the session "
+        "(or set QUIZ_PROFILE=1).",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Convert per-exam JSON files into the compact exam log."
+    )
+    migrate_parser.add_argument("--exams-dir", default="exams")
+    catalog_parser = subparsers.add_parser(
+        "catalog", help="Rebuild the catalog of completed tests by scanning the files."
+    )
+    catalog_parser.add_argument("action", choices=["repair"])
+    catalog_parser.add_argument("--exams-dir", default="exams")
+    stats_parser = subparsers.add_parser(
+        "stats", help="Export test result statistics to a CSV file."
+    )
+    stats_parser.add_argument("--exams-dir", default="exams")
+    stats_parser.add_argument("--output", default="statistics.csv")
+    stats_parser.add_argument(
+        "--layout",
+        choices=["wide", "long"],
+        default="wide",
+        help="wide: one row per question; long: one row per question and attempt.",
+    )
+    grade_parser = subparsers.add_parser(
+        "grade", help="Grade a batch of answer sheets without a terminal."
+    )
+    grade_parser.add_argument("--data-file", default="data.json")
+    grade_parser.add_argument(
+        "--sheets",
+        required=True,
+        help="JSON array or JSON Lines file of answer sheets.",
+    )
+    grade_parser.add_argument(
+        "--pass-condition", required=True, help="e.g. 70%% or 7 (questions)."
+    )
+    grade_parser.add_argument(
+        "--output",
+        help="Write the results as JSON Lines to this file (default: stdout).",
+    )
+    grade_parser.add_argument(
+        "--save", action="store_true", help="Save the graded sheets as completed tests"
+    )
+    grade_parser.add_argument("--exams-dir", default="exams")
+    bank_parser = subparsers.add_parser(
+        "bank", help="Build or verify the memory-mapped question bank."
+    )
+    bank_parser.add_argument("action", choices=["build", "verify"])
+    bank_parser.add_argument("--data-file", default="data.json")
+    import_parser = subparsers.add_parser(
+        "import",
+        help="Validate questions from CSV, JSON Lines or JSON files and add the new "
+        "ones to the bank.",
+    )
+    import_parser.add_argument("sources", nargs="+", metavar="SOURCE")
+    import_parser.add_argument("--data-file", default="data.json")
+    import_parser.add_argument(
+        "--format",
+        choices=["csv", "jsonl", "json"],
+        help="Format of all sources (default: from their file extensions).",
+    )
+    import_parser.add_argument(
+        "--errors", help="Write the rejected records to this JSON Lines file."
+    )
+    import_parser.add_argument(
+        "--workers", type=int, help="Processes validating questions (default: CPUs)."
+    )
+    search_parser = subparsers.add_parser(
+        "search", help="List the questions of the bank matching a search."
+    )
+    search_parser.add_argument(
+        "query", help="e.g. 'bigquery (dataset OR table) -billing tag:gcp'."
+    )
+    search_parser.add_argument("--data-file", default="data.json")
+    search_parser.add_argument(
+        "--limit", type=int, default=20, help="Questions to list (0 for all)."
+    )
+    dedup_parser = subparsers.add_parser(
+        "dedup",
+        help="List near-duplicate questions, or link edited questions to their "
+        "old ids so their statistics carry over.",
+    )
+    dedup_parser.add_argument("action", choices=["lint", "link"])
+    dedup_parser.add_argument("--data-file", default="data.json")
+    dedup_parser.add_argument("--exams-dir", default="exams")
+    dedup_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEDUP_THRESHOLD,
+        help="Least similarity (0 - 1) of two versions of a question.",
+    )
+    analyze_parser = subparsers.add_parser(
+        "analyze",
+        help="Item analysis of the questions over the test history: difficulty, "
+        "discrimination, answer selection rates and optionally IRT parameters "
+        "(needs NumPy).",
+    )
+    analyze_parser.add_argument("--exams-dir", default="exams")
+    analyze_parser.add_argument(
+        "--output",
+        default="items.csv",
+        help="One row per question; written as JSON if the name ends in .json.",
+    )
+    analyze_parser.add_argument(
+        "--answers", help="Also write a CSV with one row per answer of each question."
+    )
+    analyze_parser.add_argument(
+        "--irt", choices=["1pl", "2pl"], help="Also fit an IRT model."
+    )
+    analyze_parser.add_argument(
+        "--iterations",
+        type=int,
+        default=IRT_ITERATIONS,
+        help="Most rounds of IRT updates.",
+    )
+    db_parser = subparsers.add_parser(
+        "db", help="Import the test history into an SQLite database."
+    )
+    db_parser.add_argument("action", choices=["import"])
+    db_parser.add_argument("--exams-dir", default="exams")
+    serve_parser = subparsers.add_parser(
+        "serve", help="Serve tests to many candidates from one process."
+    )
+    serve_parser.add_argument("--data-file", default="data.json")
+    serve_parser.add_argument("--exams-dir", default="exams")
+    client_parser = subparsers.add_parser(
+        "client", help="Take a test served by a quiz server."
+    )
+    for subparser in (serve_parser, client_parser):
+        subparser.add_argument("--host", default="127.0.0.1")
+        subparser.add_argument("--port", type=int, default=8765)
+        subparser.add_argument(
+            "--socket", help="Unix socket path, used instead of --host and --port."
+        )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report_file = args.instrument or os.environ.get("QUIZ_INSTRUMENT")
+    profile = args.profile or os.environ.get("QUIZ_PROFILE", "") not in ("", "0")
+    if report_file or profile:
+        run_instrumented(
+            lambda: run(args), report_file or "quiz-instrumentation.json", profile
+        )
+    else:
+        run(args)
+
+
+def run(args):
+    """Run a command, or the interactive menu when no command is given."""
+    if args.command == "migrate":
+        count = migrate_exams(args.exams_dir)
+        log_dir = os.path.join(args.exams_dir, HISTORY_DIR)
+        print(f"Migrated {count} tests into {log_dir}")
+        return
+    if args.command == "catalog":
+        count = repair_catalog(args.exams_dir)
+        catalog_file = os.path.join(args.exams_dir, CATALOG_FILE)
+        print(f"Catalogued {count} tests in {catalog_file}")
+        return
+    if args.command == "stats":
+        save_statistics_to_csv(args.exams_dir, args.output, args.layout)
+        return
+    if args.command == "grade":
+        try:
+            graded = grade_answer_sheets(
+                load_questions(args.data_file),
+                read_answer_sheets(args.sheets),
+                args.pass_condition,
+            )
+        except ValueError as e:
+            sys.exit(f"Cannot grade {args.sheets}: {e}")
+        with (
+            open(args.output, "w", encoding="utf-8")
+            if args.output
+            else (contextlib.nullcontext(sys.stdout))
+        ) as f:
+            for result in graded:
+                result = {k: v for k, v in result.items() if k != "exam"}
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        if args.save:
+            save_exams(args.exams_dir, [result["exam"] for result in graded])
+        passed = sum(result["passed"] for result in graded)
+        print(f"Graded {len(graded)} answer sheets, {passed} passed.", file=sys.stderr)
+        return
+    if args.command == "search":
+        try:
+            positions = open_search_index(args.data_file).search(args.query)
+        except ValueError as e:
+            sys.exit(f"Invalid search: {e}")
+        shown = positions[: args.limit] if args.limit else positions
+        for question in load_questions_at(args.data_file, shown):
+            print(f"{question['id']}  {question['description'][:100]}")
+        print(f"{len(positions)} questions match.", file=sys.stderr)
+        return
+    if args.command == "dedup":
+        questions = [
+            (question["id"], question["description"])
+            for question in iter_questions(args.data_file)
+        ]
+        if args.action == "link":
+            links = link_changed_questions(args.exams_dir, questions, args.threshold)
+            for old_id, new_id in links.items():
+                print(f"{old_id} -> {new_id}")
+            print(f"Linked {len(links)} changed questions.", file=sys.stderr)
+            return
+        texts = [description for _, description in questions]
+        pairs = find_near_duplicates(texts, args.threshold)
+        for i, j, similarity in pairs:
+            print(f"{similarity:.2f}  {questions[i][0]}  {texts[i][:80]}")
+            print(f"      {questions[j][0]}  {texts[j][:80]}")
+        print(f"{len(pairs)} near-duplicate pairs found.", file=sys.stderr)
+        if pairs:
+            sys.exit(1)
+        return
+    if args.command == "analyze":
+        if np is None:
+            sys.exit("Item analysis needs NumPy: pip install numpy")
+        items = item_analysis(args.exams_dir, args.irt, args.iterations)
+        count = save_item_analysis(items, args.output, args.answers)
+        print(f"Analysed {count} questions: {args.output}")
+        return
+    if args.command == "db":
+        count = import_database(args.exams_dir)
+        database_file = os.path.join(args.exams_dir, DATABASE_FILE)
+        print(f"Imported {count} tests into {database_file}")
+        return
+    if args.command == "serve":
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(
+                serve(args.data_file, args.exams_dir, args.host, args.port, args.socket)
+            )
+        return
+    if args.command == "client":
+        run_client({"host": args.host, "port": args.port, "socket_path": args.socket})
+        return
+    if args.command == "import":
+
+        def show_progress(counts):
+            print(
+                f"\r{counts['read']} read, {counts['added']} added, "
+                f"{counts['invalid']} invalid",
+                end="",
+                file=sys.stderr,
+                flush=True,
+            )
+
+        interactive = sys.stderr.isatty()
+        try:
+            counts = import_questions(
+                args.data_file,
+                args.sources,
+                args.format,
+                args.workers,
+                args.errors,
+                show_progress if interactive else None,
+            )
+        except (OSError, ValueError) as e:
+            sys.exit(f"Cannot import into {args.data_file}: {e}")
+        if interactive:
+            print(file=sys.stderr)
+        for source, number, error in counts["errors"]:
+            print(f"{source}:{number}: {error}", file=sys.stderr)
+        if counts["invalid"] > len(counts["errors"]):
+            more = counts["invalid"] - len(counts["errors"])
+            print(f"... and {more} more invalid records.", file=sys.stderr)
+        print(
+            f"Added {counts['added']} questions to {args.data_file}; "
+            f"{counts['existing']} were already in it, {counts['invalid']} invalid."
+        )
+        if counts["invalid"]:
+            sys.exit(1)
+        return
+    if args.command == "bank":
+        if args.action == "build":
+            count = build_bank(args.data_file)
+            bank_file = args.data_file + BANK_FILE_SUFFIX
+            print(f"Built bank of {count} questions: {bank_file}")
+            return
+        problems = verify_bank(args.data_file)
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+        print(f"Bank for {args.data_file} is valid.")
+        return
+
+    # File and directory paths
+    data_file = "data.json"
+    exams_dir = "exams"
+    os.makedirs(exams_dir, exist_ok=True)
+
+    while True:
+        choice = main_menu()
+        if choice == "1":
+            seen_questions = get_questions_from_done_tests(exams_dir)
+
+            # Ask the user if they want to skip questions already done in previous tests
+            skip_old_questions = (
+                input("Skip questions already done in previous tests? (y/n): ")
+                .strip()
+                .lower()
+            )
+
+            exclude = seen_questions if skip_old_questions == "y" else set()
+
+            bank = open_bank(data_file)
+            if bank is not None:
+                # Compiled bank: pick positions from the index, decode only those
+                with bank:
+                    positions = bank.positions(exclude)
+                    if not positions:
+                        print("No new questions to take.")
+                        input("\nPress Enter to return to the main menu.")
+                        continue
+
+                    num_questions = int(
+                        input(f"Number of questions (max {len(positions)}): ")
+                    )
+                    num_questions = min(num_questions, len(positions))
+                    time_limit = int(input("Test time (minutes): "))
+                    pass_condition = input(
+                        "Pass condition (e.g., 70% or 7 questions): "
+                    ).strip()
+
+                    with phase("sampling"):
+                        selected_questions = [
+                            bank.question(position)
+                            for position in random.sample(positions, num_questions)
+                        ]
+            elif os.path.getsize(data_file) > STREAMING_BANK_SIZE:
+                # Large bank: ask for the settings first, then stream and sample
+                num_questions = int(input("Number of questions: "))
+                time_limit = int(input("Test time (minutes): "))
+                pass_condition = input(
+                    "Pass condition (e.g., 70% or 7 questions): "
+                ).strip()
+                selected_questions, _ = sample_questions(
+                    data_file, num_questions, exclude
+                )
+                if not selected_questions:
+                    print("No new questions to take.")
+                    input("\nPress Enter to return to the main menu.")
+                    continue
+            else:
+                # Take a new test
+                questions = load_questions(data_file)
+
+                # Remove questions that have already appeared in old tests
+                questions = [q for q in questions if q["id"] not in exclude]
+
+                if not questions:
+                    print("No new questions to take.")
+                    input("\nPress Enter to return to the main menu.")
+                    continue
+
+                num_questions = int(
+                    input(f"Number of questions (max {len(questions)}): ")
+                )
+                num_questions = min(num_questions, len(questions))
+                time_limit = int(input("Test time (minutes): "))
+                pass_condition = input(
+                    "Pass condition (e.g., 70% or 7 questions): "
+                ).strip()
+
+                # Randomly select questions
+                with phase("sampling"):
+                    selected_questions = random.sample(questions, num_questions)
+
+            take_test(exams_dir, selected_questions, time_limit, pass_condition)
+
+        elif choice == "2":
+            # Retake an old test
+            done_tests = get_test_catalog(exams_dir)
+            if not done_tests:
+                print("No saved tests found.")
+                input("\nPress Enter to return to the menu.")
+                continue
+
+            page = 0
+            num_pages = (len(done_tests) - 1) // EXAM_PAGE_SIZE + 1
+            while True:
+                clear_screen()
+                print(f"\nList of saved tests (page {page + 1} of {num_pages}):")
+                first = page * EXAM_PAGE_SIZE
+                for i, test in enumerate(
+                    done_tests[first : first + EXAM_PAGE_SIZE], first + 1
+                ):
+                    print(format_catalog_entry(i, test))
+
+                test_choice = (
+                    input(
+                        "\nSelect a test (number), 'n' or 'p' for the next or previous "
+                        "page, or 'back' to return to the menu: "
+                    )
+                    .strip()
+                    .lower()
+                )
+                if test_choice == "back":
+                    break
+                if test_choice in ("n", "p"):
+                    page += 1 if test_choice == "n" else -1
+                    page = min(max(page, 0), num_pages - 1)
+                    continue
+
+                if test_choice.isdigit() and 1 <= int(test_choice) <= len(done_tests):
+                    test_choice = int(test_choice) - 1
+                    exam_data = load_exam(done_tests[test_choice]["path"])
+
+                    # Display saved test information
+                    clear_screen()
+                    print("\nSaved test information:")
+                    print(f"Date and time: {exam_data['timestamp']}")
+                    print(f"Correct answers: {exam_data['score']}/{exam_data['total']}")
+                    print(f"Score: {exam_data['percentage']:.2f}%")
+                    print(f"Status: {'PASS' if exam_data['passed'] else 'FAIL'}")
+                    print(f"Pass condition: {exam_data['pass_condition']}")
+                    print(f"Time taken: {exam_data['elapsed_time']}")
+                    print(f"Test time: {exam_data['time_limit']} minutes")
+
+                    # Option to retake the test
+                    action = (
+                        input(
+                            "\nEnter 'start' to retake the test or 'back' to return to the list: "
+                        )
+                        .strip()
+                        .lower()
+                    )
+                    if action == "back":
+                        continue
+                    elif action == "start":
+                        # Proceed to retake the test
+                        questions = [q["question"] for q in exam_data["questions"]]
+
+                        time_limit = exam_data.get("time_limit")
+                        if time_limit is None:
+                            time_limit = int(input("Test time (minutes): "))
+
+                        # Retake the test
+                        take_test(
+                            exams_dir,
+                            questions,
+                            time_limit,
+                            exam_data["pass_condition"],
+                        )
+                        break
+                    else:
+                        print("Invalid choice. Please try again.")
+                        input("\nPress Enter to continue.")
+                else:
+                    print("Invalid choice. Please try again.")
+                    input("\nPress Enter to continue.")
+
+        elif choice == "3":
+            save_statistics_to_csv(exams_dir)
+            input("\nPress Enter to return to the main menu.")
+
+        elif choice == "4":
+            threshold = float(input("Enter the maximum correct answer rate (0-100): "))
+            low_accuracy_keys = get_low_accuracy_question_keys(exams_dir, threshold)
+
+            if not low_accuracy_keys:
+                print(
+                    "No questions found with a correct rate below the entered threshold."
+                )
+                input("\nPress Enter to return to the main menu.")
+                continue
+
+            num_questions = int(
+                input(f"Number of questions (max {len(low_accuracy_keys)}): ")
+            )
+            num_questions = min(num_questions, len(low_accuracy_keys))
+            time_limit = int(input("Test time (minutes): "))
+            pass_condition = input(
+                "Pass condition (e.g., 70% or 7 questions): "
+            ).strip()
+
+            # Only the selected questions are decoded from the question store
+            with phase("sampling"):
+                selected_keys = random.sample(low_accuracy_keys, num_questions)
+            selected_questions = load_stored_questions(exams_dir, selected_keys)
+            take_test(exams_dir, selected_questions, time_limit, pass_condition)
+
+        elif choice == "6":
+            # Resume an interrupted test
+            journals = get_interrupted_tests(exams_dir)
+            if not journals:
+                print("No interrupted tests found.")
+                input("\nPress Enter to return to the menu.")
+                continue
+
+            journals = [AnswerJournal.open(exams_dir, path) for path in journals]
+            clear_screen()
+            print("\nInterrupted tests:")
+            for i, journal in enumerate(journals):
+                results = journal.results
+                answered = sum(bool(result["user_answer"]) for result in results)
+                elapsed_minutes = int(journal.elapsed // 60)
+                elapsed_seconds = int(journal.elapsed % 60)
+                print(
+                    f"{i + 1}. {journal.name}: {answered}/{len(results)} answered, "
+                    f"{elapsed_minutes:02}:{elapsed_seconds:02} of "
+                    f"{journal.time_limit} minutes used"
+                )
+
+            test_choice = (
+                input(
+                    "\nSelect a test (number) or enter 'back' to return to the menu: "
+                )
+                .strip()
+                .lower()
+            )
+            if test_choice.isdigit() and 1 <= int(test_choice) <= len(journals):
+                run_test(exams_dir, journals[int(test_choice) - 1])
+            elif test_choice != "back":
+                print("Invalid choice. Please try again.")
+                input("\nPress Enter to return to the menu.")
+
+        elif choice == "7":
+            # Study the questions the review schedule says are due
+            num_questions = int(input("Number of questions: "))
+            due_keys = get_due_question_keys(exams_dir, num_questions)
+            if not due_keys:
+                print("No questions are due for review.")
+                input("\nPress Enter to return to the main menu.")
+                continue
+            if len(due_keys) < num_questions:
+                print(f"Only {len(due_keys)} questions are due for review.")
+            time_limit = int(input("Test time (minutes): "))
+            pass_condition = input(
+                "Pass condition (e.g., 70% or 7 questions): "
+            ).strip()
+
+            selected_questions = load_stored_questions(exams_dir, due_keys)
+            take_test(exams_dir, selected_questions, time_limit, pass_condition)
+
+        elif choice == "8":
+            # Take a test from the questions matching a search
+            query = input(
+                "Search (e.g. bigquery OR dataset -billing, tag:iam): "
+            ).strip()
+            try:
+                with phase("search"):
+                    positions = open_search_index(data_file).search(query)
+            except ValueError as e:
+                print(f"Invalid search: {e}")
+                input("\nPress Enter to return to the main menu.")
+                continue
+            if not positions:
+                print("No questions match the search.")
+                input("\nPress Enter to return to the main menu.")
+                continue
+
+            num_questions = int(input(f"Number of questions (max {len(positions)}): "))
+            num_questions = min(num_questions, len(positions))
+            time_limit = int(input("Test time (minutes): "))
+            pass_condition = input(
+                "Pass condition (e.g., 70% or 7 questions): "
+            ).strip()
+
+            # Only the selected questions are decoded
+            with phase("sampling"):
+                selected_questions = load_questions_at(
+                    data_file, random.sample(positions, num_questions)
+                )
+            take_test(exams_dir, selected_questions, time_limit, pass_condition)
+
+        elif choice == "9":
+            # Favour questions often answered wrongly and not seen lately
+            num_questions = int(input("Number of questions: "))
+            time_limit = int(input("Test time (minutes): "))
+            pass_condition = input(
+                "Pass condition (e.g., 70% or 7 questions): "
+            ).strip()
+
+            with phase("sampling"):
+                positions = get_adaptive_positions(data_file, exams_dir, num_questions)
+            if not positions:
+                print("No questions to take.")
+                input("\nPress Enter to return to the main menu.")
+                continue
+            selected_questions = load_questions_at(data_file, positions)
+            take_test(exams_dir, selected_questions, time_limit, pass_condition)
+
+        elif choice in ("5", "q"):
+            print("Exiting the program. See you again!")
+            break
+
+        else:
+            print("Invalid choice. Please try again.")
+            input("\nPress Enter to return to the menu.")
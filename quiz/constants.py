@@ -0,0 +1,82 @@
+"""File names, limits and tuning constants shared by the quiz modules."""
+
+import re
+import string
+import sys
+import struct
+
+STATS_INDEX_FILE = ".stats_index.json"
+STATS_INDEX_VERSION = 3
+HISTORY_FILE = "history.jsonl"
+# Exam log shards, one per month the tests were saved in (e.g. history/2025-01.jsonl)
+HISTORY_DIR = "history"
+# One line per completed test with what the test list shows, so listing the
+# tests reads neither the tests nor the directory
+CATALOG_FILE = "catalog.jsonl"
+CATALOG_FIELDS = ("timestamp", "score", "total", "percentage", "passed")
+EXAM_PAGE_SIZE = 20
+QUESTION_STORE_FILE = "questions.jsonl"
+MIGRATED_DIR = "migrated"
+# Journals of tests in progress, in the exams directory
+JOURNAL_DIR = "journal"
+DATABASE_FILE = "quiz.db"
+# Bump when the database schema changes
+DATABASE_VERSION = 2
+BANK_CACHE_SUFFIX = ".cache"
+# Banks larger than this are streamed instead of loaded into memory
+STREAMING_BANK_SIZE = 256 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+FILE_LOCK_OFFSET = 1 << 62  # Byte locked on Windows, past the end of any file
+# marshal data is only readable by the Python version that wrote it
+BANK_CACHE_VERSION = f"1-{sys.version_info[0]}.{sys.version_info[1]}"
+BANK_FILE_SUFFIX = ".bank"
+BANK_INDEX_SUFFIX = ".bank.idx"
+BANK_INDEX_MAGIC = b"QBANKIX1"
+# Index header: magic, question count, source size, source mtime_ns, source MD5
+BANK_INDEX_HEADER = struct.Struct("<8sQQq16s")
+# One record per question in bank order: question id (MD5), offset, length
+BANK_INDEX_RECORD = struct.Struct("<16sQI")
+BANK_INDEX_POSITION = struct.Struct("<I")
+IMPORT_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "json"}
+IMPORT_BATCH_SIZE = 1000  # Questions validated per task
+IMPORT_ERRORS_SHOWN = 10
+MAX_ANSWERS = len(string.ascii_uppercase)  # Answers are chosen by letter
+SEARCH_INDEX_SUFFIX = ".search"
+# Marshal data like the bank cache, so keyed by the Python version too
+SEARCH_INDEX_VERSION = f"2-{sys.version_info[0]}.{sys.version_info[1]}"
+# Words of question text, and the parts of a search query
+SEARCH_TOKEN = re.compile(r"\w+")
+SEARCH_QUERY_TOKEN = re.compile(r'[()]|-?(?:tag:)?"[^"]*"|[^\s()]+')
+NONZERO_BYTES = re.compile(rb"[^\x00]")
+# Positions of the set bits in each byte value
+BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+ALIASES_FILE = ".aliases.json"  # Hidden, so it is not taken for a test
+
+# Below this many tests, scanning serially is faster than starting processes
+PARALLEL_SCAN_MIN_TESTS = 256
+SCAN_CACHE_SIZE = 4096
+# Tests scanned at a time when exporting statistics in long layout
+STATISTICS_BATCH_SIZE = 256
+# Question versions and exam log records decoded at a time by the item analysis
+ANALYSIS_BATCH_KEYS = 10000
+ANALYSIS_BATCH_TESTS = 1000
+IRT_ITERATIONS = 100
+IRT_TOLERANCE = 1e-4
+IRT_DISCRIMINATION_RANGE = (0.05, 5.0)
+# Adaptive tests: questions are weighted by error rate, damped for a while after
+# they were answered; weights are scaled to integers for the Fenwick tree
+ADAPTIVE_HALF_LIFE_DAYS = 7  # Days after which a question is half as damped
+ADAPTIVE_MIN_AGE_DAYS = 1  # Added to the age, so recent questions can be drawn
+ADAPTIVE_WEIGHT_SCALE = 1 << 20
+ADAPTIVE_REBUILD_SECONDS = 3600  # The sampler is rebuilt at least this often
+# SM-2 review scheduling: an answer counts as quality 4 when correct, 2 when wrong
+REVIEW_INITIAL_EASE = 2.5
+REVIEW_MIN_EASE = 1.3
+REVIEW_CORRECT_QUALITY = 4
+REVIEW_WRONG_QUALITY = 2
+# Seconds a server waits after a test's deadline for answers still in flight
+SERVER_DEADLINE_GRACE = 2
+# Longest message between the quiz server and its clients
+MESSAGE_LIMIT = 64 * 1024 * 1024
+# Escape sequences sent by arrow and function keys, ignored at the prompt
+ANSI_ESCAPE = re.compile(r"\x1b(\[[0-?]*[ -/]*[@-~]|O.)?")
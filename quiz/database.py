@@ -0,0 +1,555 @@
+"""SQLite database of tests and answers."""
+
+import json
+import os
+import datetime
+import itertools
+import contextlib
+import threading
+
+from .aliases import load_question_aliases
+from .constants import CATALOG_FIELDS, DATABASE_FILE, DATABASE_VERSION
+from .deps import sqlite3
+from .model import (
+    canonical_question,
+    is_answer_correct,
+    question_key,
+    selected_positions,
+    unique_exam_name,
+)
+from .scheduling import review_question
+
+# Open history databases, keyed by (path, process id, thread id)
+_databases = {}
+
+
+class QuizDatabase:
+    """
+    SQLite storage for the test history, used instead of the exam log and the
+    question store once an exams directory has a database (see import_database).
+    A trigger keeps per-question totals up to date as responses are inserted, so
+    the statistics queries read one row per question however long the history
+    is. The review schedule of each question is kept in the same row, indexed
+    by due time. The database runs in WAL mode, so sessions can read while
+    another one saves, and several sessions can save tests to the same directory.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS questions (
+        question_pk INTEGER PRIMARY KEY,
+        key TEXT NOT NULL UNIQUE,
+        id TEXT NOT NULL,
+        description TEXT NOT NULL,
+        extra TEXT
+    );
+    CREATE TABLE IF NOT EXISTS answers (
+        question_pk INTEGER NOT NULL REFERENCES questions,
+        position INTEGER NOT NULL,
+        id TEXT NOT NULL,
+        value TEXT NOT NULL,
+        correct INTEGER NOT NULL,
+        PRIMARY KEY (question_pk, position)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS exams (
+        exam_pk INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        saved_at REAL NOT NULL,
+        timestamp TEXT NOT NULL,
+        score INTEGER,
+        total INTEGER,
+        percentage REAL,
+        passed INTEGER,
+        pass_condition TEXT,
+        elapsed_time TEXT,
+        time_limit INTEGER,
+        extra TEXT
+    );
+    CREATE INDEX IF NOT EXISTS exams_saved_at ON exams (saved_at);
+    CREATE INDEX IF NOT EXISTS exams_timestamp ON exams (timestamp);
+    CREATE TABLE IF NOT EXISTS responses (
+        exam_pk INTEGER NOT NULL REFERENCES exams,
+        position INTEGER NOT NULL,
+        question_pk INTEGER NOT NULL REFERENCES questions,
+        question_id TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        correct INTEGER NOT NULL,
+        PRIMARY KEY (exam_pk, position)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS responses_question_id
+        ON responses (question_id, exam_pk, position, correct);
+    CREATE TABLE IF NOT EXISTS question_stats (
+        stats_pk INTEGER PRIMARY KEY,
+        question_id TEXT NOT NULL UNIQUE,
+        question_pk INTEGER NOT NULL REFERENCES questions,
+        attempts INTEGER NOT NULL,
+        correct_count INTEGER NOT NULL,
+        last_seen TEXT NOT NULL,
+        repetitions INTEGER NOT NULL DEFAULT 0,
+        interval REAL NOT NULL DEFAULT 0,
+        ease REAL NOT NULL DEFAULT 2.5,
+        due REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS question_stats_due
+        ON question_stats (due, question_id);
+    CREATE TRIGGER IF NOT EXISTS responses_stats AFTER INSERT ON responses BEGIN
+        INSERT INTO question_stats
+            (question_id, question_pk, attempts, correct_count, last_seen)
+        SELECT NEW.question_id, NEW.question_pk, 1, NEW.correct, timestamp
+        FROM exams WHERE exam_pk = NEW.exam_pk
+        ON CONFLICT (question_id) DO UPDATE SET
+            question_pk = excluded.question_pk,
+            attempts = attempts + 1,
+            correct_count = correct_count + excluded.correct_count,
+            last_seen = excluded.last_seen;
+    END;
+    """
+    EXAM_COLUMNS = (
+        "timestamp",
+        "score",
+        "total",
+        "percentage",
+        "passed",
+        "pass_condition",
+        "elapsed_time",
+        "time_limit",
+    )
+
+    def __init__(self, path):
+        self.path = path
+        # Autocommit; write transactions are started explicitly by transaction()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version == 1:
+            self._add_review_state()
+        elif version != DATABASE_VERSION:
+            self.connection.executescript(
+                f"BEGIN IMMEDIATE; {self.SCHEMA}; "
+                f"PRAGMA user_version = {DATABASE_VERSION}; COMMIT;"
+            )
+
+    def _add_review_state(self):
+        """Upgrade a version 1 database, scheduling reviews from the history."""
+        with self.transaction():
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] != 1:
+                return  # Upgraded by another session in the meantime
+            for column in (
+                "repetitions INTEGER NOT NULL DEFAULT 0",
+                "interval REAL NOT NULL DEFAULT 0",
+                "ease REAL NOT NULL DEFAULT 2.5",
+                "due REAL NOT NULL DEFAULT 0",
+            ):
+                self.connection.execute(
+                    f"ALTER TABLE question_stats ADD COLUMN {column}"
+                )
+            self.connection.execute(
+                "CREATE INDEX question_stats_due ON question_stats (due, question_id)"
+            )
+            self._review(
+                self.connection.execute(
+                    "SELECT question_id, correct, timestamp "
+                    "FROM exams JOIN responses USING (exam_pk) "
+                    "ORDER BY saved_at, exam_pk, position"
+                ).fetchall()
+            )
+            self.connection.execute(f"PRAGMA user_version = {DATABASE_VERSION}")
+
+    def _review(self, responses):
+        """
+        Schedule the next reviews of answered questions, in answer order.
+        :param responses: (question id, correct, test timestamp) per answer.
+        """
+        for question_id, is_correct, timestamp in responses:
+            stats = dict(
+                zip(
+                    ("repetitions", "interval", "ease"),
+                    self.connection.execute(
+                        "SELECT repetitions, interval, ease FROM question_stats "
+                        "WHERE question_id = ?",
+                        (question_id,),
+                    ).fetchone(),
+                )
+            )
+            review_question(
+                stats,
+                is_correct,
+                datetime.datetime.fromisoformat(timestamp).timestamp(),
+            )
+            self.connection.execute(
+                "UPDATE question_stats SET repetitions = ?, interval = ?, ease = ?, "
+                "due = ? WHERE question_id = ?",
+                (
+                    stats["repetitions"],
+                    stats["interval"],
+                    stats["ease"],
+                    stats["due"],
+                    question_id,
+                ),
+            )
+
+    def link_questions(self, aliases):
+        """
+        Count the responses to old question ids under their new ids, and recount
+        the per-question totals and review schedules.
+        :param aliases: Dict of old question id -> newest question id.
+        """
+        with self.transaction():
+            # Start over from the ids of the questions as answered, as a response
+            # may already count under a version that has been linked again
+            self.connection.execute(
+                "UPDATE responses SET question_id = "
+                "(SELECT id FROM questions WHERE question_pk = responses.question_pk)"
+            )
+            self.connection.executemany(
+                "UPDATE responses SET question_id = ? WHERE question_id = ?",
+                [(new_id, old_id) for old_id, new_id in aliases.items()],
+            )
+            self.connection.execute("DELETE FROM question_stats")
+            # Replay the responses as the trigger saw them, in insertion order
+            self.connection.execute(
+                "INSERT INTO question_stats "
+                "(question_id, question_pk, attempts, correct_count, last_seen) "
+                "SELECT question_id, question_pk, 1, correct, timestamp "
+                "FROM exams JOIN responses USING (exam_pk) "
+                "WHERE true ORDER BY exam_pk, position "
+                "ON CONFLICT (question_id) DO UPDATE SET "
+                "question_pk = excluded.question_pk, "
+                "attempts = attempts + 1, "
+                "correct_count = correct_count + excluded.correct_count, "
+                "last_seen = excluded.last_seen"
+            )
+            self._review(
+                self.connection.execute(
+                    "SELECT question_id, correct, timestamp "
+                    "FROM exams JOIN responses USING (exam_pk) "
+                    "ORDER BY saved_at, exam_pk, position"
+                ).fetchall()
+            )
+
+    def __contains__(self, name):
+        """Whether a test of this name is saved."""
+        row = self.connection.execute(
+            "SELECT 1 FROM exams WHERE name = ?", (name,)
+        ).fetchone()
+        return row is not None
+
+    def close(self):
+        self.connection.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Run the statements of the block in one write transaction.
+        The write lock is taken up front, so a session saving at the same time
+        as another one waits for it instead of failing halfway.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def _add_question(self, question):
+        """Store a canonical question unless it is stored already; return its row id."""
+        key = question_key(question)
+        row = self.connection.execute(
+            "SELECT question_pk FROM questions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        extra = {
+            k: v
+            for k, v in question.items()
+            if k not in ("id", "description", "answers")
+        }
+        question_pk = self.connection.execute(
+            "INSERT INTO questions (key, id, description, extra) VALUES (?, ?, ?, ?)",
+            (
+                key,
+                question["id"],
+                question["description"],
+                json.dumps(extra, ensure_ascii=False) if extra else None,
+            ),
+        ).lastrowid
+        self.connection.executemany(
+            "INSERT INTO answers (question_pk, position, id, value, correct) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (question_pk, position, ans["id"], ans["value"], ans["correct"])
+                for position, ans in enumerate(question["answers"])
+            ],
+        )
+        return question_pk
+
+    def add_exams(self, exams):
+        """
+        Save completed tests in one transaction.
+        :param exams: (name, exam data, saved_at) per test. A None name is replaced
+            by one made from the current time, as is a None saved_at. Tests whose
+            name is already saved are not saved again.
+        :return: List of the tests' names.
+        """
+        names = []
+        aliases = load_question_aliases(os.path.dirname(self.path))
+        with self.transaction():
+            for name, exam_data, saved_at in exams:
+                now = datetime.datetime.now()
+                if name is None:
+                    name = unique_exam_name(now, self)
+                names.append(name)
+                if name in self:
+                    continue
+
+                extra = {
+                    k: v
+                    for k, v in exam_data.items()
+                    if k not in self.EXAM_COLUMNS and k != "questions"
+                }
+                columns = ", ".join(self.EXAM_COLUMNS)
+                placeholders = ", ".join("?" * (len(self.EXAM_COLUMNS) + 3))
+                exam_pk = self.connection.execute(
+                    f"INSERT INTO exams (name, saved_at, {columns}, extra) "
+                    f"VALUES ({placeholders})",
+                    (
+                        name,
+                        now.timestamp() if saved_at is None else saved_at,
+                        *(exam_data.get(column) for column in self.EXAM_COLUMNS),
+                        json.dumps(extra, ensure_ascii=False) if extra else None,
+                    ),
+                ).lastrowid
+                responses = []
+                for position, result in enumerate(exam_data["questions"]):
+                    question = canonical_question(result["question"])
+                    answer_ids = [ans["id"] for ans in question["answers"]]
+                    responses.append(
+                        (
+                            exam_pk,
+                            position,
+                            self._add_question(question),
+                            aliases.get(question["id"], question["id"]),
+                            json.dumps(
+                                selected_positions(answer_ids, result["user_answer"])
+                            ),
+                            is_answer_correct(question, result["user_answer"]),
+                        )
+                    )
+                self.connection.executemany(
+                    "INSERT INTO responses (exam_pk, position, question_pk, "
+                    "question_id, answer, correct) VALUES (?, ?, ?, ?, ?, ?)",
+                    responses,
+                )
+                self._review(
+                    (question_id, is_correct, exam_data["timestamp"])
+                    for _, _, _, question_id, _, is_correct in responses
+                )
+        return names
+
+    def _question(self, question_pk):
+        """Decode one stored question."""
+        question_id, description, extra = self.connection.execute(
+            "SELECT id, description, extra FROM questions WHERE question_pk = ?",
+            (question_pk,),
+        ).fetchone()
+        answers = self.connection.execute(
+            "SELECT id, value, correct FROM answers WHERE question_pk = ? "
+            "ORDER BY position",
+            (question_pk,),
+        )
+        question = {
+            "description": description,
+            "answers": [
+                {"value": value, "correct": bool(correct), "id": answer_id}
+                for answer_id, value, correct in answers
+            ],
+            "id": question_id,
+        }
+        if extra:
+            question.update(json.loads(extra))
+        return question
+
+    def questions(self, keys):
+        """Decode the questions with the given store keys."""
+        questions = []
+        for key in keys:
+            row = self.connection.execute(
+                "SELECT question_pk FROM questions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(key)
+            questions.append(self._question(row[0]))
+        return questions
+
+    def load_exam(self, name):
+        """Load a saved test, in the format of load_exam."""
+        row = self.connection.execute(
+            f"SELECT exam_pk, {', '.join(self.EXAM_COLUMNS)}, extra FROM exams "
+            "WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        exam_data = {
+            column: value
+            for column, value in zip(self.EXAM_COLUMNS, row[1:-1])
+            if value is not None
+        }
+        if "passed" in exam_data:
+            exam_data["passed"] = bool(exam_data["passed"])
+        if row[-1]:
+            exam_data.update(json.loads(row[-1]))
+        exam_data["questions"] = []
+        for question_pk, answer in self.connection.execute(
+            "SELECT question_pk, answer FROM responses WHERE exam_pk = ? "
+            "ORDER BY position",
+            (row[0],),
+        ).fetchall():
+            question = self._question(question_pk)
+            exam_data["questions"].append(
+                {
+                    "question": question,
+                    "user_answer": [
+                        question["answers"][i]["id"] for i in json.loads(answer)
+                    ],
+                }
+            )
+        return exam_data
+
+    def catalog(self, order="newest"):
+        """Catalog entries of the saved tests, sorted by newest or oldest."""
+        direction = "DESC" if order == "newest" else "ASC"
+        rows = self.connection.execute(
+            f"SELECT name, saved_at, {', '.join(CATALOG_FIELDS)} FROM exams "
+            f"ORDER BY saved_at {direction}, exam_pk {direction}"
+        )
+        return [
+            {
+                "name": name,
+                "path": f"{self.path}#{name}",
+                "saved_at": saved_at,
+                **dict(zip(CATALOG_FIELDS, fields)),
+            }
+            for name, saved_at, *fields in rows
+        ]
+
+    def question_ids(self):
+        """Ids of every question that has been in a saved test."""
+        rows = self.connection.execute("SELECT question_id FROM question_stats")
+        return {question_id for (question_id,) in rows}
+
+    def low_accuracy_keys(self, threshold):
+        """Store keys of the questions answered correctly less than threshold %."""
+        rows = self.connection.execute(
+            "SELECT key FROM question_stats JOIN questions USING (question_pk) "
+            "WHERE correct_count * 100.0 < ? * attempts ORDER BY stats_pk",
+            (threshold,),
+        )
+        return [key for (key,) in rows]
+
+    def due_keys(self, num_questions, now):
+        """Store keys of the questions most overdue for review at time now."""
+        rows = self.connection.execute(
+            "SELECT key FROM question_stats JOIN questions USING (question_pk) "
+            "WHERE due <= ? ORDER BY due, question_id LIMIT ?",
+            (now, num_questions),
+        )
+        return [key for (key,) in rows]
+
+    def question_stats(self, question_ids=None):
+        """
+        Attempts, correct answers and time of the last answer of answered questions.
+        :param question_ids: Only these questions; every answered question by default.
+        :return: Iterator of (question id, attempts, correct count, last seen).
+        """
+        columns = "question_id, attempts, correct_count, last_seen"
+        if question_ids is None:
+            return self.connection.execute(f"SELECT {columns} FROM question_stats")
+        rows = (
+            self.connection.execute(
+                f"SELECT {columns} FROM question_stats WHERE question_id = ?",
+                (question_id,),
+            ).fetchone()
+            for question_id in question_ids
+        )
+        return (row for row in rows if row is not None)
+
+    def last_exam(self):
+        """Number of the last saved test, which grows as tests are saved."""
+        return self.connection.execute(
+            "SELECT COALESCE(MAX(exam_pk), 0) FROM exams"
+        ).fetchone()[0]
+
+    def descriptions(self):
+        """(question id, description) of every saved question version."""
+        return self.connection.execute("SELECT id, description FROM questions")
+
+    def max_attempts(self):
+        """Largest number of attempts at any one question."""
+        return self.connection.execute(
+            "SELECT COALESCE(MAX(attempts), 0) FROM question_stats"
+        ).fetchone()[0]
+
+    def question_results(self):
+        """
+        Outcomes of the attempts at each question, in the order of the questions'
+        first attempts.
+        :return: Iterator of (latest version of the question, outcomes) where
+            outcomes has a "1" or "0" per attempt, oldest first.
+        """
+        questions = self.connection.execute(
+            "SELECT question_pk, question_id FROM question_stats ORDER BY stats_pk"
+        )
+        for question_pk, question_id in questions:
+            outcomes = self.connection.execute(
+                "SELECT correct FROM responses WHERE question_id = ? "
+                "ORDER BY exam_pk, position",
+                (question_id,),
+            )
+            yield self._question(question_pk), "".join(
+                str(correct) for (correct,) in outcomes
+            )
+
+    def responses(self):
+        """
+        Every answered question, oldest test first.
+        :return: Iterator of (question id, store key, test name, timestamp, correct).
+        """
+        return self.connection.execute(
+            "SELECT question_id, key, name, timestamp, correct "
+            "FROM exams JOIN responses USING (exam_pk) "
+            "JOIN questions USING (question_pk) "
+            "ORDER BY saved_at, exam_pk, position"
+        )
+
+    def answer_sheets(self):
+        """
+        Selected answers of every saved test, without grading them.
+        :return: Iterator of one list per test of (question store key, positions
+            of the selected answers in the stored question).
+        """
+        rows = self.connection.execute(
+            "SELECT exam_pk, key, answer FROM responses "
+            "JOIN questions USING (question_pk) ORDER BY exam_pk, position"
+        )
+        for _, sheet in itertools.groupby(rows, key=lambda row: row[0]):
+            yield [(key, json.loads(answer)) for _, key, answer in sheet]
+
+
+def open_database(exams_dir, create=False):
+    """
+    Open the SQLite history of an exams directory.
+    Connections are cached per process and thread, since an SQLite connection
+    must not be used across a fork or from two threads at once.
+    :param exams_dir: Directory containing completed tests.
+    :param create: Whether to create the database if it does not exist.
+    :return: QuizDatabase, or None if the directory has no database.
+    """
+    path = os.path.join(exams_dir, DATABASE_FILE)
+    cache_key = (path, os.getpid(), threading.get_ident())
+    database = _databases.get(cache_key)
+    if database is None:
+        if not create and not os.path.exists(path):
+            return None
+        database = _databases[cache_key] = QuizDatabase(path)
+    return database
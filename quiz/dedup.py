@@ -0,0 +1,165 @@
+"""Finding near-duplicate questions with MinHash."""
+
+import itertools
+import random
+
+from .constants import SEARCH_TOKEN
+from .deps import np
+
+# MinHash near-duplicate detection: 16 bands of 8 values find 95% of the pairs of
+# questions with 0.8 similarity and nearly all above 0.85, but few below 0.6
+MINHASH_PERMUTATIONS = 128
+MINHASH_BANDS = 16
+MINHASH_SHINGLE = 5
+MINHASH_BATCH_SHINGLES = 4096
+# Multiply-shift hash functions ((a * x + b) mod 2**64) >> 32, with a odd
+_minhash_random = random.Random(0x51AB)
+MINHASH_A = tuple(
+    _minhash_random.getrandbits(64) | 1 for _ in range(MINHASH_PERMUTATIONS)
+)
+MINHASH_B = tuple(_minhash_random.getrandbits(64) for _ in range(MINHASH_PERMUTATIONS))
+DEDUP_THRESHOLD = 0.8
+
+
+def shingle_text(text):
+    """
+    Text as compared for near duplicates: lower case words separated by single
+    spaces, so that punctuation and spacing do not count as edits.
+    """
+    return " ".join(SEARCH_TOKEN.findall(text.lower())).ljust(MINHASH_SHINGLE)
+
+
+def shingle_hashes(text):
+    """Hashes of the 5-character shingles of a text, as made by shingle_text."""
+    codes = [ord(c) for c in text]
+    return [
+        (
+            codes[i] * 923521  # 31 ** 4
+            + codes[i + 1] * 29791
+            + codes[i + 2] * 961
+            + codes[i + 3] * 31
+            + codes[i + 4]
+        )
+        & 0xFFFFFFFF
+        for i in range(len(codes) - MINHASH_SHINGLE + 1)
+    ]
+
+
+def minhash_signatures(texts):
+    """
+    MinHash signatures of texts: the minimum of each of MINHASH_PERMUTATIONS
+    hash functions over the hashes of the text's 5-character shingles. A small
+    edit changes only the few shingles around it, and the share of equal values
+    in two signatures estimates the Jaccard similarity of the texts' shingles.
+    With NumPy installed, the shingles of many texts are hashed at once;
+    otherwise a pure Python fallback computes the same signatures.
+    :param texts: Texts, e.g. question descriptions.
+    :return: Array of shape (len(texts), MINHASH_PERMUTATIONS), or a list of
+        tuples without NumPy.
+    """
+    texts = [shingle_text(text) for text in texts]
+    if np is None:
+        return [
+            tuple(
+                min((a * h + b) & 0xFFFFFFFFFFFFFFFF for h in hashes) >> 32
+                for a, b in zip(MINHASH_A, MINHASH_B)
+            )
+            for hashes in map(shingle_hashes, texts)
+        ]
+
+    a = np.array(MINHASH_A, dtype=np.uint64)[:, None]
+    b = np.array(MINHASH_B, dtype=np.uint64)[:, None]
+    powers = [np.uint64(31**k) for k in range(MINHASH_SHINGLE - 1, -1, -1)]
+    signatures = np.empty((len(texts), MINHASH_PERMUTATIONS), dtype=np.uint32)
+    start = 0
+    while start < len(texts):
+        # Hash a batch of texts at once, keeping the hash matrix in cache
+        end, size = start, 0
+        while end < len(texts) and size < MINHASH_BATCH_SHINGLES:
+            size += len(texts[end]) - MINHASH_SHINGLE + 1
+            end += 1
+        batch = "".join(texts[start:end])
+        codes = np.frombuffer(batch.encode("utf-32-le"), dtype=np.uint32)
+        codes = codes.astype(np.uint64)
+        windows = len(codes) - MINHASH_SHINGLE + 1
+        hashes = sum(
+            codes[k : windows + k] * power for k, power in enumerate(powers)
+        ) & np.uint64(0xFFFFFFFF)
+        # Drop the shingles that span two texts
+        lengths = np.array([len(text) for text in texts[start:end]])
+        text_starts = np.cumsum(lengths) - lengths
+        keep = np.ones(windows, dtype=bool)
+        keep[(text_starts[1:, None] - np.arange(1, MINHASH_SHINGLE)).ravel()] = False
+        offsets = text_starts - np.arange(end - start) * (MINHASH_SHINGLE - 1)
+        # uint64 arithmetic wraps around, which is the mod 2**64 of the hash
+        values = a * hashes[keep]
+        values += b
+        minimums = np.minimum.reduceat(values, offsets, axis=1)
+        signatures[start:end] = (minimums >> np.uint64(32)).T
+        start = end
+    return signatures
+
+
+def signature_similarity(signatures, i, j):
+    """Estimated Jaccard similarity of the texts with signatures i and j."""
+    if np is None:
+        equal = sum(x == y for x, y in zip(signatures[i], signatures[j]))
+    else:
+        equal = int(np.count_nonzero(signatures[i] == signatures[j]))
+    return equal / MINHASH_PERMUTATIONS
+
+
+def lsh_buckets(signatures):
+    """
+    Locality-sensitive hashing of MinHash signatures: signatures are cut into
+    MINHASH_BANDS bands, and texts whose signatures are equal in a whole band
+    land in the same bucket. Similar texts share a bucket with high probability,
+    dissimilar ones rarely, so only texts in a shared bucket are compared.
+    :param signatures: Signatures from minhash_signatures.
+    :return: Iterator of buckets of two or more text indexes, in index order.
+    """
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    if np is None:
+        for band in range(MINHASH_BANDS):
+            buckets = {}
+            for i, signature in enumerate(signatures):
+                band_values = signature[band * rows : (band + 1) * rows]
+                buckets.setdefault(band_values, []).append(i)
+            yield from (bucket for bucket in buckets.values() if len(bucket) > 1)
+        return
+
+    for band in range(MINHASH_BANDS):
+        values = signatures[:, band * rows : (band + 1) * rows].astype(np.uint64)
+        # Sort by the band, two values packed into each sort key
+        values = values[:, 0::2] << np.uint64(32) | values[:, 1::2]
+        order = np.lexsort(values.T[::-1])
+        values = values[order]
+        # Runs of equal bands in sorted order are the buckets
+        starts = np.flatnonzero(
+            np.concatenate(([True], np.any(values[1:] != values[:-1], axis=1), [True]))
+        )
+        for start, end in zip(starts[:-1], starts[1:]):
+            if end - start > 1:
+                yield sorted(order[start:end].tolist())
+
+
+def find_near_duplicates(texts, threshold=DEDUP_THRESHOLD):
+    """
+    Find pairs of near-duplicate texts in roughly linear time with MinHash and
+    locality-sensitive hashing, instead of comparing every pair.
+    :param texts: Texts, e.g. question descriptions.
+    :param threshold: Least estimated Jaccard similarity (0 - 1) of a pair.
+    :return: Sorted list of (i, j, similarity) with i < j; every pair of texts
+        sharing a bucket is compared.
+    """
+    signatures = minhash_signatures(texts)
+    pairs = {}
+    for bucket in lsh_buckets(signatures):
+        for i, j in itertools.combinations(bucket, 2):
+            if (i, j) not in pairs:
+                pairs[i, j] = signature_similarity(signatures, i, j)
+    return sorted(
+        (i, j, similarity)
+        for (i, j), similarity in pairs.items()
+        if similarity >= threshold
+    )
@@ -0,0 +1,54 @@
+"""Standard modules imported on first use, and optional platform modules."""
+
+import sys
+import importlib.util
+
+
+def lazy_import(name):
+    """
+    Import a module when one of its attributes is first used, to keep start-up
+    fast. Modules needed only by some commands and menu options are imported
+    this way.
+    :param name: Name of the module.
+    :return: The module, or None if it is not installed.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+asyncio = lazy_import("asyncio")
+concurrent_futures = lazy_import("concurrent.futures")
+cProfile = lazy_import("cProfile")
+csv = lazy_import("csv")
+hashlib = lazy_import("hashlib")
+multiprocessing = lazy_import("multiprocessing")
+pstats = lazy_import("pstats")
+shutil = lazy_import("shutil")
+sqlite3 = lazy_import("sqlite3")
+tracemalloc = lazy_import("tracemalloc")
+# NumPy is optional; batch grading and deduplication fall back to plain Python
+np = lazy_import("numpy")
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:  # Only available on Windows
+    msvcrt = None
+try:
+    import termios
+    import tty
+except ImportError:  # Not available on Windows
+    termios = tty = None
@@ -0,0 +1,90 @@
+"""Locked appends to line-based files shared by several processes."""
+
+import os
+import contextlib
+
+from .constants import FILE_LOCK_OFFSET, STREAM_CHUNK_SIZE
+from .deps import fcntl, msvcrt
+
+
+@contextlib.contextmanager
+def locked_file(f):
+    """
+    Hold an exclusive lock on an open file, waiting while another session holds
+    it. Locks are advisory: they only keep out writers that take them too.
+    """
+    if msvcrt is not None:
+        # Windows locks byte ranges and keeps readers out of them, so lock a byte
+        # far past the end of any real file
+        f.seek(FILE_LOCK_OFFSET)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                pass  # LK_LOCK gives up after 10 seconds; keep waiting
+        try:
+            yield f
+        finally:
+            f.seek(FILE_LOCK_OFFSET)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def open_locked(path):
+    """
+    Open a file for appending and hold its lock. If the file was replaced while
+    waiting for the lock, as repair_catalog does, the new file is locked instead.
+    """
+    while True:
+        with open(path, "a+b") as f, locked_file(f):
+            try:
+                replaced = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = True
+            if not replaced:
+                yield f
+                return
+
+
+def complete_lines_end(f):
+    """Offset just after the last newline of an open binary file, 0 if none."""
+    end = f.seek(0, os.SEEK_END)
+    while end > 0:
+        start = max(0, end - STREAM_CHUNK_SIZE)
+        f.seek(start)
+        newline = f.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+
+def append_lines(path, text, sync=False):
+    """
+    Append complete lines to an append-only file with a single write.
+    The file is locked for the whole append, so sessions sharing the exams
+    directory take turns. A partial last line, left by a crash during an earlier
+    append, is cut off first so that it cannot merge with the new lines. It is
+    found from the file as it is on disk, never from an offset remembered
+    earlier, as another session may have appended since.
+    :param path: File to append to.
+    :param text: Lines to append, each ending with a newline.
+    :param sync: Whether to fsync the file before returning.
+    :return: Offset of the first appended line in the file.
+    """
+    with open_locked(path) as f:
+        start = complete_lines_end(f)
+        if f.seek(0, os.SEEK_END) > start:
+            f.truncate(start)
+        f.write(text.encode("utf-8"))
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+    return start
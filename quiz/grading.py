@@ -0,0 +1,518 @@
+"""Batch grading of answer sheets."""
+
+import json
+import datetime
+import array
+import bisect
+import itertools
+
+from .deps import np
+
+
+def answer_bits(question, max_answers=64):
+    """
+    Bit of each answer id of a question, and the bitmask of the correct answers.
+    :param max_answers: Most answers allowed, for masks stored in 64 bits; None
+        for no limit.
+    """
+    if max_answers is not None and len(question["answers"]) > max_answers:
+        raise ValueError(
+            f"Question {question['id']} has too many answers to be batch graded"
+        )
+    bits = {}
+    correct_mask = 0
+    for i, answer in enumerate(question["answers"]):
+        bits.setdefault(answer["id"], 1 << i)
+        if answer["correct"]:
+            correct_mask |= bits[answer["id"]]
+    return bits, correct_mask
+
+
+def grade_answer_sheets(questions, sheets, pass_condition):
+    """
+    Grade many answer sheets at once, without a terminal.
+    Each sheet's answers are packed into one bitmask per question, so a question
+    is graded by comparing its mask with the mask of the correct answers; with
+    NumPy installed the comparison, scores and pass conditions are computed on
+    whole arrays at once.
+    :param questions: Question bank, as returned by load_questions.
+    :param sheets: Answer sheets: dicts with a "candidate" name, "answers"
+        mapping question id to the selected answer ids and, optionally, the
+        "questions" asked (defaults to the answered ones), "timestamp",
+        "elapsed_time" and "time_limit".
+    :param pass_condition: Pass condition, e.g. "70%" or "7".
+    :return: List of dicts, one per sheet, with the candidate, score, total,
+        percentage, passed, per-question correctness and an exam record in the
+        format written by save_exam.
+    """
+    questions_by_id = {question["id"]: question for question in questions}
+    columns = {}
+    for number, sheet in enumerate(sheets, start=1):
+        for question_id in sheet.get("questions") or sheet["answers"]:
+            if question_id not in questions_by_id:
+                raise ValueError(f"Sheet {number}: unknown question id {question_id}")
+            columns.setdefault(question_id, len(columns))
+
+    question_ids = list(columns)
+    bits = []
+    correct_masks = []
+    for question_id in question_ids:
+        answer_bit, correct_mask = answer_bits(questions_by_id[question_id])
+        bits.append(answer_bit)
+        correct_masks.append(correct_mask)
+
+    # Flatten every asked question of every sheet into one response
+    rows = []
+    response_columns = []
+    selected = []
+    for row, sheet in enumerate(sheets):
+        for question_id in sheet.get("questions") or sheet["answers"]:
+            column = columns[question_id]
+            mask = 0
+            for answer_id in sheet["answers"].get(question_id, []):
+                if answer_id not in bits[column]:
+                    raise ValueError(
+                        f"Sheet {row + 1}: unknown answer id {answer_id} "
+                        f"for question {question_id}"
+                    )
+                mask |= bits[column][answer_id]
+            rows.append(row)
+            response_columns.append(column)
+            selected.append(mask)
+
+    by_percentage = "%" in pass_condition
+    threshold = (
+        float(pass_condition.strip("%")) if by_percentage else int(pass_condition)
+    )
+    if np is not None:
+        rows = np.array(rows, dtype=np.intp)
+        correct = (
+            np.array(selected, dtype=np.uint64)
+            == np.array(correct_masks, dtype=np.uint64)[
+                np.array(response_columns, dtype=np.intp)
+            ]
+        )
+        scores = np.bincount(rows, weights=correct, minlength=len(sheets))
+        totals = np.bincount(rows, minlength=len(sheets))
+        percentages = np.divide(
+            scores * 100.0, totals, out=np.zeros(len(sheets)), where=totals > 0
+        )
+        passed = (percentages if by_percentage else scores) >= threshold
+        correct = correct.tolist()
+        scores = scores.astype(int).tolist()
+        totals, percentages, passed = (
+            totals.tolist(),
+            percentages.tolist(),
+            passed.tolist(),
+        )
+    else:
+        correct = [
+            mask == correct_masks[column]
+            for mask, column in zip(selected, response_columns)
+        ]
+        scores = [0] * len(sheets)
+        totals = [0] * len(sheets)
+        for row, is_correct in zip(rows, correct):
+            scores[row] += is_correct
+            totals[row] += 1
+        percentages = [
+            score * 100.0 / total if total else 0.0
+            for score, total in zip(scores, totals)
+        ]
+        passed = [
+            (percentage if by_percentage else score) >= threshold
+            for score, percentage in zip(scores, percentages)
+        ]
+
+    graded = []
+    offset = 0
+    for i, sheet in enumerate(sheets):
+        asked_ids = sheet.get("questions") or list(sheet["answers"])
+        sheet_correct = correct[offset : offset + len(asked_ids)]
+        results = [
+            {
+                "question": questions_by_id[question_id],
+                "user_answer": list(sheet["answers"].get(question_id, [])),
+            }
+            for question_id in asked_ids
+        ]
+        exam_data = {
+            "timestamp": sheet.get("timestamp", datetime.datetime.now().isoformat()),
+            "questions": results,
+            "score": scores[i],
+            "total": totals[i],
+            "percentage": percentages[i],
+            "passed": passed[i],
+            "pass_condition": pass_condition,
+            "elapsed_time": sheet.get("elapsed_time", "00:00"),
+            "time_limit": sheet.get("time_limit"),
+        }
+        graded.append(
+            {
+                "candidate": sheet.get("candidate", str(i + 1)),
+                "score": scores[i],
+                "total": totals[i],
+                "percentage": percentages[i],
+                "passed": passed[i],
+                "correct": dict(zip(asked_ids, sheet_correct)),
+                "exam": exam_data,
+            }
+        )
+        offset += len(asked_ids)
+    return graded
+
+
+def id_digest(item_id):
+    """16-byte digest of a 32 hex digit id, or None if the id is not one."""
+    if isinstance(item_id, str) and len(item_id) == 32:
+        try:
+            digest = bytes.fromhex(item_id)
+        except ValueError:
+            return None
+        if digest.hex() == item_id:
+            return digest
+    return None
+
+
+class QuestionTable:
+    """
+    Compact, array-backed table of questions, numbered by position.
+    Question and answer ids are kept as 16-byte digests, descriptions and answer
+    values as UTF-8 in one buffer each, and the correct answers of each question
+    as one bitmask in the layout of answer_bits, so a selection packed with
+    answer_mask is graded with one integer compare. Whatever the columns cannot
+    hold is kept per question, so question() gives back exactly the dict the
+    table was built from. Offers the read interface of MappedBank.
+    """
+
+    __slots__ = (
+        "question_ids",
+        "answer_ids",
+        "answer_starts",
+        "correct_masks",
+        "descriptions",
+        "description_ends",
+        "values",
+        "value_ends",
+        "extras",
+        "_order",
+    )
+
+    def __init__(self, questions=()):
+        question_ids = []
+        answer_ids = []
+        descriptions = []
+        values = []
+        answer_counts = []
+        self.correct_masks = array.array("Q")
+        # Position -> (extra question fields, {answer index: extra answer fields})
+        self.extras = {}
+        for position, question in enumerate(questions):
+            _, correct_mask = answer_bits(question)
+            self.correct_masks.append(correct_mask)
+            answer_counts.append(len(question["answers"]))
+            question_ids.append(question["id"])
+            descriptions.append(question["description"])
+            question_extra = {
+                k: v
+                for k, v in question.items()
+                if k not in ("description", "answers", "id")
+            }
+            answer_extras = {}
+            for i, answer in enumerate(question["answers"]):
+                answer_ids.append(answer["id"])
+                values.append(answer["value"])
+                # The mask has the bit of the first answer with each id only
+                if len(answer) != 3 or answer["correct"] is not bool(
+                    correct_mask >> i & 1
+                ):
+                    answer_extras[i] = {
+                        k: v
+                        for k, v in answer.items()
+                        if k not in ("value", "id")
+                        and not (k == "correct" and v is bool(correct_mask >> i & 1))
+                    }
+            if question_extra or answer_extras:
+                self.extras[position] = (question_extra, answer_extras)
+        self.answer_starts = array.array(
+            "I", itertools.accumulate(answer_counts, initial=0)
+        )
+
+        # Whatever the columns cannot hold is kept with the question's extras
+        def keep(field, question_fields):
+            for position, value in question_fields.items():
+                self.extras.setdefault(position, ({}, {}))[0][field] = value
+
+        def keep_answers(field, answer_fields):
+            for j, value in answer_fields.items():
+                position = bisect.bisect_right(self.answer_starts, j) - 1
+                answer_extras = self.extras.setdefault(position, ({}, {}))[1]
+                answer_extras.setdefault(j - self.answer_starts[position], {})[
+                    field
+                ] = value
+
+        self.question_ids, unpacked = self._pack_ids(question_ids)
+        keep("id", unpacked)
+        self.answer_ids, unpacked = self._pack_ids(answer_ids)
+        keep_answers("id", unpacked)
+        self.descriptions, self.description_ends, unpacked = self._pack_texts(
+            descriptions
+        )
+        keep("description", unpacked)
+        self.values, self.value_ends, unpacked = self._pack_texts(values)
+        keep_answers("value", unpacked)
+        self._order = None
+
+    @staticmethod
+    def _pack_ids(ids):
+        """
+        Pack ids into 16-byte digests.
+        :return: Tuple of (digests, dict of index -> id for the ids that have no
+            digest and are packed as zeros).
+        """
+        joined = "".join(ids) if all(isinstance(i, str) for i in ids) else None
+        if joined is not None and len(joined) == 32 * len(ids):
+            try:
+                packed = bytes.fromhex(joined)
+            except ValueError:
+                packed = None
+            if packed is not None and packed.hex() == joined:
+                return packed, {}
+        digests = [id_digest(item_id) for item_id in ids]
+        unpacked = {i: ids[i] for i, digest in enumerate(digests) if digest is None}
+        return b"".join(digest or bytes(16) for digest in digests), unpacked
+
+    @staticmethod
+    def _pack_texts(texts):
+        """
+        Pack texts as UTF-8 into one buffer.
+        :return: Tuple of (buffer, end offsets starting with 0, dict of index ->
+            value for the values that are not encodable text and are packed empty).
+        """
+        encoded = []
+        unpacked = {}
+        for i, text in enumerate(texts):
+            try:
+                encoded.append(text.encode("utf-8"))
+            except (AttributeError, UnicodeEncodeError):  # Not text, or lone surrogates
+                encoded.append(b"")
+                unpacked[i] = text
+        ends = array.array("Q", itertools.accumulate(map(len, encoded), initial=0))
+        return b"".join(encoded), ends, unpacked
+
+    def __len__(self):
+        return len(self.correct_masks)
+
+    def _check(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+
+    def question_id(self, position):
+        """Id of the question at a position, without decoding it."""
+        self._check(position)
+        extra = self.extras.get(position)
+        if extra is not None and "id" in extra[0]:
+            return extra[0]["id"]
+        return self.question_ids[position * 16 : position * 16 + 16].hex()
+
+    def answer_id_list(self, position):
+        """Ids of the answers of the question at a position, in order."""
+        self._check(position)
+        start, end = self.answer_starts[position], self.answer_starts[position + 1]
+        answer_extras = self.extras.get(position, ({}, {}))[1]
+        return [
+            (
+                answer_extras[i]["id"]
+                if i in answer_extras and "id" in answer_extras[i]
+                else self.answer_ids[j * 16 : j * 16 + 16].hex()
+            )
+            for i, j in enumerate(range(start, end))
+        ]
+
+    def question(self, position):
+        """Decode the question at a position into its dict form."""
+        question_extra, answer_extras = self.extras.get(position, ({}, {}))
+        answer_ids = self.answer_id_list(position)
+        start = self.answer_starts[position]
+        correct_mask = self.correct_masks[position]
+        answers = []
+        for i, answer_id in enumerate(answer_ids):
+            begin, end = self.value_ends[start + i], self.value_ends[start + i + 1]
+            answer = {
+                "value": self.values[begin:end].decode("utf-8"),
+                "correct": bool(correct_mask >> i & 1),
+                "id": answer_id,
+            }
+            answer.update(answer_extras.get(i, ()))
+            answers.append(answer)
+        begin, end = self.description_ends[position : position + 2]
+        question = {
+            "description": self.descriptions[begin:end].decode("utf-8"),
+            "answers": answers,
+        }
+        question.update(question_extra)
+        question.setdefault("id", self.question_id(position))
+        return question
+
+    def to_questions(self):
+        """Decode all questions, as load_questions returns them."""
+        return [self.question(position) for position in range(len(self))]
+
+    def find(self, question_id):
+        """Position of the question with the given id, or None."""
+        target = id_digest(question_id)
+        if target is None:
+            for position, (question_extra, _) in self.extras.items():
+                if question_extra.get("id") == question_id:
+                    return position
+            return None
+        if self._order is None:
+            # Positions sorted by id, built on the first lookup
+            ids = self.question_ids
+            self._order = array.array(
+                "I", sorted(range(len(self)), key=lambda p: ids[p * 16 : p * 16 + 16])
+            )
+        ids = self.question_ids
+        low, high = 0, len(self._order)
+        while low < high:
+            middle = (low + high) // 2
+            if ids[self._order[middle] * 16 : self._order[middle] * 16 + 16] < target:
+                low = middle + 1
+            else:
+                high = middle
+        # Questions whose id has no digest hold zeros, which a real id may match
+        for position in self._order[low:]:
+            if ids[position * 16 : position * 16 + 16] != target:
+                break
+            if self.question_id(position) == question_id:
+                return position
+        return None
+
+    def positions(self, exclude=()):
+        """Positions of all questions whose id is not in exclude."""
+        if not exclude:
+            return list(range(len(self)))
+        digests = {id_digest(question_id) for question_id in exclude}
+        renamed = {
+            position
+            for position, (question_extra, _) in self.extras.items()
+            if "id" in question_extra
+        }
+        ids = self.question_ids
+        # Only compare the ids themselves where the digests cannot tell
+        return [
+            position
+            for position in range(len(self))
+            if ids[position * 16 : position * 16 + 16] not in digests
+            and position not in renamed
+            or self.question_id(position) not in exclude
+        ]
+
+    def answer_mask(self, position, answer_ids):
+        """
+        Pack selected answer ids into a bitmask in the layout of correct_masks.
+        :return: The bitmask, or None if an id is not an answer of the question.
+        """
+        bits = {}
+        for i, answer_id in enumerate(self.answer_id_list(position)):
+            bits.setdefault(answer_id, 1 << i)
+        mask = 0
+        for answer_id in answer_ids:
+            bit = bits.get(answer_id)
+            if bit is None:
+                return None
+            mask |= bit
+        return mask
+
+    def mask_answer_ids(self, position, mask):
+        """Ids of the answers whose bits are set in a mask, in answer order."""
+        return [
+            answer_id
+            for i, answer_id in enumerate(self.answer_id_list(position))
+            if mask >> i & 1
+        ]
+
+    def is_correct(self, position, mask):
+        """Whether a packed selection is exactly the correct answers."""
+        return mask == self.correct_masks[position]
+
+
+class CompactExam:
+    """
+    Completed test held as a QuestionTable of its questions and one answer
+    bitmask per question, instead of a dict per result. Selections a mask does
+    not spell out exactly (answers given out of order, twice, or unknown to the
+    question) are also kept as given, so to_exam() gives back the dict that
+    from_exam() was given.
+    """
+
+    __slots__ = ("header", "questions", "selected", "answer_lists")
+
+    def __init__(self, header, questions, selected, answer_lists=None):
+        self.header = header
+        self.questions = questions
+        self.selected = selected
+        self.answer_lists = answer_lists or {}
+
+    @classmethod
+    def from_exam(cls, exam_data):
+        """
+        Pack a test in the format of load_exam and save_exam.
+        :raises ValueError: If a question has more than 64 answers.
+        """
+        results = exam_data["questions"]
+        questions = QuestionTable(result["question"] for result in results)
+        selected = array.array("Q")
+        answer_lists = {}
+        for position, result in enumerate(results):
+            user_answer = result["user_answer"]
+            mask = questions.answer_mask(position, user_answer)
+            if mask is None:
+                # An unknown answer is never correct: use a mask that never matches
+                mask = ~questions.correct_masks[position] & 0xFFFFFFFFFFFFFFFF
+            if questions.mask_answer_ids(position, mask) != user_answer:
+                answer_lists[position] = user_answer
+            selected.append(mask)
+        # Keep the place of the results among the fields
+        header = {k: (None if k == "questions" else v) for k, v in exam_data.items()}
+        return cls(header, questions, selected, answer_lists)
+
+    def __len__(self):
+        return len(self.selected)
+
+    def user_answer(self, position):
+        """Selected answer ids of the result at a position."""
+        if position in self.answer_lists:
+            return self.answer_lists[position]
+        return self.questions.mask_answer_ids(position, self.selected[position])
+
+    def correct(self):
+        """Whether each result is correct, in order."""
+        return [
+            selected == correct
+            for selected, correct in zip(self.selected, self.questions.correct_masks)
+        ]
+
+    def score(self):
+        """Number of correctly answered questions."""
+        return sum(self.correct())
+
+    def to_exam(self):
+        """Unpack the test into the format of load_exam and save_exam."""
+        results = [
+            {
+                "question": self.questions.question(position),
+                "user_answer": self.user_answer(position),
+            }
+            for position in range(len(self))
+        ]
+        return {k: (results if k == "questions" else v) for k, v in self.header.items()}
+
+
+def read_answer_sheets(path):
+    """Read answer sheets from a JSON array or a JSON Lines file."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
@@ -0,0 +1,661 @@
+"""Saving tests and reading statistics from the test history."""
+
+import json
+import os
+import datetime
+import time
+import contextlib
+from collections import OrderedDict
+
+from .aliases import load_question_aliases, question_aliases_version
+from .bank import load_question_ids
+from .constants import (
+    ADAPTIVE_REBUILD_SECONDS,
+    ALIASES_FILE,
+    DATABASE_FILE,
+    PARALLEL_SCAN_MIN_TESTS,
+    QUESTION_STORE_FILE,
+    REVIEW_INITIAL_EASE,
+    SCAN_CACHE_SIZE,
+    STATISTICS_BATCH_SIZE,
+    STATS_INDEX_FILE,
+    STATS_INDEX_VERSION,
+)
+from .database import QuizDatabase, open_database
+from .dedup import DEDUP_THRESHOLD, find_near_duplicates
+from .grading import answer_bits
+from .instrument import timed
+from .model import (
+    canonical_question,
+    exam_name,
+    is_answer_correct,
+    question_key,
+    unique_exam_name,
+)
+from .scheduling import ReviewQueue, WeightedSampler, adaptive_weight, review_question
+from .storage import (
+    add_to_question_store,
+    append_exams_to_history,
+    exams_dir_of,
+    get_done_tests,
+    get_file_catalog,
+    load_exam,
+    read_catalog,
+    read_history_log,
+    read_question_store,
+    read_stored_questions,
+    repair_catalog,
+)
+from .workers import process_pool, scan_workers
+
+# Id and correct-answer bitmask of stored questions, keyed by store path and key
+_question_masks = {}
+# Scanned tests keyed by (path, version), least recently used first
+_scanned_exams = OrderedDict()
+# Review queues keyed by exams directory, with the number of tests they include
+_review_queues = {}
+# Adaptive test samplers keyed by exams directory, with the bank and history
+# versions they were built from
+_adaptive_samplers = {}
+
+
+@timed("save_exam")
+def save_exam(exam_dir, exam_data, name=None):
+    """Save test results to the exam log."""
+    exam_path = save_exams(exam_dir, [exam_data], [name])[0]
+    print(f"\nResults saved at: {exam_path}")
+
+
+def save_exams(exam_dir, exams, names=None):
+    """
+    Save several completed tests to the exam log, updating the statistics index once.
+    The tests are appended to the question store, the exam log shard of the
+    current month and the catalog with one write each, and synced to disk
+    before returning. If the exams directory has a
+    database, the tests are saved to it in one transaction instead.
+    :param exam_dir: Directory containing completed tests.
+    :param exams: Completed tests.
+    :param names: Names to save the tests under, or None to name them after the
+        current time. A test whose name is already in the log is not saved again.
+    :return: List of the saved tests' paths.
+    """
+    os.makedirs(exam_dir, exist_ok=True)
+    database = open_database(exam_dir)
+    if database is not None:
+        previous_version = database.last_exam()
+        names = names or [None] * len(exams)
+        names = database.add_exams(
+            [(name, exam_data, None) for exam_data, name in zip(exams, names)]
+        )
+        aliases = load_question_aliases(exam_dir)
+        answered = {
+            aliases.get(result["question"]["id"], result["question"]["id"])
+            for exam_data in exams
+            for result in exam_data["questions"]
+        }
+        update_adaptive_sampler(
+            exam_dir, previous_version, history_question_stats(exam_dir, answered)
+        )
+        return [f"{database.path}#{name}" for name in names]
+
+    catalog = read_catalog(exam_dir)["tests"]
+    index = load_stats_index(exam_dir)
+    # Taken after loading the index, which may fold in tests added by hand
+    previous_version = history_version(exam_dir)
+    taken_names = set(index["exams"]) | set(catalog)
+    indexed = len(index["exams"])
+    aliases = load_question_aliases(exam_dir)
+    saved_names = []
+    keyed_questions = []
+    records = []
+    reviewed = set()
+    for exam_data, name in zip(exams, names or [None] * len(exams)):
+        now = datetime.datetime.now()
+        if name is None:
+            name = unique_exam_name(now, taken_names)
+        saved_names.append(name)
+        if name in catalog:
+            continue
+        taken_names.add(name)
+
+        keys = []
+        for result in exam_data["questions"]:
+            question = canonical_question(result["question"])
+            keys.append(question_key(question))
+            keyed_questions.append((keys[-1], question))
+        records.append((name, exam_data, now.timestamp(), keys))
+        # Fold the new exam into the statistics index instead of rescanning
+        scanned = reduce_exam(name, exam_data, keys, aliases)
+        add_exam_to_stats_index(index, scanned)
+        reviewed.update(question_id for question_id, _, _ in scanned["results"])
+
+    if records:
+        # The questions go first, so the log never refers to a missing question
+        add_to_question_store(exam_dir, keyed_questions, sync=True)
+        append_exams_to_history(exam_dir, records, sync=True)
+        save_stats_index(exam_dir, index)
+        # Reschedule the answered questions instead of rebuilding the review queue
+        cached = _review_queues.get(exam_dir)
+        if cached is not None and cached[0] == indexed:
+            for question_id in reviewed:
+                cached[1].push(question_id, index["questions"][question_id]["due"])
+            _review_queues[exam_dir] = (len(index["exams"]), cached[1])
+        update_adaptive_sampler(
+            exam_dir,
+            previous_version,
+            history_question_stats(exam_dir, reviewed, index),
+        )
+        # The catalog may have been rebuilt since it was read above
+        catalog = read_catalog(exam_dir)["tests"]
+    return [catalog[name]["path"] for name in saved_names]
+
+
+def reduce_exam(exam_name, exam_data, keys, aliases=None):
+    """
+    Reduce a completed test to what the statistics index needs.
+    :param exam_name: Name of the completed test.
+    :param exam_data: Completed test.
+    :param keys: Question store keys of the test's questions.
+    :param aliases: Dict of old question id -> new question id to count under.
+    :return: Dict with the name, timestamp and (question id, key, correct) per result.
+    """
+    aliases = aliases or {}
+    results = []
+    for key, result in zip(keys, exam_data["questions"]):
+        question = result["question"]
+        is_correct = is_answer_correct(question, result["user_answer"])
+        results.append((aliases.get(question["id"], question["id"]), key, is_correct))
+    return {"name": exam_name, "timestamp": exam_data["timestamp"], "results": results}
+
+
+def scan_exam(exam_path):
+    """Load a completed test and reduce it for the statistics index."""
+    log_path, _, name = exam_path.rpartition("#")
+    if log_path and os.path.basename(log_path) != DATABASE_FILE:
+        return scan_logged_exam(log_path, name)
+    exam_data = load_exam(exam_path)
+    keyed_questions = []
+    for result in exam_data["questions"]:
+        question = canonical_question(result["question"])
+        keyed_questions.append((question_key(question), question))
+    scanned = reduce_exam(
+        exam_name(exam_path),
+        exam_data,
+        [key for key, _ in keyed_questions],
+        load_question_aliases(exams_dir_of(exam_path)),
+    )
+    # Tests saved as separate files may have questions missing from the store
+    scanned["questions"] = keyed_questions if "#" not in exam_path else []
+    return scanned
+
+
+def scan_logged_exam(log_path, name):
+    """
+    Reduce an entry of the exam log without building its results as dicts.
+    The log refers to stored questions by key and to the selected answers by
+    position, so each result is graded by comparing the bitmask of its selection
+    with the correct-answer mask of the stored question.
+    """
+    offset, _ = read_history_log(log_path)[name]
+    with open(log_path, "rb") as f:
+        f.seek(offset)
+        record = json.loads(f.readline())
+    exams_dir = exams_dir_of(log_path)
+    keys = [key for key, _ in record["questions"]]
+    masks = stored_question_masks(os.path.join(exams_dir, QUESTION_STORE_FILE), keys)
+    aliases = load_question_aliases(exams_dir)
+    results = []
+    for key, (_, answer_indexes) in zip(keys, record["questions"]):
+        question_id, correct_mask = masks[key]
+        # Answers are logged by the position of the first answer with their id
+        selected_mask = 0
+        for i in answer_indexes:
+            selected_mask |= 1 << i
+        results.append(
+            (aliases.get(question_id, question_id), key, selected_mask == correct_mask)
+        )
+    return {
+        "name": name,
+        "timestamp": record["timestamp"],
+        "results": results,
+        "questions": [],
+    }
+
+
+def stored_question_masks(store_path, keys):
+    """
+    Id and correct-answer bitmask of stored questions, decoding each question
+    once per process.
+    :param store_path: Path of the question store.
+    :param keys: Keys of the questions needed.
+    :return: Dict of question key -> (question id, correct-answer bitmask), in
+        the layout of answer_bits.
+    """
+    masks = _question_masks.setdefault(store_path, {})
+    missing = [key for key in dict.fromkeys(keys) if key not in masks]
+    for key, question in zip(missing, read_stored_questions(store_path, missing)):
+        masks[key] = (question["id"], answer_bits(question, max_answers=None)[1])
+    return masks
+
+
+def exam_version(exam_path):
+    """
+    Value that changes whenever a completed test is rewritten, or None if its
+    file was deleted.
+    """
+    if "#" in exam_path:
+        log_path, _, name = exam_path.rpartition("#")
+        if os.path.basename(log_path) == DATABASE_FILE:
+            return 0  # Saved tests are never changed
+        return read_history_log(log_path)[name][0]  # Log entries never change
+    try:
+        return os.path.getmtime(exam_path)
+    except FileNotFoundError:
+        return None
+
+
+@timed("history_scan")
+def scan_history(exam_paths, workers=None):
+    """
+    Load and reduce completed tests, fanning parsing out across processes.
+    Scans are cached by path and version, and by the version of the question
+    aliases they were made with, so repeated calls reuse work.
+    :param exam_paths: Completed tests to scan.
+    :param workers: Number of processes; defaults to scan_workers().
+    :return: List of reduced tests, in the order of exam_paths. Test files
+        deleted by hand since they were listed are left out, and dropped from
+        the catalog.
+    """
+    workers = workers or scan_workers()
+    directories = [exams_dir_of(path) for path in exam_paths]
+    aliases = {
+        directory: question_aliases_version(directory) for directory in set(directories)
+    }
+    cache_keys = []
+    deleted_from = set()
+    for path, directory in zip(exam_paths, directories):
+        version = exam_version(path)
+        if version is None:
+            deleted_from.add(directory)
+        else:
+            cache_keys.append((path, version, aliases[directory]))
+    for directory in deleted_from:
+        repair_catalog(directory)
+    missing = [key[0] for key in cache_keys if key not in _scanned_exams]
+
+    if workers > 1 and len(missing) >= PARALLEL_SCAN_MIN_TESTS:
+        # Forked workers inherit the already parsed log and store indexes
+        with process_pool(workers) as executor:
+            chunksize = max(1, len(missing) // (workers * 4))
+            scanned = dict(
+                zip(missing, executor.map(scan_exam, missing, chunksize=chunksize))
+            )
+    else:
+        scanned = {path: scan_exam(path) for path in missing}
+
+    results = []
+    for cache_key in cache_keys:
+        if cache_key[0] in scanned:
+            # Callers store the questions of a fresh scan; the cache can drop them
+            results.append(scanned[cache_key[0]])
+            _scanned_exams[cache_key] = {**results[-1], "questions": []}
+        else:
+            _scanned_exams.move_to_end(cache_key)
+            results.append(_scanned_exams[cache_key])
+    while len(_scanned_exams) > SCAN_CACHE_SIZE:
+        _scanned_exams.popitem(last=False)
+    return results
+
+
+def add_exam_to_stats_index(index, scanned):
+    """Add the results of one reduced test to the statistics index."""
+    index["exams"].append(scanned["name"])
+    reviewed_at = datetime.datetime.fromisoformat(scanned["timestamp"]).timestamp()
+    for question_id, key, is_correct in scanned["results"]:
+        stats = index["questions"].setdefault(
+            question_id,
+            {
+                "key": key,
+                "attempts": 0,
+                "correct_count": 0,
+                "results": "",
+                "repetitions": 0,
+                "interval": 0,
+                "ease": REVIEW_INITIAL_EASE,
+            },
+        )
+        stats["key"] = key  # Keep the most recent version of the question
+        stats["attempts"] += 1
+        if is_correct:
+            stats["correct_count"] += 1
+        stats["results"] += "1" if is_correct else "0"
+        stats["last_seen"] = scanned["timestamp"]
+        review_question(stats, is_correct, reviewed_at)
+
+
+def get_due_question_keys(exams_dir, num_questions, now=None):
+    """
+    Get the store keys of the questions most overdue for review.
+    :param exams_dir: Directory containing completed tests.
+    :param num_questions: Largest number of questions to get.
+    :param now: time.time() to compare due times with; defaults to now.
+    :return: List of question store keys, most overdue first.
+    """
+    now = time.time() if now is None else now
+    database = open_database(exams_dir)
+    if database is not None:
+        return database.due_keys(num_questions, now)
+    index = load_stats_index(exams_dir)
+    return [
+        index["questions"][question_id]["key"]
+        for question_id in review_queue(exams_dir, index).due(
+            index["questions"], num_questions, now
+        )
+    ]
+
+
+def review_queue(exams_dir, index):
+    """The cached review queue of an exams directory, rebuilt if tests were added."""
+    cached = _review_queues.get(exams_dir)
+    if cached is None or cached[0] != len(index["exams"]):
+        cached = _review_queues[exams_dir] = (
+            len(index["exams"]),
+            ReviewQueue(index["questions"]),
+        )
+    return cached[1]
+
+
+def history_question_stats(exams_dir, question_ids=None, index=None):
+    """
+    Attempts, correct answers and time of the last answer of answered questions,
+    from the statistics index or the database.
+    :param exams_dir: Directory containing completed tests.
+    :param question_ids: Only these questions; every answered question by default.
+    :param index: Statistics index already loaded, to read instead of the files.
+    :return: Dict of question id -> (attempts, correct count, last seen as
+        time.time()).
+    """
+    database = open_database(exams_dir) if index is None else None
+    if database is not None:
+        rows = database.question_stats(question_ids)
+    else:
+        questions = (index or load_stats_index(exams_dir))["questions"]
+        if question_ids is not None:
+            questions = {
+                question_id: questions[question_id]
+                for question_id in question_ids
+                if question_id in questions
+            }
+        rows = (
+            (question_id, stats["attempts"], stats["correct_count"], stats["last_seen"])
+            for question_id, stats in questions.items()
+        )
+    return {
+        question_id: (
+            attempts,
+            correct_count,
+            datetime.datetime.fromisoformat(last_seen).timestamp(),
+        )
+        for question_id, attempts, correct_count, last_seen in rows
+    }
+
+
+def history_version(exams_dir):
+    """Value that changes whenever tests are added to the history."""
+    database = open_database(exams_dir)
+    if database is not None:
+        return database.last_exam()
+    try:
+        stat = os.stat(os.path.join(exams_dir, STATS_INDEX_FILE))
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_adaptive_positions(data_file, exams_dir, num_questions, now=None):
+    """
+    Pick questions of the bank for an adaptive test, drawn by adaptive_weight.
+    The weighted sampler is cached per exams directory and updated as tests are
+    saved. It is rebuilt when the bank changes, when tests are added by another
+    session, and after ADAPTIVE_REBUILD_SECONDS so the recency damping decays.
+    :param data_file: JSON file containing an array of questions.
+    :param exams_dir: Directory containing completed tests.
+    :param num_questions: Number of questions to pick; fewer if the bank is smaller.
+    :param now: time.time() to weigh recency against; defaults to now.
+    :return: List of bank positions, for load_questions_at.
+    """
+    now = time.time() if now is None else now
+    stat = os.stat(data_file)
+    bank = (os.path.abspath(data_file), stat.st_size, stat.st_mtime_ns)
+    cached = _adaptive_samplers.get(exams_dir)
+    if (
+        cached is None
+        or cached["bank"] != bank
+        or cached["history"] != history_version(exams_dir)
+        or now - cached["built_at"] > ADAPTIVE_REBUILD_SECONDS
+    ):
+        ids = load_question_ids(data_file)
+        stats = history_question_stats(exams_dir)
+        unseen = (0, 0, None)
+        cached = _adaptive_samplers[exams_dir] = {
+            "bank": bank,
+            "history": history_version(exams_dir),
+            "built_at": now,
+            "positions": {question_id: i for i, question_id in enumerate(ids)},
+            "sampler": WeightedSampler(
+                adaptive_weight(*stats.get(question_id, unseen), now)
+                for question_id in ids
+            ),
+        }
+    return cached["sampler"].sample(num_questions)
+
+
+def update_adaptive_sampler(exams_dir, previous_version, stats):
+    """
+    Reweigh the answered questions in the cached adaptive sampler after tests
+    were saved, instead of rebuilding it.
+    :param exams_dir: Directory containing completed tests.
+    :param previous_version: history_version() before the tests were saved; a
+        sampler of any other version is dropped, as it misses other tests.
+    :param stats: Statistics of the answered questions, as from
+        history_question_stats.
+    """
+    cached = _adaptive_samplers.get(exams_dir)
+    if cached is None:
+        return
+    if cached["history"] != previous_version:
+        del _adaptive_samplers[exams_dir]
+        return
+    now = time.time()
+    for question_id, question_stats in stats.items():
+        position = cached["positions"].get(question_id)
+        if position is not None:
+            cached["sampler"].update(position, adaptive_weight(*question_stats, now))
+    cached["history"] = history_version(exams_dir)
+
+
+def add_tests_to_stats_index(exams_dir, index, exam_paths):
+    """Scan completed tests and add them to the statistics index."""
+    for scanned in scan_history(exam_paths):
+        if scanned["questions"]:
+            add_to_question_store(exams_dir, scanned["questions"])
+        add_exam_to_stats_index(index, scanned)
+
+
+def save_stats_index(exams_dir, index):
+    """Write the statistics index atomically next to the completed tests."""
+    index_path = os.path.join(exams_dir, STATS_INDEX_FILE)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, index_path)
+
+
+def rebuild_stats_index(exams_dir):
+    """Rebuild the statistics index from every completed test."""
+    index = {
+        "version": STATS_INDEX_VERSION,
+        "aliases": question_aliases_version(exams_dir),
+        "exams": [],
+        "questions": {},
+    }
+    _review_queues.pop(exams_dir, None)
+    add_tests_to_stats_index(
+        exams_dir, index, get_done_tests(exams_dir, order="oldest")
+    )
+    if os.path.isdir(exams_dir):
+        save_stats_index(exams_dir, index)
+    return index
+
+
+@timed("history_index")
+def load_stats_index(exams_dir):
+    """
+    Load the per-question statistics index for completed tests.
+    Tests added outside the app are folded in, and the index is rebuilt
+    if any test it contains has been removed or the question aliases changed.
+    :param exams_dir: Directory containing completed tests.
+    :return: Index with attempts, correct count, last seen and review state per
+        question id.
+    """
+    index_path = os.path.join(exams_dir, STATS_INDEX_FILE)
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return rebuild_stats_index(exams_dir)
+
+    done_tests = get_done_tests(exams_dir, order="oldest")
+    done_names = {exam_name(test) for test in done_tests}
+    if (
+        index.get("version") != STATS_INDEX_VERSION
+        or index.get("aliases") != question_aliases_version(exams_dir)
+        or not done_names.issuperset(index["exams"])
+    ):
+        return rebuild_stats_index(exams_dir)
+
+    indexed = set(index["exams"])
+    new_tests = [test for test in done_tests if exam_name(test) not in indexed]
+    if new_tests:
+        add_tests_to_stats_index(exams_dir, index, new_tests)
+        save_stats_index(exams_dir, index)
+    return index
+
+
+def stored_descriptions(exams_dir):
+    """(question id, description) of every question version in the test history."""
+    database = open_database(exams_dir)
+    if database is not None:
+        return database.descriptions()
+    load_stats_index(exams_dir)  # Adds the questions of per-exam files to the store
+    store_path = os.path.join(exams_dir, QUESTION_STORE_FILE)
+    keys = list(read_question_store(store_path))
+    return [
+        (question["id"], question["description"])
+        for question in read_stored_questions(store_path, keys)
+    ]
+
+
+def link_changed_questions(exams_dir, questions, threshold=DEDUP_THRESHOLD):
+    """
+    Link questions of the test history that are no longer in the bank to the
+    near-duplicate bank question they were edited into, so that their
+    statistics carry over and they count as seen.
+    :param exams_dir: Directory containing completed tests.
+    :param questions: (question id, description) of each question in the bank.
+    :param threshold: Least estimated similarity (0 - 1) of an old and a new version.
+    :return: Dict of old question id -> new question id, for the new links.
+    """
+    aliases = load_question_aliases(exams_dir)
+    bank_ids = {question_id for question_id, _ in questions}
+    # Old versions already linked to a question in the bank are left alone
+    old_questions = dict(
+        (question_id, description)
+        for question_id, description in stored_descriptions(exams_dir)
+        if question_id not in bank_ids and aliases.get(question_id) not in bank_ids
+    )
+    if not old_questions:
+        return {}
+    ids = [question_id for question_id, _ in questions] + list(old_questions)
+    texts = [description for _, description in questions] + list(old_questions.values())
+    links = {}
+    for i, j, similarity in find_near_duplicates(texts, threshold):
+        # Bank questions come first, so i is in the bank when j is an old version
+        if i < len(questions) <= j:
+            if similarity > links.get(ids[j], (None, 0))[1]:
+                links[ids[j]] = (ids[i], similarity)
+    links = {old_id: new_id for old_id, (new_id, _) in links.items()}
+    if not links:
+        return {}
+
+    aliases_path = os.path.join(exams_dir, ALIASES_FILE)
+    try:
+        with open(aliases_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        saved = {}
+    # A question edited back to an old version is no longer linked away from it
+    saved = {
+        old_id: new_id for old_id, new_id in saved.items() if old_id not in bank_ids
+    }
+    saved.update(links)
+    tmp_path = f"{aliases_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(saved, f, indent=4)
+    os.replace(tmp_path, aliases_path)
+
+    # Fold the statistics of the old ids into the new ones; the statistics index
+    # is rebuilt on its next load, as it records the aliases it was built with
+    database = open_database(exams_dir)
+    if database is not None:
+        database.link_questions(load_question_aliases(exams_dir))
+    return links
+
+
+def import_database(exams_dir):
+    """
+    Copy the exam log and the per-exam JSON files of an exams directory into its
+    SQLite database, which is used instead of them from then on.
+    Tests already in the database are skipped, so the import can be run again,
+    for instance after more test files were copied into the directory. A new
+    database is built next to the history as quiz.db.tmp and only moved into
+    place once every test is imported, since the history is hidden as soon as
+    the database exists.
+    :param exams_dir: Directory containing completed tests.
+    :return: Number of imported tests.
+    """
+    os.makedirs(exams_dir, exist_ok=True)
+    repair_catalog(exams_dir)  # Lists files copied in since the catalog was written
+    database = open_database(exams_dir)
+    tmp_path = None
+    if database is None:
+        tmp_path = os.path.join(exams_dir, f"{DATABASE_FILE}.tmp")
+        # Left behind by an interrupted import
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path + suffix)
+        database = QuizDatabase(tmp_path)
+    count = 0
+    batch = []
+    for entry in get_file_catalog(exams_dir, "oldest"):
+        name = os.path.splitext(entry["name"])[0]
+        if name in database:
+            continue
+        batch.append((name, load_exam(entry["path"]), entry["saved_at"]))
+        if len(batch) == STATISTICS_BATCH_SIZE:
+            database.add_exams(batch)
+            count += len(batch)
+            batch = []
+    database.add_exams(batch)
+    if tmp_path is not None:
+        database.close()  # Checkpoints the write-ahead log into the file
+        os.replace(tmp_path, os.path.join(exams_dir, DATABASE_FILE))
+    return count + len(batch)
+
+
+def get_questions_from_done_tests(exams_dir):
+    """Get all questions that have been in old tests."""
+    database = open_database(exams_dir)
+    if database is not None:
+        return database.question_ids()
+    return set(load_stats_index(exams_dir)["questions"])
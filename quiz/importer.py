@@ -0,0 +1,331 @@
+"""Importing new questions from CSV and JSON Lines files."""
+
+import json
+import os
+import re
+import string
+import struct
+import itertools
+import contextlib
+from collections import deque
+
+from .bank import MappedBank, iter_json_array
+from .constants import (
+    IMPORT_BATCH_SIZE,
+    IMPORT_ERRORS_SHOWN,
+    IMPORT_FORMATS,
+    MAX_ANSWERS,
+    STREAM_CHUNK_SIZE,
+)
+from .deps import csv, hashlib
+from .instrument import timed
+from .model import md5_hash
+from .workers import process_pool
+
+
+def import_format(source_file):
+    """Format of an import source, from its file extension."""
+    extension = os.path.splitext(source_file)[1].lower()
+    if extension not in IMPORT_FORMATS:
+        raise ValueError(
+            f"Cannot tell the format of {source_file}; expected one of "
+            + ", ".join(IMPORT_FORMATS)
+        )
+    return IMPORT_FORMATS[extension]
+
+
+def csv_import_columns(source_file):
+    """
+    Find the columns of a CSV import source from its header row.
+    :param source_file: CSV file of questions.
+    :return: Dict of the positions of the "description" and "correct" columns, the
+        "answers" columns in order, the "tags" column or None, and the "width"
+        of the header row.
+    """
+    with open(source_file, "r", newline="", encoding="utf-8-sig") as f:
+        header = [name.strip().lower() for name in next(csv.reader(f), [])]
+    columns = {
+        "answers": [i for i, name in enumerate(header) if name.startswith("answer")],
+        "tags": header.index("tags") if "tags" in header else None,
+        "width": len(header),
+    }
+    for name in ("description", "correct"):
+        if name not in header:
+            raise ValueError(f"{source_file} has no {name!r} column")
+        columns[name] = header.index(name)
+    if not columns["answers"]:
+        raise ValueError(f"{source_file} has no answer columns")
+    return columns
+
+
+def iter_import_records(source_file, source_format):
+    """
+    Read the records of an import source one at a time, leaving the parsing of
+    lines and rows to check_import_batch.
+    :param source_file: CSV, JSON Lines or JSON array file of questions.
+    :param source_format: "csv", "jsonl" or "json".
+    :return: Generator of (line or element number, record), where the record is a
+        line of JSON, a CSV row after the header or a decoded array element.
+    """
+    if source_format == "json":
+        yield from enumerate(iter_json_array(source_file), 1)
+        return
+    with open(source_file, "r", newline="", encoding="utf-8-sig") as f:
+        if source_format == "jsonl":
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    yield number, line
+            return
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if any(cell.strip() for cell in row):
+                yield reader.line_num, row
+
+
+def question_from_csv(columns, row):
+    """Build a question from a CSV row, given the columns of csv_import_columns."""
+    cells = row + [""] * (columns["width"] - len(row))
+    values = [cells[i] for i in columns["answers"]]
+    correct = set()
+    # Letters of the correct answers, as typed in a test: "B", "A,C" or "AC". They
+    # name answer columns, so they are resolved before blank answers are dropped
+    for letter in re.sub(r"[\s,;]", "", cells[columns["correct"]]).upper():
+        position = string.ascii_uppercase.find(letter)
+        if not 0 <= position < len(values) or not values[position].strip():
+            raise ValueError(f"Correct answer {letter!r} is not one of the answers")
+        correct.add(position)
+    question = {
+        "description": cells[columns["description"]],
+        "answers": [
+            {"value": value, "correct": i in correct}
+            for i, value in enumerate(values)
+            if value.strip()
+        ],
+    }
+    if columns["tags"] is not None and cells[columns["tags"]].strip():
+        tags = cells[columns["tags"]].split(";")
+        question["tags"] = [tag.strip() for tag in tags if tag.strip()]
+    return question
+
+
+def validate_question(question):
+    """
+    Check that a question can be asked and graded.
+    :param question: Question as stored in the question bank.
+    :raise ValueError: Describing the first problem found.
+    """
+    if not isinstance(question, dict):
+        raise ValueError("Question is not an object")
+    description = question.get("description")
+    if not isinstance(description, str) or not description.strip():
+        raise ValueError("Question has no description")
+    answers = question.get("answers")
+    if not isinstance(answers, list) or not 2 <= len(answers) <= MAX_ANSWERS:
+        raise ValueError(f"Question needs 2 to {MAX_ANSWERS} answers")
+    answer_ids = set()
+    for letter, answer in zip(string.ascii_uppercase, answers):
+        if not isinstance(answer, dict):
+            raise ValueError(f"Answer {letter} is not an object")
+        value = answer.get("value")
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"Answer {letter} has no value")
+        if not isinstance(answer.get("correct"), bool):
+            raise ValueError(f"Answer {letter} is not marked correct or incorrect")
+        answer_id = md5_hash(value)
+        if answer_id in answer_ids:
+            raise ValueError(f"Answer {letter} repeats an earlier answer")
+        answer_ids.add(answer_id)
+    if not any(answer["correct"] for answer in answers):
+        raise ValueError("No answer is marked correct")
+    tags = question.get("tags", [])
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError("Tags are not a list of strings")
+
+
+def check_import_batch(source_format, columns, records):
+    """
+    Parse, validate and hash a batch of import records; run in worker processes.
+    :param source_format: "csv", "jsonl" or "json".
+    :param columns: Columns of a CSV source, from csv_import_columns.
+    :param records: List of (number, record) from iter_import_records.
+    :return: List of (number, question id digest, question as a line of JSON) for
+        valid records, and of (number, None, error message) for the others.
+    """
+    results = []
+    for number, record in records:
+        try:
+            if source_format == "csv":
+                question = question_from_csv(columns, record)
+            elif source_format == "jsonl":
+                question = json.loads(record)
+            else:
+                question = record
+            validate_question(question)
+        except ValueError as e:
+            if isinstance(e, json.JSONDecodeError):
+                e = f"Invalid JSON: {e}"
+            results.append((number, None, str(e)))
+            continue
+        # Ids are calculated from the text when the bank is loaded
+        question.pop("id", None)
+        for answer in question["answers"]:
+            answer.pop("id", None)
+        # One line per question: indenting with the json module is far slower
+        data = json.dumps(question, ensure_ascii=False)
+        results.append(
+            (
+                number,
+                hashlib.md5(question["description"].encode("utf-8")).digest(),
+                data.encode("utf-8"),
+            )
+        )
+    return results
+
+
+def check_import_batches(executor, source_format, columns, batches, backlog):
+    """
+    Check batches of import records, across an executor's processes if one is
+    given, and yield the results in order. At most backlog batches are in
+    flight, so the source is never read far ahead of the bank being written.
+    """
+    if executor is None:
+        for batch in batches:
+            yield check_import_batch(source_format, columns, batch)
+        return
+    pending = deque()
+    for batch in batches:
+        pending.append(
+            executor.submit(check_import_batch, source_format, columns, batch)
+        )
+        if len(pending) >= backlog:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def bank_question_digests(data_file):
+    """
+    Ids of the questions in the bank, as digests. They are read from the mapped
+    bank if it is current, and the question file is streamed otherwise.
+    """
+    if not os.path.exists(data_file):
+        return set()
+    with contextlib.suppress(OSError, ValueError, struct.error):
+        with MappedBank(data_file) as bank:
+            if bank.is_current(data_file):
+                return {
+                    bytes.fromhex(bank.question_id(position))
+                    for position in range(len(bank))
+                }
+    return {
+        hashlib.md5(question["description"].encode("utf-8")).digest()
+        for question in iter_json_array(data_file)
+    }
+
+
+def copy_array_head(path, out):
+    """
+    Copy a JSON array file up to the end of its last element, leaving it open.
+    :param path: JSON file containing an array; a missing file counts as empty.
+    :param out: Binary file to copy into.
+    :return: Whether the array has any elements.
+    """
+    if not os.path.exists(path):
+        out.write(b"[")
+        return False
+    with open(path, "rb") as f:
+        tail_start = max(0, f.seek(0, os.SEEK_END) - STREAM_CHUNK_SIZE)
+        f.seek(tail_start)
+        tail = f.read().rstrip()
+        if not tail.endswith(b"]"):
+            raise ValueError(f"{path} does not contain a JSON array")
+        head = tail[:-1].rstrip()
+        remaining = tail_start + len(head)
+        f.seek(0)
+        while remaining:
+            chunk = f.read(min(remaining, STREAM_CHUNK_SIZE))
+            out.write(chunk)
+            remaining -= len(chunk)
+    return not head.endswith(b"[")
+
+
+@timed("bank_import")
+def import_questions(
+    data_file, sources, source_format=None, workers=None, error_file=None, progress=None
+):
+    """
+    Add the valid, new questions of CSV, JSON Lines or JSON array files to the
+    question bank. Sources are streamed in batches that are parsed, validated and
+    hashed across processes, so memory use grows only with the number of ids.
+    The bank is replaced atomically, and left alone if no question is added.
+    :param data_file: JSON file containing an array of questions; created if missing.
+    :param sources: Files of questions to import.
+    :param source_format: "csv", "jsonl" or "json"; by default taken from the
+        extension of each source.
+    :param workers: Number of processes; defaults to the number of CPUs.
+    :param error_file: Write the rejected records to this JSON Lines file.
+    :param progress: Called with the counts after each batch.
+    :return: Dict with the counts of records "read", questions "added", questions
+        already in the bank ("existing") and "invalid" records, and the first
+        "errors" as (source, number, message).
+    """
+    workers = workers or os.cpu_count() or 1
+    formats = [source_format or import_format(source) for source in sources]
+    # Read the CSV headers before anything is written
+    columns = [
+        csv_import_columns(source) if kind == "csv" else None
+        for source, kind in zip(sources, formats)
+    ]
+    existing = bank_question_digests(data_file)
+    added = set()
+    counts = {"read": 0, "added": 0, "existing": 0, "invalid": 0, "errors": []}
+    tmp_file = f"{data_file}.tmp"
+    try:
+        with contextlib.ExitStack() as stack:
+            out = stack.enter_context(open(tmp_file, "wb"))
+            errors = executor = None
+            if error_file:
+                errors = stack.enter_context(open(error_file, "w", encoding="utf-8"))
+            if workers > 1:
+                executor = stack.enter_context(process_pool(workers))
+            separator = b",\n  " if copy_array_head(data_file, out) else b"\n  "
+            for source, kind, source_columns in zip(sources, formats, columns):
+                records = iter_import_records(source, kind)
+                batches = iter(
+                    lambda: list(itertools.islice(records, IMPORT_BATCH_SIZE)), []
+                )
+                for results in check_import_batches(
+                    executor, kind, source_columns, batches, workers * 2
+                ):
+                    for number, digest, data in results:
+                        counts["read"] += 1
+                        if digest in existing:
+                            counts["existing"] += 1
+                            continue
+                        if digest in added:
+                            data = f"Repeats question {digest.hex()} of the import"
+                        elif digest is not None:
+                            added.add(digest)
+                            out.write(separator)
+                            out.write(data)
+                            separator = b",\n  "
+                            continue
+                        counts["invalid"] += 1
+                        if errors:
+                            record = {"source": source, "record": number, "error": data}
+                            errors.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        if len(counts["errors"]) < IMPORT_ERRORS_SHOWN:
+                            counts["errors"].append((source, number, data))
+                    counts["added"] = len(added)
+                    if progress:
+                        progress(counts)
+            out.write(b"\n]\n")
+            out.flush()
+            os.fsync(out.fileno())
+        if added:
+            os.replace(tmp_file, data_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return counts
@@ -0,0 +1,103 @@
+"""Phase timings and profiling for ``--instrument`` and ``--profile``."""
+
+import json
+import time
+import sys
+import functools
+import contextlib
+import io
+
+from .deps import cProfile, pstats, tracemalloc
+
+# (phase, start, duration) of the session; None unless instrumentation is on
+_phase_timings = None
+
+
+def phase(name):
+    """Context manager timing a phase of the session, when instrumentation is on."""
+    if _phase_timings is None:
+        return contextlib.nullcontext()
+    return _timed_phase(name)
+
+
+@contextlib.contextmanager
+def _timed_phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phase_timings.append((name, start, time.perf_counter() - start))
+
+
+def timed(name):
+    """Decorator recording every call of a function as a phase of the session."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _phase_timings is None:
+                return func(*args, **kwargs)
+            with _timed_phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def run_instrumented(func, report_file, profile=False):
+    """
+    Run func while recording phase timings, then write them to report_file.
+    :param func: Function to run, usually the whole session.
+    :param report_file: JSON file for the timings.
+    :param profile: Also run cProfile and tracemalloc; the cProfile data is
+        written to <report_file>.prof and a readable summary to <report_file>.txt.
+    """
+    global _phase_timings
+    _phase_timings = []
+    profiler = None
+    if profile:
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    session_start = time.perf_counter()
+    try:
+        return func()
+    finally:
+        session_time = time.perf_counter() - session_start
+        if profiler:
+            profiler.disable()
+        summary = {}
+        for name, _, duration in _phase_timings:
+            stats = summary.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["total"] += duration
+            stats["max"] = max(stats["max"], duration)
+        for stats in summary.values():
+            stats["mean"] = stats["total"] / stats["count"]
+        report = {
+            "session_time": session_time,
+            # Phase times are inclusive: a phase includes the phases it calls
+            "phases": dict(sorted(summary.items(), key=lambda x: -x[1]["total"])),
+            "events": [
+                {"phase": name, "start": start - session_start, "duration": duration}
+                for name, start, duration in _phase_timings
+            ],
+        }
+        _phase_timings = None
+
+        if profiler:
+            snapshot = tracemalloc.take_snapshot()
+            report["memory"] = {
+                "peak": tracemalloc.get_traced_memory()[1],
+                "top": [str(stat) for stat in snapshot.statistics("lineno")[:25]],
+            }
+            tracemalloc.stop()
+            profiler.dump_stats(f"{report_file}.prof")
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(40)
+            with open(f"{report_file}.txt", "w", encoding="utf-8") as f:
+                f.write(text.getvalue())
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"\nInstrumentation report saved at: {report_file}", file=sys.stderr)
@@ -0,0 +1,189 @@
+"""Answer journal for resuming interrupted tests."""
+
+import json
+import os
+import datetime
+
+from .constants import JOURNAL_DIR, QUESTION_STORE_FILE
+from .database import open_database
+from .model import canonical_question
+from .storage import read_catalog, read_stored_questions, store_questions
+
+
+def stored_answer_ids(questions):
+    """Answer ids of each question in the order the question store keeps them."""
+    return [
+        [ans["id"] for ans in canonical_question(question)["answers"]]
+        for question in questions
+    ]
+
+
+def answer_positions(answer_ids, ids):
+    """
+    Positions of answer ids in a question's list of answer ids. Answers with the
+    same text share an id, so each position is used once: repeated ids take the
+    positions of the id in turn.
+    """
+    positions = {}
+    for position, answer_id in enumerate(answer_ids):
+        positions.setdefault(answer_id, []).append(position)
+    taken = {}
+    result = []
+    for answer_id in ids:
+        count = taken.get(answer_id, 0)
+        result.append(positions[answer_id][count])
+        taken[answer_id] = count + 1
+    return result
+
+
+class AnswerJournal:
+    """
+    Append-only journal of a test in progress, so that an interrupted test can be
+    resumed.
+    The first line describes the test; then every answer, and the elapsed time
+    once per second, are appended as they happen. Each line is written to the
+    file at once, so it survives the process being killed, but fsync is left to
+    sync(), which the session calls at most once per second.
+    """
+
+    def __init__(self, path, header, results, elapsed, end):
+        self.path = path
+        self.name = header["name"]
+        self.time_limit = header["time_limit"]
+        self.pass_condition = header["pass_condition"]
+        self.results = results
+        self.elapsed = elapsed
+        self._end = end
+        self._file = None  # Opened on the first append
+        self._dirty = False
+        self._answer_ids = stored_answer_ids([result["question"] for result in results])
+
+    @classmethod
+    def start(cls, exams_dir, results, time_limit, pass_condition):
+        """Start the journal of a new test, with its questions in display order."""
+        journal_dir = os.path.join(exams_dir, JOURNAL_DIR)
+        os.makedirs(journal_dir, exist_ok=True)
+        questions = [result["question"] for result in results]
+        keys = store_questions(exams_dir, questions, sync=True)
+
+        now = datetime.datetime.now()
+        name = base_name = f"exam_{now.strftime('%Y%m%d_%H%M%S_%f')}"
+        suffix = 1
+        while os.path.exists(os.path.join(journal_dir, f"{name}.jsonl")):
+            name = f"{base_name}_{suffix}"
+            suffix += 1
+        # Answers are journaled as indexes into the stored answer order, and the
+        # order they are displayed in is kept so a resumed test looks the same
+        orders = []
+        for question, answer_ids in zip(questions, stored_answer_ids(questions)):
+            ids = [ans["id"] for ans in question["answers"]]
+            orders.append(answer_positions(answer_ids, ids))
+        header = {
+            "name": name,
+            "started_at": now.timestamp(),
+            "time_limit": time_limit,
+            "pass_condition": pass_condition,
+            "questions": [list(pair) for pair in zip(keys, orders)],
+        }
+        path = os.path.join(journal_dir, f"{name}.jsonl")
+        line = json.dumps(header, ensure_ascii=False, separators=(",", ":")) + "\n"
+        # Create the file only once the header is complete
+        with open(path + ".tmp", "wb") as f:
+            f.write(line.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return cls(path, header, results, 0.0, len(line.encode("utf-8")))
+
+    @classmethod
+    def open(cls, exams_dir, path):
+        """Reopen the journal of an interrupted test, replaying its answers."""
+        with open(path, "rb") as f:
+            data = f.read()
+        # A crash can leave the last line partially written; it is ignored
+        end = data.rfind(b"\n") + 1
+        lines = data[:end].splitlines()
+        header = json.loads(lines[0])
+        # Journals keep their questions in the store file, even with a database
+        questions = read_stored_questions(
+            os.path.join(exams_dir, QUESTION_STORE_FILE),
+            [key for key, _ in header["questions"]],
+        )
+        answer_ids = stored_answer_ids(questions)
+        results = []
+        for question, (_, order) in zip(questions, header["questions"]):
+            question["answers"] = [question["answers"][i] for i in order]
+            results.append({"question": question, "user_answer": []})
+        elapsed = 0.0
+        for line in lines[1:]:
+            record = json.loads(line)
+            if "i" in record:
+                results[record["i"]]["user_answer"] = [
+                    answer_ids[record["i"]][i] for i in record["answer"]
+                ]
+            elapsed = record["elapsed"]
+        return cls(path, header, results, elapsed, end)
+
+    def _append(self, record):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+            # Cut off a line left partially written by a crash
+            if self._file.seek(0, os.SEEK_END) > self._end:
+                self._file.truncate(self._end)
+        self._file.write(
+            (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        )
+        self._file.flush()
+        self._dirty = True
+
+    def record_answer(self, index, user_answer, elapsed):
+        """Record the answer given to a question."""
+        self.elapsed = elapsed
+        self._append(
+            {
+                "i": index,
+                "answer": answer_positions(self._answer_ids[index], user_answer),
+                "elapsed": round(elapsed, 3),
+            }
+        )
+
+    def record_time(self, elapsed):
+        """Record the time spent on the test so far."""
+        self.elapsed = elapsed
+        self._append({"elapsed": round(elapsed, 3)})
+
+    def sync(self):
+        """Flush the journal to disk, if anything was appended since the last sync."""
+        if self._dirty:
+            self._dirty = False
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """Remove the journal of a test that has been saved."""
+        os.remove(self.path)
+
+
+def get_interrupted_tests(exams_dir):
+    """Get the journals of tests interrupted before they were saved, oldest first."""
+    journal_dir = os.path.join(exams_dir, JOURNAL_DIR)
+    if not os.path.isdir(journal_dir):
+        return []
+    saved = open_database(exams_dir)
+    if saved is None:
+        saved = read_catalog(exams_dir)["tests"]
+    journals = []
+    for entry in os.scandir(journal_dir):
+        if not entry.name.endswith(".jsonl"):
+            continue
+        if entry.name[: -len(".jsonl")] in saved:
+            # Saved, but interrupted before its journal was removed
+            os.remove(entry.path)
+            continue
+        journals.append(entry.path)
+    return sorted(journals)
@@ -0,0 +1,117 @@
+"""Questions, tests and grading rules."""
+
+import json
+import os
+import random
+import datetime
+import time
+
+from .deps import hashlib
+from .instrument import phase
+
+
+def md5_hash(text):
+    """Generate MD5 hash from content."""
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def exam_name(exam_path):
+    """Get the display name of a completed test."""
+    if "#" in exam_path:
+        return exam_path.rpartition("#")[2]
+    return os.path.basename(exam_path)
+
+
+def question_key(question):
+    """Content address of a question: MD5 of its canonical JSON form."""
+    return md5_hash(json.dumps(question, ensure_ascii=False, sort_keys=True))
+
+
+def canonical_question(question):
+    """Copy of a question with answers in a stable (id) order."""
+    return {**question, "answers": sorted(question["answers"], key=lambda a: a["id"])}
+
+
+def unique_exam_name(now, taken_names):
+    """Name a test after the time it is saved, adding a suffix if that is taken."""
+    name = base_name = f"exam_{now.strftime('%Y%m%d_%H%M%S_%f')}"
+    suffix = 1
+    while name in taken_names:
+        name = f"{base_name}_{suffix}"
+        suffix += 1
+    return name
+
+
+def finished_exam(results, start_time, time_limit, pass_condition):
+    """
+    Grade a finished test.
+    :param results: List of dicts with "question" and "user_answer".
+    :param start_time: time.time() when the test started.
+    :param time_limit: Test time in minutes.
+    :param pass_condition: Pass condition, e.g. "70%" or "7".
+    :return: The test in the format saved by save_exam.
+    """
+    # Calculate results
+    with phase("grading"):
+        correct_count = grade_results(results)
+    total_questions = len(results)
+    percentage = (correct_count / total_questions) * 100
+    passed = check_pass_condition(pass_condition, correct_count, total_questions)
+
+    # Calculate elapsed time
+    elapsed_time = min(time.time() - start_time, time_limit * 60)
+    elapsed_minutes = int(elapsed_time // 60)
+    elapsed_seconds = int(elapsed_time % 60)
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "questions": results,
+        "score": correct_count,
+        "total": total_questions,
+        "percentage": percentage,
+        "passed": passed,
+        "pass_condition": pass_condition,
+        "elapsed_time": f"{elapsed_minutes:02}:{elapsed_seconds:02}",
+        "time_limit": time_limit,  # Save test time
+    }
+
+
+def is_answer_correct(question, user_answer):
+    """Whether the selected answer ids are exactly the correct answers."""
+    correct_answer_ids = {ans["id"] for ans in question["answers"] if ans["correct"]}
+    return set(user_answer) == correct_answer_ids
+
+
+def selected_positions(answer_ids, user_answer):
+    """
+    Positions of the selected answers in a list of answer ids. Tests saved by
+    older versions hold "NEXT" instead of a list for a question skipped on a
+    retake, which selects nothing; ids that are not in the list are ignored.
+    """
+    if not isinstance(user_answer, list):
+        return []
+    return [answer_ids.index(i) for i in user_answer if i in answer_ids]
+
+
+def grade_results(results):
+    """Count the correctly answered questions of a test."""
+    return sum(
+        is_answer_correct(result["question"], result["user_answer"])
+        for result in results
+    )
+
+
+def check_pass_condition(pass_condition, correct_count, total_questions):
+    """
+    Check a pass condition: a percentage ("70%") or a number of questions ("7").
+    :return: True if the test is passed.
+    """
+    if "%" in pass_condition:
+        percentage = (correct_count / total_questions) * 100 if total_questions else 0
+        return percentage >= float(pass_condition.strip("%"))
+    return correct_count >= int(pass_condition)
+
+
+def shuffle_answers(questions):
+    """Shuffle the order of answers for each question."""
+    for question in questions:
+        random.shuffle(question["answers"])
@@ -0,0 +1,167 @@
+"""Spaced-repetition review queue and weighted question sampling."""
+
+import random
+import array
+import itertools
+import heapq
+
+from .constants import (
+    ADAPTIVE_HALF_LIFE_DAYS,
+    ADAPTIVE_MIN_AGE_DAYS,
+    ADAPTIVE_WEIGHT_SCALE,
+    REVIEW_CORRECT_QUALITY,
+    REVIEW_MIN_EASE,
+    REVIEW_WRONG_QUALITY,
+)
+
+
+def review_question(stats, is_correct, reviewed_at):
+    """
+    Schedule the next review of a question after it was answered, with SM-2.
+    :param stats: Review state of the question: "repetitions" (correct answers
+        in a row), "interval" (days) and "ease". Updated in place, and "due" is
+        set to the time the question is due again.
+    :param is_correct: Whether the question was answered correctly.
+    :param reviewed_at: time.time() when the question was answered.
+    """
+    if is_correct:
+        quality = REVIEW_CORRECT_QUALITY
+        if stats["repetitions"] == 0:
+            stats["interval"] = 1
+        elif stats["repetitions"] == 1:
+            stats["interval"] = 6
+        else:
+            stats["interval"] = round(stats["interval"] * stats["ease"], 2)
+        stats["repetitions"] += 1
+    else:
+        # A wrong answer starts the question over, but it keeps a lower ease
+        quality = REVIEW_WRONG_QUALITY
+        stats["repetitions"] = 0
+        stats["interval"] = 1
+    ease = stats["ease"] + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
+    stats["ease"] = max(REVIEW_MIN_EASE, round(ease, 2))
+    stats["due"] = reviewed_at + stats["interval"] * 86400
+
+
+class ReviewQueue:
+    """
+    Due index of the reviewed questions: a heap of (due, question id).
+    A rescheduled question is pushed again and its old entry is dropped when it
+    reaches the top, so rescheduling costs O(log Q) and picking the N most
+    overdue questions O(N log Q), without scanning every question.
+    """
+
+    def __init__(self, questions):
+        self._build(questions)
+
+    def _build(self, questions):
+        self.heap = [
+            (stats["due"], question_id) for question_id, stats in questions.items()
+        ]
+        heapq.heapify(self.heap)
+
+    def push(self, question_id, due):
+        heapq.heappush(self.heap, (due, question_id))
+
+    def due(self, questions, num_questions, now):
+        """
+        Pick the questions that are due, most overdue first.
+        :param questions: Current review state per question id, to tell which
+            entries are outdated.
+        :param num_questions: Largest number of questions to pick.
+        :param now: time.time() to compare due times with.
+        :return: List of question ids.
+        """
+        if len(self.heap) > 2 * len(questions):
+            self._build(questions)  # Mostly outdated entries; start over
+        picked = {}
+        while self.heap and len(picked) < num_questions and self.heap[0][0] <= now:
+            due, question_id = heapq.heappop(self.heap)
+            if questions[question_id]["due"] == due:
+                picked.setdefault(question_id, due)
+        # Picked questions stay due until a test with them is saved
+        for question_id, due in picked.items():
+            heapq.heappush(self.heap, (due, question_id))
+        return list(picked)
+
+
+class WeightedSampler:
+    """
+    Fenwick tree over integer weights, for weighted draws without replacement.
+    Changing a weight and drawing an item each cost O(log N), so picking N items
+    does not touch the others. Integer weights keep the sums exact however many
+    updates are made.
+    """
+
+    def __init__(self, weights):
+        self.weights = array.array("q", weights)
+        size = len(self.weights)
+        # Node i sums the (i & -i) weights up to item i, a difference of prefix sums
+        prefix = list(itertools.accumulate(self.weights, initial=0))
+        self.tree = array.array("q", [0])
+        self.tree.extend(prefix[i] - prefix[i - (i & -i)] for i in range(1, size + 1))
+        self.total = prefix[-1]
+        self._top = 1 << (size.bit_length() - 1) if size else 0
+
+    def __len__(self):
+        return len(self.weights)
+
+    def update(self, position, weight):
+        """Set the weight of the item at a position."""
+        delta = weight - self.weights[position]
+        self.weights[position] = weight
+        self.total += delta
+        i = position + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _find(self, target):
+        """Position of the item whose share of the total weight covers target."""
+        position = 0
+        step = self._top
+        while step:
+            following = position + step
+            if following < len(self.tree) and self.tree[following] <= target:
+                position = following
+                target -= self.tree[following]
+            step >>= 1
+        return position
+
+    def sample(self, count, rng=random):
+        """
+        Draw items with probability proportional to their weights, without
+        replacement; items of weight 0 are never drawn.
+        :param count: Largest number of items to draw.
+        :param rng: Random number generator.
+        :return: List of positions, in the order they were drawn.
+        """
+        picked = []
+        try:
+            while len(picked) < count and self.total > 0:
+                position = self._find(rng.randrange(self.total))
+                picked.append((position, self.weights[position]))
+                self.update(position, 0)
+        finally:
+            # Picked items stay in the pool for the next test
+            for position, weight in picked:
+                self.update(position, weight)
+        return [position for position, _ in picked]
+
+
+def adaptive_weight(attempts, correct_count, last_seen, now):
+    """
+    Weight of a question in adaptive tests. It is the question's error rate,
+    smoothed towards 1/2 so that questions never answered get a fair share, and
+    damped for a few days after the question was last answered.
+    :param attempts: Number of times the question was answered.
+    :param correct_count: Number of correct answers.
+    :param last_seen: time.time() of the last answer, or None if never answered.
+    :param now: time.time() to measure the time since the last answer from.
+    :return: Integer weight, at least 1.
+    """
+    weight = (attempts - correct_count + 1) / (attempts + 2)
+    if last_seen is not None:
+        days = max(0.0, now - last_seen) / 86400 + ADAPTIVE_MIN_AGE_DAYS
+        weight *= 1 - 0.5 ** (days / ADAPTIVE_HALF_LIFE_DAYS)
+    return max(1, round(weight * ADAPTIVE_WEIGHT_SCALE))
@@ -0,0 +1,209 @@
+"""Full-text search over the question bank."""
+
+import os
+import array
+import bisect
+
+from .bank import file_md5, iter_questions, read_bank_cache, write_bank_cache
+from .constants import (
+    BYTE_BITS,
+    NONZERO_BYTES,
+    SEARCH_INDEX_SUFFIX,
+    SEARCH_INDEX_VERSION,
+    SEARCH_QUERY_TOKEN,
+    SEARCH_TOKEN,
+)
+from .instrument import timed
+
+# Loaded search indexes, keyed by bank path, with the bank's size and mtime
+_search_indexes = {}
+
+
+class SearchIndex:
+    """
+    Inverted index over the descriptions, answer values and tags of a bank.
+    Questions are numbered by their position in the bank, as in load_questions.
+    A term found in few questions keeps the positions of those questions; a term
+    found in many keeps a bitmap with a bit per question, which is smaller.
+    Queries are evaluated on Python ints used as bitsets, so AND, OR and NOT
+    cost one operation per term however many questions match.
+    """
+
+    def __init__(self, data):
+        self.count = data["count"]
+        self.ids = data["ids"]
+        self.positions = data["positions"]
+        self.bitmaps = data["bitmaps"]
+        self.terms = sorted([*self.positions, *self.bitmaps])
+
+    def _bits(self, term):
+        """Bitset of the questions containing a term."""
+        if term in self.bitmaps:
+            return int.from_bytes(self.bitmaps[term], "little")
+        if term not in self.positions:
+            return 0
+        bits = bytearray((self.count + 7) // 8)
+        for position in array.array("I", self.positions[term]):
+            bits[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(bits, "little")
+
+    def _prefix_bits(self, prefix):
+        """Bitset of the questions containing a term that starts with prefix."""
+        bits = 0
+        for i in range(bisect.bisect_left(self.terms, prefix), len(self.terms)):
+            if not self.terms[i].startswith(prefix):
+                break
+            bits |= self._bits(self.terms[i])
+        return bits
+
+    def search(self, query):
+        """
+        Find the questions matching a query.
+        Words must all appear, in any order and case. "OR" and "NOT" (or a
+        leading "-") combine words, parentheses group them, "tag:name" matches a
+        tag and a trailing "*" matches any word starting with the prefix.
+        :param query: Query, e.g. 'bigquery (dataset OR table) -billing tag:gcp'.
+        :return: Sorted positions of the matching questions in the bank.
+        """
+        tokens = SEARCH_QUERY_TOKEN.findall(query)
+        bits, end = self._parse_or(tokens, 0)
+        if end < len(tokens):
+            raise ValueError(f"Unexpected {tokens[end]!r} in query")
+        data = bits.to_bytes((self.count + 7) // 8, "little")
+        if data.count(0) * 2 > len(data):
+            # Few matches: let the regex engine skip the empty bytes
+            return [
+                match.start() * 8 + bit
+                for match in NONZERO_BYTES.finditer(data)
+                for bit in BYTE_BITS[data[match.start()]]
+            ]
+        return [
+            i * 8 + bit
+            for i, byte in enumerate(data)
+            if byte
+            for bit in BYTE_BITS[byte]
+        ]
+
+    def _parse_or(self, tokens, pos):
+        bits, pos = self._parse_and(tokens, pos)
+        while pos < len(tokens) and tokens[pos] == "OR":
+            other, pos = self._parse_and(tokens, pos + 1)
+            bits |= other
+        return bits, pos
+
+    def _parse_and(self, tokens, pos):
+        bits = (1 << self.count) - 1
+        start = pos
+        while pos < len(tokens) and tokens[pos] not in ("OR", ")"):
+            if tokens[pos] == "AND":
+                pos += 1
+                continue
+            other, pos = self._parse_not(tokens, pos)
+            bits &= other
+        if pos == start:
+            raise ValueError("Empty query" if pos == len(tokens) else "Empty group")
+        return bits, pos
+
+    def _parse_not(self, tokens, pos):
+        if pos == len(tokens):
+            raise ValueError("Query ends after NOT")
+        token = tokens[pos]
+        if token == "NOT":
+            bits, pos = self._parse_not(tokens, pos + 1)
+            return ((1 << self.count) - 1) & ~bits, pos
+        if token.startswith("-") and len(token) > 1:
+            return ((1 << self.count) - 1) & ~self._term_bits(token[1:]), pos + 1
+        if token == "(":
+            bits, pos = self._parse_or(tokens, pos + 1)
+            if pos == len(tokens) or tokens[pos] != ")":
+                raise ValueError("Missing ) in query")
+            return bits, pos + 1
+        return self._term_bits(token), pos + 1
+
+    def _term_bits(self, token):
+        if token.startswith("tag:"):
+            return self._bits("tag:" + token[4:].strip('"').lower())
+        words = SEARCH_TOKEN.findall(token.lower())
+        if not words:
+            raise ValueError(f"Nothing to search for in {token!r}")
+        bits = (1 << self.count) - 1
+        for word in words[:-1]:
+            bits &= self._bits(word)
+        if token.endswith("*"):
+            return bits & self._prefix_bits(words[-1])
+        return bits & self._bits(words[-1])
+
+
+def build_search_index(data_file):
+    """
+    Build the search index of a question bank, streaming the bank.
+    :param data_file: JSON file containing an array of questions.
+    :return: The SearchIndex.
+    """
+    stat = os.stat(data_file)
+    key = {
+        "version": SEARCH_INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "digest": file_md5(data_file),
+    }
+    ids = []
+    postings = {}
+    for position, question in enumerate(
+        iter_questions(data_file, with_answer_ids=False)
+    ):
+        ids.append(question["id"])
+        text = " ".join(
+            [question["description"], *(ans["value"] for ans in question["answers"])]
+        )
+        terms = set(SEARCH_TOKEN.findall(text.lower()))
+        terms.update("tag:" + tag.lower() for tag in question.get("tags", ()))
+        for term in terms:
+            postings.setdefault(term, array.array("I")).append(position)
+
+    count = len(ids)
+    data = {"count": count, "ids": ids, "positions": {}, "bitmaps": {}}
+    for term, positions in postings.items():
+        # A bitmap takes count / 8 bytes, a list of positions 4 bytes per question
+        if len(positions) * 32 > count:
+            bits = bytearray((count + 7) // 8)
+            for position in positions:
+                bits[position >> 3] |= 1 << (position & 7)
+            data["bitmaps"][term] = bytes(bits)
+        else:
+            data["positions"][term] = positions.tobytes()
+    try:
+        write_bank_cache(data_file + SEARCH_INDEX_SUFFIX, key, data)
+    except OSError:
+        pass  # A read-only bank directory just means no cache
+    return SearchIndex(data)
+
+
+@timed("search_index")
+def open_search_index(data_file):
+    """
+    Load the search index of a question bank, building it if the bank changed.
+    The index is cached next to the bank and kept in memory once loaded.
+    :param data_file: JSON file containing an array of questions.
+    :return: The SearchIndex.
+    """
+    stat = os.stat(data_file)
+    cached = _search_indexes.get(data_file)
+    if cached and cached[0] == (stat.st_size, stat.st_mtime_ns):
+        return cached[1]
+
+    index_file = data_file + SEARCH_INDEX_SUFFIX
+    index = None
+    try:
+        key, _ = read_bank_cache(index_file, key_only=True)
+        if key.get("version") == SEARCH_INDEX_VERSION and (
+            (key["size"], key["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns)
+            or key["digest"] == file_md5(data_file)
+        ):
+            index = SearchIndex(read_bank_cache(index_file)[1])
+    except (OSError, EOFError, ValueError, TypeError, AttributeError, KeyError):
+        pass
+    if index is None:
+        index = build_search_index(data_file)
+    _search_indexes[data_file] = ((stat.st_size, stat.st_mtime_ns), index)
+    return index
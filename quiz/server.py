@@ -0,0 +1,353 @@
+"""Quiz server and client over TCP or a Unix socket."""
+
+import json
+import os
+import random
+import time
+
+from .aliases import load_question_aliases
+from .bank import load_questions, open_bank
+from .constants import MESSAGE_LIMIT, SERVER_DEADLINE_GRACE
+from .deps import asyncio, concurrent_futures
+from .grading import QuestionTable
+from .history import get_questions_from_done_tests, save_exams
+from .instrument import phase
+from .journal import AnswerJournal
+from .model import check_pass_condition, finished_exam, shuffle_answers
+from .terminal import print_results, run_session
+
+
+async def send_message(writer, message):
+    """Send one JSON Lines message over a connection."""
+    writer.write(
+        (json.dumps(message, ensure_ascii=False, separators=(",", ":")) + "\n").encode(
+            "utf-8"
+        )
+    )
+    await writer.drain()
+
+
+async def receive_message(reader):
+    """Receive one JSON Lines message, or None when the connection is closed."""
+    line = await reader.readline()
+    return json.loads(line) if line else None
+
+
+class QuizServer:
+    """
+    Serves tests to many candidates at once from one process.
+    The bank and the set of questions already taken are loaded once. Each
+    connection takes one test: the server samples the questions, journals the
+    answers, submits the test at its deadline and grades it; the client only
+    displays questions and sends answers. Finished tests are saved in batches, so
+    the statistics index is rewritten once per batch instead of once per test.
+    """
+
+    def __init__(self, data_file, exams_dir):
+        self.exams_dir = exams_dir
+        self.bank = open_bank(data_file)
+        # Without a built bank, hold the questions in a compact table
+        self.questions = (
+            None if self.bank is not None else QuestionTable(load_questions(data_file))
+        )
+        self.seen_questions = get_questions_from_done_tests(exams_dir)
+        # Files of the exams directory are only written from this one thread
+        self._io = concurrent_futures.ThreadPoolExecutor(max_workers=1)
+        self._journals = set()
+        self._pending = []
+        self._saving = None
+
+    def close(self):
+        self._io.shutdown()
+        if self.bank is not None:
+            self.bank.close()
+
+    def _sample(self, num_questions, exclude):
+        bank = self.bank if self.bank is not None else self.questions
+        positions = bank.positions(exclude)
+        positions = random.sample(positions, min(num_questions, len(positions)))
+        return [bank.question(position) for position in positions]
+
+    async def _run_io(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io, func, *args)
+
+    async def _save(self, exam_data, name):
+        """Save a finished test, together with the tests finishing around it."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((exam_data, name, future))
+        if self._saving is None or self._saving.done():
+            self._saving = asyncio.ensure_future(self._save_pending())
+        return await future
+
+    async def _save_pending(self):
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                paths = await self._run_io(
+                    save_exams,
+                    self.exams_dir,
+                    [exam_data for exam_data, _, _ in batch],
+                    [name for _, name, _ in batch],
+                )
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            # Counted under their new ids, as get_questions_from_done_tests does
+            aliases = await self._run_io(load_question_aliases, self.exams_dir)
+            for (exam_data, _, future), path in zip(batch, paths):
+                for result in exam_data["questions"]:
+                    question_id = result["question"]["id"]
+                    self.seen_questions.add(aliases.get(question_id, question_id))
+                future.set_result(path)
+
+    async def sync_journals(self):
+        """Sync the journals of all running tests to disk once per second."""
+        while True:
+            await asyncio.sleep(1)
+            for journal in list(self._journals):
+                await self._run_io(journal.sync)
+
+    async def handle(self, reader, writer):
+        """Serve one candidate's test over a connection."""
+        session = None
+        try:
+            while True:
+                request = await receive_message(reader)
+                if request is None:
+                    break
+                if not isinstance(request, dict):
+                    await send_message(
+                        writer, {"ok": False, "error": "A request must be an object."}
+                    )
+                    continue
+                try:
+                    if request["op"] == "start" and session is None:
+                        session = await self._start(request)
+                        response = {
+                            "ok": True,
+                            "remaining": session["deadline"] - time.time(),
+                            "time_limit": session["time_limit"],
+                            # The client is not told which answers are correct
+                            "questions": [
+                                {
+                                    "id": result["question"]["id"],
+                                    "description": result["question"]["description"],
+                                    "answers": [
+                                        {"id": ans["id"], "value": ans["value"]}
+                                        for ans in result["question"]["answers"]
+                                    ],
+                                }
+                                for result in session["results"]
+                            ],
+                        }
+                    elif request["op"] == "answer" and session is not None:
+                        response = self._answer(session, request)
+                    elif request["op"] == "submit" and session is not None:
+                        exam_data, exam_path = await self._finish(session)
+                        response = {
+                            "ok": True,
+                            "timed_out": session["timed_out"],
+                            "saved_at": exam_path,
+                            "exam": {
+                                k: v for k, v in exam_data.items() if k != "questions"
+                            },
+                        }
+                    else:
+                        response = {"ok": False, "error": "Unexpected request."}
+                except (KeyError, ValueError, TypeError) as e:
+                    response = {"ok": False, "error": str(e)}
+                # Answers are not waited for, so responses name their request
+                response["op"] = request.get("op")
+                await send_message(writer, response)
+        except (ConnectionError, ValueError):
+            pass  # A test is still submitted at its deadline
+        finally:
+            writer.close()
+
+    async def _start(self, request):
+        num_questions = int(request["questions"])
+        time_limit = int(request["time_limit"])
+        pass_condition = str(request["pass_condition"])
+        check_pass_condition(pass_condition, 0, 1)  # Reject a malformed condition
+        exclude = self.seen_questions if request.get("skip_seen") else set()
+        with phase("sampling"):
+            questions = self._sample(num_questions, exclude)
+        if not questions:
+            raise ValueError("No new questions to take.")
+        shuffle_answers(questions)
+        results = [{"question": q, "user_answer": []} for q in questions]
+        journal = await self._run_io(
+            AnswerJournal.start, self.exams_dir, results, time_limit, pass_condition
+        )
+        self._journals.add(journal)
+        session = {
+            "results": results,
+            "journal": journal,
+            "time_limit": time_limit,
+            "pass_condition": pass_condition,
+            "start_time": time.time(),
+            "timed_out": False,
+            "finished": None,
+        }
+        session["deadline"] = session["start_time"] + time_limit * 60
+
+        def submit_at_deadline():
+            session["timed_out"] = True
+            asyncio.ensure_future(self._finish(session))
+
+        # Allow for the answer in flight when the client's timer runs out
+        session["timer"] = asyncio.get_running_loop().call_later(
+            time_limit * 60 + SERVER_DEADLINE_GRACE, submit_at_deadline
+        )
+        return session
+
+    def _answer(self, session, request):
+        if session["finished"] is not None:
+            return {"ok": False, "error": "The test is over."}
+        index = int(request["index"])
+        if not 0 <= index < len(session["results"]):
+            raise ValueError(f"No question {index} in the test.")
+        result = session["results"][index]
+        answer_ids = [ans["id"] for ans in result["question"]["answers"]]
+        user_answer = list(request["answer"])
+        # Answers with the same text share an id, so an id may be given that often
+        if any(user_answer.count(i) > answer_ids.count(i) for i in user_answer):
+            raise ValueError(f"Unknown answer id for question {index}.")
+        result["user_answer"] = user_answer
+        # Queued on the I/O thread without waiting for a save in progress there;
+        # the thread runs its tasks in order, so the journal keeps the answer order
+        self._io.submit(
+            session["journal"].record_answer,
+            index,
+            user_answer,
+            time.time() - session["start_time"],
+        )
+        return {"ok": True, "index": index}
+
+    async def _finish(self, session):
+        """Grade and save a test once, however many times it is submitted."""
+        if session["finished"] is None:
+            session["timer"].cancel()
+            session["finished"] = asyncio.ensure_future(self._grade_and_save(session))
+        return await session["finished"]
+
+    async def _grade_and_save(self, session):
+        journal = session["journal"]
+        self._journals.discard(journal)
+        await self._run_io(journal.close)
+        exam_data = finished_exam(
+            session["results"],
+            session["start_time"],
+            session["time_limit"],
+            session["pass_condition"],
+        )
+        exam_path = await self._save(exam_data, journal.name)
+        await self._run_io(journal.remove)
+        return exam_data, exam_path
+
+
+async def serve(data_file, exams_dir, host="127.0.0.1", port=8765, socket_path=None):
+    """Run the quiz server until it is interrupted."""
+    os.makedirs(exams_dir, exist_ok=True)
+    server = QuizServer(data_file, exams_dir)
+    if socket_path:
+        listener = await asyncio.start_unix_server(
+            server.handle, socket_path, limit=MESSAGE_LIMIT
+        )
+        print(f"Serving tests on {socket_path}", flush=True)
+    else:
+        listener = await asyncio.start_server(
+            server.handle, host, port, limit=MESSAGE_LIMIT
+        )
+        print(f"Serving tests on {host}:{port}", flush=True)
+    syncing = asyncio.ensure_future(server.sync_journals())
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        syncing.cancel()
+        server.close()
+
+
+class RemoteAnswers:
+    """
+    Sends the answers of a session to the quiz server as they are given.
+    Used by run_session in place of an AnswerJournal; the server keeps the journal.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def record_answer(self, index, user_answer, elapsed):
+        message = {"op": "answer", "index": index, "answer": user_answer}
+        self.writer.write(
+            (json.dumps(message, separators=(",", ":")) + "\n").encode("utf-8")
+        )
+
+    def record_time(self, elapsed):
+        pass
+
+    def sync(self):
+        pass
+
+
+async def open_server_connection(host="127.0.0.1", port=8765, socket_path=None):
+    """Connect to a quiz server over TCP or a Unix socket."""
+    if socket_path:
+        return await asyncio.open_unix_connection(socket_path, limit=MESSAGE_LIMIT)
+    return await asyncio.open_connection(host, port, limit=MESSAGE_LIMIT)
+
+
+async def take_remote_test(connection, settings):
+    """
+    Take a test served by a quiz server.
+    :param connection: Arguments of open_server_connection.
+    :param settings: Test settings: "questions", "time_limit", "pass_condition"
+        and "skip_seen".
+    :return: The server's response to the submitted test.
+    """
+    reader, writer = await open_server_connection(**connection)
+    try:
+        await send_message(writer, {"op": "start", **settings})
+        response = await receive_message(reader)
+        if not response["ok"]:
+            return response
+        results = [{"question": q, "user_answer": []} for q in response["questions"]]
+        start_time = time.time() - (response["time_limit"] * 60 - response["remaining"])
+        await run_session(
+            results,
+            response["time_limit"],
+            start_time,
+            journal=RemoteAnswers(writer),
+        )
+        await send_message(writer, {"op": "submit"})
+        # Skip the responses to the answers sent during the session
+        while True:
+            response = await receive_message(reader)
+            if response is None or response["op"] != "answer":
+                return response
+    finally:
+        writer.close()
+
+
+def run_client(connection):
+    """Ask for the test settings, then take a test served by a quiz server."""
+    skip_seen = (
+        input("Skip questions already done in previous tests? (y/n): ").strip().lower()
+        == "y"
+    )
+    settings = {
+        "skip_seen": skip_seen,
+        "questions": int(input("Number of questions: ")),
+        "time_limit": int(input("Test time (minutes): ")),
+        "pass_condition": input("Pass condition (e.g., 70% or 7 questions): ").strip(),
+    }
+    response = asyncio.run(take_remote_test(connection, settings))
+    if response is None:
+        print("The server closed the connection.")
+    elif not response["ok"]:
+        print(response["error"])
+    else:
+        print_results(response["exam"], response["timed_out"])
+        print(f"\nResults saved at: {response['saved_at']}")
@@ -0,0 +1,487 @@
+"""Test files, the test catalog, the question store and the history log."""
+
+import json
+import os
+import datetime
+import contextlib
+
+from .constants import (
+    CATALOG_FIELDS,
+    CATALOG_FILE,
+    DATABASE_FILE,
+    HISTORY_DIR,
+    HISTORY_FILE,
+    MIGRATED_DIR,
+    QUESTION_STORE_FILE,
+)
+from .database import open_database
+from .deps import shutil
+from .files import append_lines, open_locked
+from .instrument import timed
+from .model import canonical_question, question_key, selected_positions
+
+# Parsed history logs, question stores and test catalogs, keyed by path
+_history_logs = {}
+_question_stores = {}
+_catalogs = {}
+
+
+@timed("history_list")
+def get_done_tests(exams_dir, order="newest"):
+    """Get a list of completed tests, can be sorted by newest or oldest."""
+    return [entry["path"] for entry in get_test_catalog(exams_dir, order)]
+
+
+def get_test_catalog(exams_dir, order="newest"):
+    """
+    List the completed tests with what the test list shows, without loading them.
+    :param exams_dir: Directory containing completed tests.
+    :param order: "newest" or "oldest" first.
+    :return: List of dicts with the name, path, saved_at and CATALOG_FIELDS of
+        each test.
+    """
+    database = open_database(exams_dir)
+    if database is not None:
+        return database.catalog(order)
+    return get_file_catalog(exams_dir, order)
+
+
+def get_file_catalog(exams_dir, order="newest"):
+    """Catalog entries of the tests saved as JSON files or in the exam log."""
+    return sorted(
+        read_catalog(exams_dir)["tests"].values(),
+        key=lambda entry: entry["saved_at"],
+        reverse=(order == "newest"),
+    )
+
+
+def catalog_entry(name, file, saved_at, exam_data, end=None):
+    """
+    Catalog line of one completed test.
+    :param name: Name of the test.
+    :param file: Path of the exam log shard or JSON file holding the test,
+        relative to the exams directory.
+    :param saved_at: When the test was saved, as a time.time() value.
+    :param exam_data: Completed test, or its exam log header.
+    :param end: Offset just after the test's line in the exam log shard.
+    """
+    entry = {"name": name, "file": file, "saved_at": saved_at}
+    entry.update((field, exam_data.get(field)) for field in CATALOG_FIELDS)
+    if end is not None:
+        entry["end"] = end
+    return entry
+
+
+def read_catalog(exams_dir):
+    """
+    Index the catalog of completed tests, reading only newly appended lines.
+    The catalog is rebuilt if it is missing, or if test files or exam log
+    shards were copied into or deleted from the exams directory by hand, which
+    is only checked when the directory's modification time changes. When it
+    is first read, tests left out of it by a crash between appending to the
+    exam log and to the catalog are added.
+    :param exams_dir: Directory containing completed tests.
+    :return: Dict with "tests", a dict of test name -> catalog entry including
+        the test's path, and "ends", a dict of exam log shard -> offset just
+        after its last catalogued test.
+    """
+    catalog_path = os.path.join(exams_dir, CATALOG_FILE)
+    if not os.path.exists(catalog_path):
+        if not os.path.isdir(exams_dir):
+            return {"tests": {}, "ends": {}}
+        repair_catalog(exams_dir)
+    catalog = _catalogs.get(catalog_path)
+    stat = os.stat(catalog_path)
+    size = stat.st_size
+    # A catalog rebuilt by another session is a new file, not a longer one
+    recover = catalog is None or size < catalog["size"] or stat.st_ino != catalog["ino"]
+    if recover:
+        catalog = _catalogs[catalog_path] = {
+            "size": 0,
+            "ino": stat.st_ino,
+            "tests": {},
+            "ends": {},
+        }
+    if size > catalog["size"]:
+        with open(catalog_path, "rb") as f:
+            f.seek(catalog["size"])
+            data = f.read(size - catalog["size"])
+        data = data[: data.rfind(b"\n") + 1]  # Ignore a partially written last line
+        catalog["size"] += len(data)
+        # Decode all new lines with one call, as the items of a JSON array
+        lines = data.decode("utf-8").rstrip("\n").replace("\n", ",")
+        files = {}
+        for entry in json.loads(f"[{lines}]"):
+            file = entry["file"]
+            if file not in files:
+                files[file] = os.path.join(exams_dir, file)
+            if "end" in entry:
+                entry["path"] = f"{files[file]}#{entry['name']}"
+                # Sessions saving at once may catalog their tests out of order
+                catalog["ends"][file] = max(entry["end"], catalog["ends"].get(file, 0))
+            else:
+                entry["path"] = files[file]
+            catalog["tests"][entry["name"]] = entry
+    if recover:
+        missing = []
+        for file in history_shards(exams_dir):
+            end = catalog["ends"].get(file, 0)
+            if os.path.getsize(os.path.join(exams_dir, file)) > end:
+                # Tests are matched by name, as the crashed session's test may
+                # come before tests catalogued by other sessions
+                missing.extend(
+                    entry
+                    for entry in log_catalog_entries(exams_dir, file)
+                    if entry["name"] not in catalog["tests"]
+                )
+        if missing:
+            append_to_catalog(exams_dir, missing)
+    # Taken before listing the directories, so changes made meanwhile are noticed
+    mtimes = exams_dir_mtimes(exams_dir)
+    if catalog.get("mtimes") != mtimes:
+        if catalog_out_of_date(exams_dir, catalog):
+            repair_catalog(exams_dir)
+            return read_catalog(exams_dir)
+        catalog["mtimes"] = mtimes
+    return catalog
+
+
+def exams_dir_mtimes(exams_dir):
+    """Modification times of the exams directory and of its exam log directory."""
+    mtimes = [os.stat(exams_dir).st_mtime_ns]
+    with contextlib.suppress(FileNotFoundError):
+        mtimes.append(os.stat(os.path.join(exams_dir, HISTORY_DIR)).st_mtime_ns)
+    return mtimes
+
+
+def catalog_out_of_date(exams_dir, catalog):
+    """
+    Whether test files or exam log shards were added or removed behind the
+    catalog's back. Only file names are compared, so this is a directory
+    listing, not a read of the tests.
+    """
+    with os.scandir(exams_dir) as files:
+        exam_files = {
+            file.name
+            for file in files
+            if file.name.endswith(".json") and not file.name.startswith(".")
+        }
+    catalogued_files = {
+        entry["file"] for entry in catalog["tests"].values() if "end" not in entry
+    }
+    return exam_files != catalogued_files or set(history_shards(exams_dir)) != set(
+        catalog["ends"]
+    )
+
+
+def history_shards(exams_dir):
+    """Paths of the exam log and its monthly shards, relative to the exams directory."""
+    shards = []
+    if os.path.exists(os.path.join(exams_dir, HISTORY_FILE)):
+        shards.append(HISTORY_FILE)
+    history_dir = os.path.join(exams_dir, HISTORY_DIR)
+    if os.path.isdir(history_dir):
+        with os.scandir(history_dir) as entries:
+            shards.extend(
+                f"{HISTORY_DIR}/{entry.name}"
+                for entry in entries
+                if entry.name.endswith(".jsonl") and entry.is_file()
+            )
+    return sorted(shards)
+
+
+def history_shard(saved_at):
+    """Exam log shard, relative to the exams directory, of a test saved at saved_at."""
+    month = datetime.datetime.fromtimestamp(saved_at).strftime("%Y-%m")
+    return f"{HISTORY_DIR}/{month}.jsonl"
+
+
+def log_catalog_entries(exams_dir, file):
+    """Catalog entries of the tests in an exam log shard."""
+    log_path = os.path.join(exams_dir, file)
+    logged = sorted(read_history_log(log_path).items(), key=lambda item: item[1][0])
+    ends = [offset for _, (offset, _) in logged[1:]]
+    ends.append(_history_logs[log_path]["size"])
+    return [
+        catalog_entry(name, file, header["saved_at"], header, end)
+        for (name, (_, header)), end in zip(logged, ends)
+    ]
+
+
+def append_to_catalog(exams_dir, entries, sync=False):
+    """Append entries to the catalog of completed tests with a single write."""
+    append_lines(
+        os.path.join(exams_dir, CATALOG_FILE),
+        "".join(
+            json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for entry in entries
+        ),
+        sync,
+    )
+    read_catalog(exams_dir)
+
+
+def repair_catalog(exams_dir):
+    """
+    Rebuild the catalog of completed tests from the exam log shards and the
+    per-exam JSON files, for instance after test files were copied into the
+    exams directory or deleted by hand. JSON files are listed with os.scandir
+    and sorted by the time in the test, not by their modification time.
+    :param exams_dir: Directory containing completed tests.
+    :return: Number of tests in the catalog.
+    """
+    catalog_path = os.path.join(exams_dir, CATALOG_FILE)
+    # Sessions appending to the catalog meanwhile wait, then append to the new one
+    with open_locked(catalog_path):
+        entries = []
+        with os.scandir(exams_dir) as files:
+            for file in files:
+                if file.name.endswith(".json") and not file.name.startswith("."):
+                    with open(file.path, "r", encoding="utf-8") as f:
+                        exam_data = json.load(f)
+                    saved_at = datetime.datetime.fromisoformat(exam_data["timestamp"])
+                    entries.append(
+                        catalog_entry(
+                            file.name, file.name, saved_at.timestamp(), exam_data
+                        )
+                    )
+        for file in history_shards(exams_dir):
+            entries.extend(log_catalog_entries(exams_dir, file))
+        entries.sort(key=lambda entry: entry["saved_at"])
+
+        tmp_path = f"{catalog_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(
+                    json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+                )
+        os.replace(tmp_path, catalog_path)
+    _catalogs.pop(catalog_path, None)
+    return len(entries)
+
+
+def exams_dir_of(exam_path):
+    """Exams directory of a completed test's path."""
+    path = exam_path.rpartition("#")[0] or exam_path
+    directory = os.path.dirname(path)
+    if (
+        os.path.basename(directory) == HISTORY_DIR
+        and path.endswith(".jsonl")
+        and os.path.basename(path) != HISTORY_FILE
+    ):
+        return os.path.dirname(directory)  # A monthly exam log shard
+    return directory
+
+
+def read_question_store(store_path):
+    """
+    Index the content-addressed question store, reading only newly appended lines.
+    :param store_path: Path of the question store.
+    :return: Dict of question key -> (byte offset, length).
+    """
+    store = _question_stores.get(store_path)
+    size = os.path.getsize(store_path) if os.path.exists(store_path) else 0
+    if store is None or size < store["size"]:
+        store = _question_stores[store_path] = {"size": 0, "questions": {}}
+    if size > store["size"]:
+        with open(store_path, "rb") as f:
+            f.seek(store["size"])
+            offset = store["size"]
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Ignore a partially written last line
+                # Lines start with ["<32 hex digit key>", so the key is at a fixed place
+                store["questions"][line[2:34].decode("ascii")] = (offset, len(line))
+                offset += len(line)
+            store["size"] = offset
+    return store["questions"]
+
+
+@timed("question_load")
+def load_stored_questions(exams_dir, keys):
+    """Decode the given questions from the question store or the database."""
+    database = open_database(exams_dir)
+    if database is not None:
+        return database.questions(keys)
+    return read_stored_questions(os.path.join(exams_dir, QUESTION_STORE_FILE), keys)
+
+
+def read_stored_questions(store_path, keys):
+    """Decode the given questions from the question store file."""
+    stored = read_question_store(store_path)
+    questions = []
+    with open(store_path, "rb") as f:
+        for key in keys:
+            offset, length = stored[key]
+            f.seek(offset)
+            questions.append(json.loads(f.read(length))[1])
+    return questions
+
+
+def store_questions(exams_dir, questions, sync=False):
+    """Add questions to the question store and return their keys."""
+    keyed_questions = []
+    for question in questions:
+        question = canonical_question(question)
+        keyed_questions.append((question_key(question), question))
+    add_to_question_store(exams_dir, keyed_questions, sync)
+    return [key for key, _ in keyed_questions]
+
+
+def add_to_question_store(exams_dir, keyed_questions, sync=False):
+    """Append (key, canonical question) pairs that are not stored yet."""
+    store_path = os.path.join(exams_dir, QUESTION_STORE_FILE)
+    stored = read_question_store(store_path)
+    lines = {}
+    for key, question in keyed_questions:
+        if key not in stored and key not in lines:
+            lines[key] = (
+                json.dumps([key, question], ensure_ascii=False, separators=(",", ":"))
+                + "\n"
+            )
+    if lines:
+        append_lines(store_path, "".join(lines.values()), sync)
+
+
+def read_history_log(log_path):
+    """
+    Index the append-only exam log without decoding the results.
+    :param log_path: Path of the exam log.
+    :return: Dict of exam name -> (byte offset, header fields), in log order.
+    """
+    log = _history_logs.get(log_path)
+    size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+    if log is None or size < log["size"]:
+        log = _history_logs[log_path] = {"size": 0, "exams": {}}
+    if size > log["size"]:
+        with open(log_path, "rb") as f:
+            f.seek(log["size"])
+            offset = log["size"]
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Ignore a partially written last line
+                # The results come last, so the header can be decoded on its own
+                header = json.loads(line[: line.rindex(b',"questions":')] + b"}")
+                log["exams"][header["name"]] = (offset, header)
+                offset += len(line)
+            log["size"] = offset
+    return log["exams"]
+
+
+def history_record(name, exam_data, saved_at, keys):
+    """Line of the exam log for one test, storing question references only."""
+    results = exam_data["questions"]
+    compact_results = []
+    for key, result in zip(keys, results):
+        answer_ids = [
+            ans["id"] for ans in canonical_question(result["question"])["answers"]
+        ]
+        compact_results.append(
+            [key, selected_positions(answer_ids, result["user_answer"])]
+        )
+
+    record = {"name": name, "saved_at": saved_at}
+    record.update((k, v) for k, v in exam_data.items() if k != "questions")
+    record["questions"] = compact_results
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def append_exam_to_history(exams_dir, name, exam_data, saved_at, keys):
+    """Append one test to the exam log, storing question references only."""
+    return append_exams_to_history(exams_dir, [(name, exam_data, saved_at, keys)])[0]
+
+
+def append_exams_to_history(exams_dir, exams, sync=False):
+    """
+    Append tests to the monthly shards of the exam log and then to the catalog,
+    with one write per file.
+    :param exams_dir: Directory containing completed tests.
+    :param exams: (name, exam data, saved_at, question store keys) per test.
+    :param sync: Whether to fsync the files before returning.
+    :return: List of the tests' paths.
+    """
+    shards = {}
+    for name, exam_data, saved_at, keys in exams:
+        shards.setdefault(history_shard(saved_at), []).append(
+            (name, history_record(name, exam_data, saved_at, keys), saved_at, exam_data)
+        )
+    os.makedirs(os.path.join(exams_dir, HISTORY_DIR), exist_ok=True)
+    entries = []
+    for file, records in shards.items():
+        end = append_lines(
+            os.path.join(exams_dir, file),
+            "".join(record for _, record, _, _ in records),
+            sync,
+        )
+        for name, record, saved_at, exam_data in records:
+            end += len(record.encode("utf-8"))
+            entries.append(catalog_entry(name, file, saved_at, exam_data, end))
+    # The tests go first, so the catalog never lists a missing test
+    append_to_catalog(exams_dir, entries, sync)
+    catalog = read_catalog(exams_dir)["tests"]
+    return [catalog[name]["path"] for name, _, _, _ in exams]
+
+
+def migrate_exams(exams_dir):
+    """
+    Convert per-exam JSON files into the compact exam log.
+    Converted files are moved into a "migrated" subdirectory.
+    :param exams_dir: Directory containing completed tests.
+    :return: Number of converted tests.
+    """
+    if not os.path.isdir(exams_dir):
+        return 0
+    migrated_dir = os.path.join(exams_dir, MIGRATED_DIR)
+    repair_catalog(exams_dir)  # Lists files copied in since the catalog was written
+    catalog = read_catalog(exams_dir)["tests"]
+    legacy_tests = [
+        entry for entry in get_file_catalog(exams_dir, "oldest") if "end" not in entry
+    ]
+    for entry in legacy_tests:
+        name = os.path.splitext(entry["name"])[0]
+        # A test already in the log was converted by an interrupted migration
+        if name not in catalog:
+            exam_data = load_exam(entry["path"])
+            keys = store_questions(
+                exams_dir, [result["question"] for result in exam_data["questions"]]
+            )
+            append_exam_to_history(exams_dir, name, exam_data, entry["saved_at"], keys)
+    # Moved once all are logged, as every change to the exams directory makes
+    # the next catalog read compare it with the catalog
+    for entry in legacy_tests:
+        os.makedirs(migrated_dir, exist_ok=True)
+        shutil.move(entry["path"], os.path.join(migrated_dir, entry["name"]))
+    if legacy_tests:
+        repair_catalog(exams_dir)  # Drops the moved files
+    return len(legacy_tests)
+
+
+@timed("exam_load")
+def load_exam(exam_path):
+    """Load saved test, either a JSON file or an entry of the exam log."""
+    if "#" not in exam_path:
+        with open(exam_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    log_path, _, name = exam_path.rpartition("#")
+    if os.path.basename(log_path) == DATABASE_FILE:
+        return open_database(os.path.dirname(log_path)).load_exam(name)
+    offset, _ = read_history_log(log_path)[name]
+    with open(log_path, "rb") as f:
+        f.seek(offset)
+        record = json.loads(f.readline())
+
+    questions = read_stored_questions(
+        os.path.join(exams_dir_of(log_path), QUESTION_STORE_FILE),
+        [key for key, _ in record["questions"]],
+    )
+    exam_data = {k: v for k, v in record.items() if k not in ("name", "saved_at")}
+    exam_data["questions"] = []
+    for question, (_, answer_indexes) in zip(questions, record["questions"]):
+        exam_data["questions"].append(
+            {
+                "question": question,
+                "user_answer": [question["answers"][i]["id"] for i in answer_indexes],
+            }
+        )
+    return exam_data
@@ -0,0 +1,426 @@
+"""Terminal screen, key reading and the interactive menu."""
+
+import os
+import codecs
+import string
+import time
+import sys
+
+from .constants import ANSI_ESCAPE
+from .deps import asyncio, msvcrt, shutil, termios, tty
+from .history import save_exam
+from .instrument import phase, timed
+from .journal import AnswerJournal
+from .model import finished_exam, shuffle_answers
+
+# Terminal the interactive session draws on, created on first use
+_screen = None
+
+
+class Screen:
+    """
+    Full-screen terminal output with ANSI escape sequences, without starting a
+    process per redraw.
+    A frame is a list of named regions, each a list of lines. Drawing a frame
+    rewrites the screen from the first region that changed since the previous
+    frame, and sends the whole frame with a single write. When the stream is not
+    a terminal, frames are written as plain text instead.
+    """
+
+    def __init__(self, stream=None, ansi=None):
+        self.stream = stream or sys.stdout
+        if ansi is None:
+            ansi = self.stream.isatty() and os.environ.get("TERM") != "dumb"
+            if ansi and os.name == "nt":
+                os.system("")  # Turns on escape sequences in the Windows console
+        self.ansi = ansi
+        # Regions on screen as (name, lines), and the terminal size they fit
+        self.regions = []
+        self.size = None
+
+    def _write(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+
+    def clear(self):
+        """Clear the screen; the next frame is drawn in full."""
+        if self.ansi:
+            self._write("\x1b[H\x1b[2J")
+        self.regions = []
+
+    def draw(self, regions):
+        """
+        Draw a frame. The cursor is left at the end of the last region, which
+        is always rewritten, so it can hold the input prompt.
+        :param regions: List of (name, lines) pairs, top to bottom.
+        """
+        text = ["".join(line + "\n" for line in lines) for _, lines in regions]
+        text[-1] = text[-1][:-1]
+        if not self.ansi:
+            self._write("\n" + "".join(text))
+            return
+
+        columns, rows = size = shutil.get_terminal_size()
+        # Rows taken by each region, counting lines wrapped by the terminal
+        heights = [
+            sum(max(1, -(-len(line) // columns)) for line in lines)
+            for _, lines in regions
+        ]
+        # Positioning is absolute, so a frame that scrolls is always redrawn
+        # in full; the last row is left for the echo of the user's input
+        if size != self.size or sum(heights) >= rows:
+            first = 0
+        else:
+            first = len(regions) - 1
+            for i, (region, previous) in enumerate(zip(regions, self.regions)):
+                if region != previous:
+                    first = i
+                    break
+            if len(self.regions) != len(regions):
+                first = min(first, len(self.regions), len(regions) - 1)
+        row = sum(heights[:first])
+        self._write(f"\x1b[{row + 1};1H\x1b[J" + "".join(text[first:]))
+        self.regions = [(name, list(lines)) for name, lines in regions]
+        self.size = size
+
+
+def get_screen():
+    """The terminal of the interactive session."""
+    global _screen
+    if _screen is None:
+        _screen = Screen()
+    return _screen
+
+
+@timed("clear_screen")
+def clear_screen():
+    """Clear the console screen."""
+    sys.stdout.flush()
+    get_screen().clear()
+
+
+class KeyReader:
+    """
+    Keyboard input that does not block the event loop.
+    On a terminal, keys are read as they are typed: the terminal is switched to
+    cbreak mode and watched with add_reader, or polled through msvcrt on Windows.
+    Otherwise, for example when input is piped, whole lines are read and ``live``
+    is False.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdin
+        if not self.stream.isatty():
+            self.mode = "lines"
+        elif termios is not None:
+            self.mode = "posix"
+        elif msvcrt is not None:
+            self.mode = "windows"
+        else:
+            self.mode = "lines"
+        self.live = self.mode != "lines"
+
+    def __enter__(self):
+        if self.mode == "posix":
+            self._fd = self.stream.fileno()
+            self._saved = termios.tcgetattr(self._fd)
+            tty.setcbreak(self._fd)
+            self._queue = asyncio.Queue()
+            self._decoder = codecs.getincrementaldecoder(
+                self.stream.encoding or "utf-8"
+            )(errors="replace")
+            asyncio.get_running_loop().add_reader(self._fd, self._ready)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.mode == "posix":
+            asyncio.get_running_loop().remove_reader(self._fd)
+            termios.tcsetattr(self._fd, termios.TCSADRAIN, self._saved)
+
+    def _ready(self):
+        data = os.read(self._fd, 1024)
+        self._queue.put_nowait(self._decoder.decode(data) if data else "")
+
+    async def read(self):
+        """The next text typed: one or more keys, or a whole line when not live."""
+        if self.mode == "posix":
+            text = await self._queue.get()
+        elif self.mode == "windows":
+            text = ""
+            while not text:
+                while not msvcrt.kbhit():
+                    await asyncio.sleep(0.01)
+                key = msvcrt.getwch()
+                if key in "\x00\xe0":
+                    msvcrt.getwch()  # Second half of a function or arrow key
+                else:
+                    text = key
+        else:
+            text = self.stream.readline()
+        if not text:
+            raise EOFError
+        return text
+
+
+def question_body(question, index, total_questions, prev_answer=None):
+    """Lines showing a question, its answers and the previously selected answer if any."""
+    choices = question["answers"]
+    body = [
+        "=" * 40,
+        f"Question {index + 1}/{total_questions}",
+        "",
+        "",
+        *question["description"].split("\n"),
+        "",
+        "",
+        "*" * 40,
+        "",
+        "",
+    ]
+    for i, choice in enumerate(choices):
+        body.extend(f"{string.ascii_uppercase[i]}. {choice['value']}".split("\n"))
+        body.append("")
+
+    # Display the previously selected answer if any
+    if prev_answer:
+        selected_choices = [
+            string.ascii_uppercase[i]
+            for i, choice in enumerate(choices)
+            if choice["id"] in prev_answer
+        ]
+        body.extend(["", f"Your previous answer: {', '.join(selected_choices)}"])
+    return body
+
+
+async def run_session(
+    results, time_limit, start_time, keys=None, screen=None, journal=None
+):
+    """
+    Let the user answer the questions of a test until the last one is answered or
+    the time runs out.
+    Keyboard input, the redraw of the remaining time once per second and the
+    deadline all run on one event loop, so the test ends on time even while the
+    user is typing.
+    :param results: List of dicts with "question" and "user_answer"; answers are
+        filled in as the user gives them.
+    :param time_limit: Test time in minutes.
+    :param start_time: time.time() when the test started.
+    :param keys: KeyReader to read from; defaults to standard input.
+    :param screen: Screen to draw on; defaults to the session's terminal.
+    :param journal: AnswerJournal recording the answers, if any.
+    :return: True if the time ran out before the test was finished.
+    """
+    keys = keys or KeyReader()
+    screen = screen or get_screen()
+    deadline = start_time + time_limit * 60
+    # Start at the first unanswered question, as a resumed test may have answers
+    index = next(
+        (i for i, result in enumerate(results) if not result["user_answer"]), 0
+    )
+    body = question_body(
+        results[index]["question"], index, len(results), results[index]["user_answer"]
+    )
+    typed = ""  # Typed at the prompt but not submitted yet
+    message = []
+
+    def draw():
+        with phase("render_question"):
+            remaining_time = max(0, deadline - time.time())
+            remaining_minutes = int(remaining_time // 60)
+            remaining_seconds = int(remaining_time % 60)
+            timer = [
+                "*" * 40,
+                "",
+                f"Remaining time: {remaining_minutes:02}:{remaining_seconds:02}",
+            ]
+            prompt = "Select answer (e.g., AB, 'back' to go back, 'next' to skip, or 'r' to refresh): "
+            # The question only changes when an answer is submitted, so most
+            # redraws rewrite just the timer and the prompt
+            screen.draw(
+                [
+                    ("body", body),
+                    ("timer", timer),
+                    ("message", message),
+                    ("prompt", ["", prompt + typed]),
+                ]
+            )
+
+    async def tick():
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wake just after the displayed second changes
+            await asyncio.sleep((deadline - time.time()) % 1 + 0.01)
+            draw()
+            if journal is not None:
+                # Answers are synced here once per second, and off the event
+                # loop, so that fsync never delays a keystroke
+                journal.record_time(time.time() - start_time)
+                await loop.run_in_executor(None, journal.sync)
+
+    sys.stdout.flush()
+    with keys:
+        # Without a live keyboard, input blocks the loop and the timer is only
+        # redrawn between answers
+        ticker = asyncio.ensure_future(tick()) if keys.live and screen.ansi else None
+        try:
+            while index < len(results):
+                draw()
+                try:
+                    text = await asyncio.wait_for(
+                        keys.read(), max(0, deadline - time.time())
+                    )
+                except asyncio.TimeoutError:
+                    return True
+                if time.time() >= deadline:
+                    return True
+
+                for key in ANSI_ESCAPE.sub("", text):
+                    if key in "\r\n":
+                        answer, typed = typed.strip().upper(), ""
+                    elif key in "\b\x7f":
+                        typed = typed[:-1]
+                        continue
+                    else:
+                        if key.isprintable():
+                            typed += key
+                        continue
+
+                    message = []
+                    choices = results[index]["question"]["answers"]
+                    if answer == "BACK":
+                        index = max(index - 1, 0)
+                    elif answer == "NEXT":
+                        if not results[index]["user_answer"]:
+                            message = [
+                                "",
+                                "You haven't selected any answer. Please select at least one answer before continuing.",
+                            ]
+                        else:
+                            index += 1
+                    elif answer == "R":
+                        pass  # Display the question again
+                    elif all(
+                        ch in string.ascii_uppercase[: len(choices)] for ch in answer
+                    ):
+                        results[index]["user_answer"] = [
+                            choices[string.ascii_uppercase.index(ch)]["id"]
+                            for ch in answer
+                        ]
+                        if journal is not None:
+                            journal.record_answer(
+                                index,
+                                results[index]["user_answer"],
+                                time.time() - start_time,
+                            )
+                            if ticker is None:
+                                journal.sync()
+                        index += 1
+                    else:
+                        message = ["", "Invalid answer, please try again."]
+
+                    if index == len(results):
+                        break
+                    body = question_body(
+                        results[index]["question"],
+                        index,
+                        len(results),
+                        results[index]["user_answer"],
+                    )
+        finally:
+            if ticker is not None:
+                ticker.cancel()
+    return False
+
+
+def take_test(exams_dir, questions, time_limit, pass_condition):
+    """
+    Start a test on the given questions.
+    :param exams_dir: Directory the test is saved to.
+    :param questions: Questions of the test.
+    :param time_limit: Test time in minutes.
+    :param pass_condition: Pass condition, e.g. "70%" or "7".
+    """
+    shuffle_answers(questions)
+    results = [{"question": q, "user_answer": []} for q in questions]
+    run_test(
+        exams_dir,
+        AnswerJournal.start(exams_dir, results, time_limit, pass_condition),
+    )
+
+
+def run_test(exams_dir, journal):
+    """
+    Run a new or resumed test, then grade it, show the results and save them.
+    The test is submitted automatically when the time runs out. If it is
+    interrupted with Ctrl-C, its journal is kept so it can be resumed later.
+    :param exams_dir: Directory the test is saved to.
+    :param journal: AnswerJournal of the test.
+    """
+    results = journal.results
+    time_limit = journal.time_limit
+    pass_condition = journal.pass_condition
+
+    # Count the time already spent on a resumed test
+    start_time = time.time() - journal.elapsed
+
+    # Take the test
+    try:
+        timed_out = asyncio.run(
+            run_session(results, time_limit, start_time, journal=journal)
+        )
+    except KeyboardInterrupt:
+        print("\n\nTest interrupted. It can be resumed from the main menu.")
+        input("\nPress Enter to return to the main menu.")
+        return
+    finally:
+        journal.close()
+
+    exam_data = finished_exam(results, start_time, time_limit, pass_condition)
+    print_results(exam_data, timed_out)
+
+    # Save results under the journal's name, so that a test interrupted after
+    # saving is not saved twice
+    save_exam(exams_dir, exam_data, journal.name)
+    journal.remove()
+
+    input("\nPress Enter to return to the main menu.")
+
+
+def print_results(exam_data, timed_out=False):
+    """Display the results of a finished test."""
+    clear_screen()
+    if timed_out:
+        print("\nTime's up! Your answers were submitted automatically.")
+    print("\nTest results:")
+    print(f"Correct answers: {exam_data['score']}/{exam_data['total']}")
+    print(f"Score: {exam_data['percentage']:.2f}%")
+    print(f"Status: {'PASS' if exam_data['passed'] else 'FAIL'}")
+    print(f"Time taken: {exam_data['elapsed_time']}")
+
+
+def format_catalog_entry(number, entry):
+    """Line of the saved test list for one catalog entry."""
+    timestamp = entry["timestamp"][:19].replace("T", " ")
+    status = "PASS" if entry["passed"] else "FAIL"
+    return (
+        f"{number}. {entry['name']}  {timestamp}  "
+        f"{entry['score']}/{entry['total']}  {status}"
+    )
+
+
+def main_menu():
+    """Display the main menu."""
+    clear_screen()
+    print("Welcome to the testing system!")
+    print("1. Take a new test")
+    print("2. Retake an old test")
+    print("3. Test result statistics")
+    print("4. Take a test from questions with low correct rate")
+    # Exit keeps the key it always had; newer options are added after it
+    print("5. Exit")
+    print("6. Resume an interrupted test")
+    print("7. Study questions due for review")
+    print("8. Take a test on a topic")
+    print("9. Take an adaptive test")
+    choice = input("\nYour choice: ").strip()
+    return choice
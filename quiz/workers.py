@@ -0,0 +1,22 @@
+"""Process pool for scanning and analysing the test history."""
+
+import os
+
+from .deps import concurrent_futures, multiprocessing
+
+
+def scan_workers():
+    """Number of processes used to scan the test history."""
+    workers = os.environ.get("QUIZ_SCAN_WORKERS")
+    return max(1, int(workers)) if workers else os.cpu_count() or 1
+
+
+def process_pool(workers):
+    """Process pool whose workers are forked where possible, so start up fast."""
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    return concurrent_futures.ProcessPoolExecutor(
+        max_workers=workers, mp_context=context
+    )
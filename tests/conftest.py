@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pytest
+
+from quiz.aliases import _question_aliases
+from quiz.database import _databases
+from quiz.history import (
+    _adaptive_samplers,
+    _question_masks,
+    _review_queues,
+    _scanned_exams,
+)
+from quiz.model import md5_hash
+from quiz.search import _search_indexes
+from quiz.storage import _catalogs, _history_logs, _question_stores
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_question(number, num_answers=4, correct=(0,)):
+    """Question with hash IDs, as load_questions returns them."""
+    description = f"Question {number}?"
+    answers = [
+        {"value": f"Answer {number}.{i}", "correct": i in correct}
+        for i in range(num_answers)
+    ]
+    question = {"description": description, "answers": answers}
+    question["id"] = md5_hash(description)
+    for answer in answers:
+        answer["id"] = md5_hash(answer["value"])
+    return question
+
+
+def make_exam(questions, timestamp="2024-01-01T10:00:00"):
+    """Completed test answering every question correctly."""
+    results = [
+        {
+            "question": question,
+            "user_answer": [ans["id"] for ans in question["answers"] if ans["correct"]],
+        }
+        for question in questions
+    ]
+    return {
+        "timestamp": timestamp,
+        "questions": results,
+        "score": len(results),
+        "total": len(results),
+        "percentage": 100.0,
+        "passed": True,
+        "pass_condition": "70%",
+        "elapsed_time": "01:00",
+        "time_limit": 30,
+    }
+
+
+def run_session(code, *args):
+    """Run code in a separate Python process, as another quiz session would."""
+    import subprocess
+
+    return subprocess.Popen(
+        [sys.executable, "-c", "import sys\n" + code, *map(str, args)],
+        cwd=ROOT,
+    )
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start every test with nothing cached in memory."""
+    yield
+    _history_logs.clear()
+    _question_stores.clear()
+    _question_masks.clear()
+    _catalogs.clear()
+    _question_aliases.clear()
+    _scanned_exams.clear()
+    _review_queues.clear()
+    _adaptive_samplers.clear()
+    _search_indexes.clear()
+    for database in _databases.values():
+        database.close()
+    _databases.clear()
+
+
+@pytest.fixture
+def exams_dir(tmp_path):
+    return str(tmp_path / "exams")
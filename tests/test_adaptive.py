@@ -0,0 +1,49 @@
+import datetime
+import os
+import random
+
+import pytest
+
+from conftest import make_exam
+from test_sampling import write_bank
+from quiz.bank import build_bank, load_question_ids, load_questions
+from quiz.constants import SEARCH_INDEX_SUFFIX
+from quiz.history import get_adaptive_positions, save_exams
+
+
+@pytest.fixture
+def bank(tmp_path):
+    data_file = str(tmp_path / "data.json")
+    return data_file, write_bank(data_file, 30)
+
+
+def test_question_ids_from_cache_and_compiled_bank(bank):
+    data_file, ids = bank
+    assert load_question_ids(data_file) == ids
+    build_bank(data_file)
+    assert load_question_ids(data_file) == ids
+
+
+def test_adaptive_test_does_not_build_search_index(bank, exams_dir):
+    data_file, ids = bank
+    positions = get_adaptive_positions(data_file, exams_dir, 10)
+    assert len(set(positions)) == 10
+    assert all(0 <= position < len(ids) for position in positions)
+    assert not os.path.exists(data_file + SEARCH_INDEX_SUFFIX)
+
+
+def test_adaptive_test_prefers_questions_answered_wrongly(bank, exams_dir):
+    data_file, ids = bank
+    questions = load_questions(data_file)
+    # Answer every question but the first correctly, a week ago
+    exam = make_exam(questions, "2024-01-01T10:00:00")
+    exam["questions"][0]["user_answer"] = []
+    save_exams(exams_dir, [exam], ["exam_a"])
+    now = datetime.datetime(2024, 1, 8, 10).timestamp()
+
+    # A wrongly answered question weighs twice as much as a correct one
+    random.seed(0)
+    drawn = [
+        get_adaptive_positions(data_file, exams_dir, 1, now)[0] for _ in range(2000)
+    ]
+    assert drawn.count(0) > 2000 / len(ids) * 1.5
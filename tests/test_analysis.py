@@ -0,0 +1,101 @@
+import csv
+import json
+import os
+
+import pytest
+
+from conftest import make_exam, make_question
+from test_stats import answered
+from quiz.analysis import (
+    format_question_for_csv,
+    item_analysis,
+    iter_answer_sheets,
+    save_statistics_to_csv,
+)
+from quiz.history import import_database, save_exams
+from quiz.model import canonical_question, question_key
+
+
+def test_answer_sheets_of_exam_file_with_skipped_question(exams_dir):
+    questions = [make_question(1), make_question(2)]
+    exam = make_exam(questions)
+    # Saved by the first versions, which stored "NEXT" for a skipped question
+    exam["questions"][1]["user_answer"] = "NEXT"
+    os.makedirs(exams_dir)
+    with open(os.path.join(exams_dir, "exam_old.json"), "w", encoding="utf-8") as f:
+        json.dump(exam, f, indent=4)
+    save_exams(exams_dir, [make_exam(questions)], ["exam_new"])
+
+    keys = [question_key(canonical_question(question)) for question in questions]
+    correct = [
+        [
+            position
+            for position, answer in enumerate(canonical_question(question)["answers"])
+            if answer["correct"]
+        ]
+        for question in questions
+    ]
+    sheets = [
+        [[key, list(positions)] for key, positions in sheet]
+        for sheet in iter_answer_sheets(exams_dir)
+    ]
+    # Test files are read before the exam log
+    assert sheets == [
+        [[keys[0], correct[0]], [keys[1], []]],
+        [[keys[0], correct[0]], [keys[1], correct[1]]],
+    ]
+
+
+def test_item_analysis_counts_skipped_question_as_wrong(exams_dir):
+    pytest.importorskip("numpy")
+    questions = [make_question(1), make_question(2)]
+    exam = make_exam(questions)
+    exam["questions"][1]["user_answer"] = "NEXT"
+    os.makedirs(exams_dir)
+    with open(os.path.join(exams_dir, "exam_old.json"), "w", encoding="utf-8") as f:
+        json.dump(exam, f, indent=4)
+
+    analysis = {row["question_id"]: row for row in item_analysis(exams_dir)}
+    assert analysis[questions[0]["id"]]["difficulty"] == 1
+    assert analysis[questions[1]["id"]]["difficulty"] == 0
+
+
+@pytest.mark.parametrize("use_database", [False, True])
+def test_statistics_export_layouts(exams_dir, tmp_path, use_database):
+    q1, q2 = make_question(1), make_question(2)
+    save_exams(
+        exams_dir,
+        [
+            answered([q1, q2], [True, False], "2024-01-01T10:00:00"),
+            answered([q2], [True], "2024-01-02T10:00:00"),
+        ],
+        ["exam_a", "exam_b"],
+    )
+    if use_database:
+        import_database(exams_dir)
+    cells = {q["id"]: format_question_for_csv(canonical_question(q)) for q in (q1, q2)}
+    assert cells[q1["id"]].startswith("Question 1?\n")
+    assert cells[q1["id"]].rpartition("Correct answers: ")[2].endswith(". Answer 1.0")
+
+    output_file = str(tmp_path / "wide.csv")
+    save_statistics_to_csv(exams_dir, output_file)
+    with open(output_file, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["Question", "Attempt 1", "Attempt 2"]
+    assert sorted(rows[1:]) == sorted(
+        [
+            [cells[q1["id"]], "Correct", ""],
+            [cells[q2["id"]], "Incorrect", "Correct"],
+        ]
+    )
+
+    output_file = str(tmp_path / "long.csv")
+    save_statistics_to_csv(exams_dir, output_file, layout="long")
+    with open(output_file, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows == [
+        ["Question ID", "Question", "Attempt", "Test", "Timestamp", "Result"],
+        [q1["id"], cells[q1["id"]], "1", "exam_a", "2024-01-01T10:00:00", "Correct"],
+        [q2["id"], cells[q2["id"]], "1", "exam_a", "2024-01-01T10:00:00", "Incorrect"],
+        [q2["id"], cells[q2["id"]], "2", "exam_b", "2024-01-02T10:00:00", "Correct"],
+    ]
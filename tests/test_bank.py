@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+import quiz.bank
+from test_sampling import write_bank
+from quiz.bank import (
+    build_bank,
+    load_questions,
+    load_questions_at,
+    open_bank,
+    read_bank_cache,
+    verify_bank,
+    write_bank_cache,
+)
+from quiz.constants import BANK_CACHE_SUFFIX, BANK_CACHE_VERSION, BANK_FILE_SUFFIX
+from quiz.model import md5_hash
+
+
+def no_compile(raw_data):
+    raise AssertionError("bank recompiled")
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = str(tmp_path / "data.json")
+    write_bank(path, 5)
+    return path
+
+
+def test_bank_is_compiled_once(data_file, monkeypatch):
+    questions = load_questions(data_file)
+    assert [question["id"] for question in questions] == [
+        md5_hash(f"Question {i}?") for i in range(5)
+    ]
+    assert questions[0]["answers"][1]["id"] == md5_hash("Answer 0.1")
+    key, _ = read_bank_cache(data_file + BANK_CACHE_SUFFIX, key_only=True)
+    assert key["version"] == BANK_CACHE_VERSION
+
+    monkeypatch.setattr(quiz.bank, "compile_questions", no_compile)
+    assert load_questions(data_file) == questions
+
+
+def test_changed_bank_is_recompiled(data_file):
+    load_questions(data_file)
+    write_bank(data_file, 3)
+    assert len(load_questions(data_file)) == 3
+
+
+def test_touched_bank_reuses_the_cache(data_file, monkeypatch):
+    questions = load_questions(data_file)
+    stat = os.stat(data_file)
+    os.utime(data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    monkeypatch.setattr(quiz.bank, "compile_questions", no_compile)
+
+    assert load_questions(data_file) == questions
+    # The cache is keyed by the new modification time from then on
+    key, _ = read_bank_cache(data_file + BANK_CACHE_SUFFIX, key_only=True)
+    assert key["mtime_ns"] == stat.st_mtime_ns + 10**9
+
+
+def test_stale_or_broken_cache_is_replaced(data_file):
+    cache_file = data_file + BANK_CACHE_SUFFIX
+    questions = load_questions(data_file)
+    key, _ = read_bank_cache(cache_file)
+    # A cache written by another Python version is not read
+    write_bank_cache(cache_file, {**key, "version": "1-2.7"}, [])
+    assert load_questions(data_file) == questions
+
+    with open(cache_file, "wb") as f:
+        f.write(b"\x05\x00")
+    assert load_questions(data_file) == questions
+    assert read_bank_cache(cache_file)[1] == questions
+
+
+def test_mapped_bank_matches_the_question_file(data_file):
+    assert open_bank(data_file) is None
+    questions = load_questions(data_file)
+    assert build_bank(data_file) == 5
+
+    with open_bank(data_file) as bank:
+        assert len(bank) == 5
+        assert [bank.question(i) for i in range(5)] == questions
+        assert bank.question_ids() == [question["id"] for question in questions]
+        for position, question in enumerate(questions):
+            assert bank.question_id(position) == question["id"]
+            assert bank.find(question["id"]) == position
+        assert bank.find(md5_hash("Not in the bank?")) is None
+        assert bank.positions({questions[1]["id"], questions[3]["id"]}) == [0, 2, 4]
+        with pytest.raises(IndexError):
+            bank.question(5)
+    assert verify_bank(data_file) == []
+    assert load_questions_at(data_file, [4, 0]) == [questions[4], questions[0]]
+
+
+def test_mapped_bank_is_rebuilt_when_the_file_changes(data_file):
+    build_bank(data_file)
+    write_bank(data_file, 3)
+    assert verify_bank(data_file)
+
+    with open_bank(data_file) as bank:
+        assert bank.question_ids() == [md5_hash(f"Question {i}?") for i in range(3)]
+    assert verify_bank(data_file) == []
+
+
+def test_verify_reports_a_damaged_bank(data_file):
+    build_bank(data_file)
+    with open(data_file + BANK_FILE_SUFFIX, "r+b") as f:
+        f.write(b"[")
+    assert verify_bank(data_file) == ["Question 1 cannot be decoded"]
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from benchmark import generate_bank, generate_history
+from quiz.bank import load_questions
+from quiz.model import grade_results
+from quiz.storage import get_test_catalog, load_exam
+
+
+@pytest.fixture
+def questions(tmp_path):
+    data_file = str(tmp_path / "data.json")
+    generate_bank(data_file, 30, answers_per_question=5, text_length=9)
+    return load_questions(data_file)
+
+
+def test_generated_bank_is_reproducible(tmp_path, questions):
+    assert len(questions) == 30
+    assert len({question["id"] for question in questions}) == 30
+    for question in questions:
+        assert len(question["description"].split()) == 11
+        assert len(question["answers"]) == 5
+        assert 1 <= sum(ans["correct"] for ans in question["answers"]) <= 2
+
+    generate_bank(
+        str(tmp_path / "again.json"), 30, answers_per_question=5, text_length=9
+    )
+    generate_bank(str(tmp_path / "other.json"), 30, 5, 9, seed=1)
+    with open(tmp_path / "data.json", "rb") as f:
+        data = f.read()
+    with open(tmp_path / "again.json", "rb") as f:
+        assert f.read() == data
+    with open(tmp_path / "other.json", "rb") as f:
+        assert f.read() != data
+
+
+def test_history_formats_hold_the_same_tests(tmp_path, questions):
+    histories = {}
+    for history_format in ("log", "files", "sqlite"):
+        exams_dir = str(tmp_path / history_format)
+        generate_history(exams_dir, questions, 12, 8, history_format=history_format)
+        histories[history_format] = []
+        for entry in get_test_catalog(exams_dir, order="oldest"):
+            exam = load_exam(entry["path"])
+            assert len(exam["questions"]) == 8
+            assert exam["score"] == grade_results(exam["questions"])
+            histories[history_format].append((exam["timestamp"], exam["score"]))
+    assert os.listdir(tmp_path / "files")[0].endswith(".json")
+
+    assert len(histories["log"]) == 12
+    assert histories["files"] == histories["log"]
+    assert histories["sqlite"] == histories["log"]
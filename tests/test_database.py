@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+from conftest import make_exam, make_question
+from quiz.constants import DATABASE_FILE
+from quiz.database import open_database
+from quiz.history import import_database, save_exams
+from quiz.storage import get_done_tests, get_test_catalog, load_exam
+
+
+def save_history(exams_dir, num_exams):
+    exams = [
+        make_exam([make_question(i), make_question(i + 1)], f"2024-01-01T10:{i:02d}:00")
+        for i in range(num_exams)
+    ]
+    save_exams(exams_dir, exams, [f"exam_{i}" for i in range(num_exams)])
+
+
+def test_import_copies_the_history(exams_dir):
+    save_history(exams_dir, 3)
+    before = {entry["name"]: entry for entry in get_test_catalog(exams_dir)}
+
+    assert import_database(exams_dir) == 3
+    assert not os.path.exists(os.path.join(exams_dir, DATABASE_FILE + ".tmp"))
+    catalog = get_test_catalog(exams_dir)
+    assert [entry["name"] for entry in catalog] == list(before)
+    for entry in catalog:
+        exam = load_exam(entry["path"])
+        assert exam["score"] == before[entry["name"]]["score"]
+        assert len(exam["questions"]) == 2
+    assert import_database(exams_dir) == 0
+
+
+def test_failed_import_keeps_the_history(exams_dir, monkeypatch):
+    save_history(exams_dir, 3)
+    paths = get_done_tests(exams_dir)
+
+    def failing_load_exam(path):
+        if path == paths[0]:
+            raise OSError("disk error")
+        return load_exam(path)
+
+    monkeypatch.setattr("quiz.history.STATISTICS_BATCH_SIZE", 1)
+    monkeypatch.setattr("quiz.history.load_exam", failing_load_exam)
+    with pytest.raises(OSError):
+        import_database(exams_dir)
+    monkeypatch.undo()
+
+    # The tests imported before the error are not half a history
+    assert open_database(exams_dir) is None
+    assert get_done_tests(exams_dir) == paths
+    assert import_database(exams_dir) == 3
+    assert len(get_done_tests(exams_dir)) == 3
+
+
+def test_import_exam_file_with_skipped_question(exams_dir):
+    questions = [make_question(1), make_question(2)]
+    exam = make_exam(questions)
+    # Saved by the first versions, which stored "NEXT" for a skipped question
+    exam["questions"][1]["user_answer"] = "NEXT"
+    os.makedirs(exams_dir)
+    with open(os.path.join(exams_dir, "exam_old.json"), "w", encoding="utf-8") as f:
+        json.dump(exam, f, indent=4)
+
+    assert import_database(exams_dir) == 1
+    [path] = get_done_tests(exams_dir)
+    loaded = load_exam(path)
+    assert [result["user_answer"] for result in loaded["questions"]] == [
+        [questions[0]["answers"][0]["id"]],
+        [],
+    ]
+    [stats] = open_database(exams_dir).question_stats([questions[1]["id"]])
+    assert stats[1:3] == (1, 0)
@@ -0,0 +1,82 @@
+import pytest
+
+import quiz.dedup
+from conftest import make_exam, make_question
+from quiz.aliases import load_question_aliases
+from quiz.dedup import find_near_duplicates, minhash_signatures
+from quiz.history import (
+    get_questions_from_done_tests,
+    link_changed_questions,
+    load_stats_index,
+    save_exams,
+)
+from quiz.model import md5_hash
+
+ORIGINAL = (
+    "Which storage service should you use to keep large amounts of unstructured "
+    "object data with high durability and a low cost per gigabyte?"
+)
+EDITED = (
+    "Which storage service should you use to keep large amounts of unstructured "
+    "object data with very high durability and a low cost per gigabyte?"
+)
+UNRELATED = (
+    "How many nodes does a regional cluster create by default when it is "
+    "deployed across three zones of a region?"
+)
+
+
+def question(description):
+    result = make_question(0)
+    result["description"] = description
+    result["id"] = md5_hash(description)
+    return result
+
+
+def one_bucket(signatures):
+    """Put every text in one bucket, as when they share a band by chance."""
+    yield list(range(len(signatures)))
+
+
+def test_edited_question_is_a_near_duplicate():
+    [(i, j, similarity)] = find_near_duplicates([ORIGINAL, UNRELATED, EDITED])
+    assert (i, j) == (0, 2)
+    assert 0.8 <= similarity < 1
+
+
+def test_every_pair_in_a_bucket_is_compared(monkeypatch):
+    monkeypatch.setattr(quiz.dedup, "lsh_buckets", one_bucket)
+    # The first text of the bucket is similar to neither of the others
+    pairs = find_near_duplicates([UNRELATED, ORIGINAL, EDITED])
+    assert [(i, j) for i, j, _ in pairs] == [(1, 2)]
+
+
+def test_signatures_without_numpy(monkeypatch):
+    if quiz.dedup.np is None:
+        pytest.skip("NumPy is not installed")
+    texts = [ORIGINAL, EDITED, UNRELATED, "tiny"]
+    expected = [tuple(int(value) for value in row) for row in minhash_signatures(texts)]
+    monkeypatch.setattr(quiz.dedup, "np", None)
+    assert minhash_signatures(texts) == expected
+    assert [(i, j) for i, j, _ in find_near_duplicates(texts)] == [(0, 1)]
+
+
+@pytest.mark.parametrize("same_bucket", [False, True])
+def test_old_version_is_linked_to_its_edit(exams_dir, monkeypatch, same_bucket):
+    old = question(ORIGINAL)
+    save_exams(exams_dir, [make_exam([old])], ["exam_a"])
+    if same_bucket:
+        monkeypatch.setattr(quiz.dedup, "lsh_buckets", one_bucket)
+    # The unrelated bank question comes first in the bucket
+    bank = [(md5_hash(text), text) for text in (UNRELATED, EDITED)]
+
+    links = link_changed_questions(exams_dir, bank)
+
+    new_id = md5_hash(EDITED)
+    assert links == {old["id"]: new_id}
+    assert load_question_aliases(exams_dir) == links
+    # The old version's statistics and seen status carry over to the edit
+    assert set(load_stats_index(exams_dir)["questions"]) == {new_id}
+    assert get_questions_from_done_tests(exams_dir) == {new_id}
+    # Linked versions are not linked again
+    assert link_changed_questions(exams_dir, bank) == {}
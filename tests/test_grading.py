@@ -0,0 +1,161 @@
+import json
+
+import pytest
+
+import quiz.grading
+from conftest import make_exam, make_question
+from test_journal import duplicate_answers_question
+from quiz.grading import (
+    CompactExam,
+    QuestionTable,
+    grade_answer_sheets,
+    read_answer_sheets,
+)
+from quiz.model import grade_results, is_answer_correct, md5_hash
+
+QUESTIONS = [make_question(1, correct=(0, 2)), make_question(2), make_question(3)]
+
+
+def answer_ids(question, *positions):
+    return [question["answers"][position]["id"] for position in positions]
+
+
+def answer_sheets():
+    q1, q2, q3 = QUESTIONS
+    return [
+        {
+            "candidate": "all right",
+            "answers": {
+                q1["id"]: answer_ids(q1, 2, 0),
+                q2["id"]: answer_ids(q2, 0),
+                q3["id"]: answer_ids(q3, 0),
+            },
+        },
+        {
+            # The third question was asked but left unanswered
+            "candidate": "one wrong",
+            "questions": [q1["id"], q2["id"], q3["id"]],
+            "answers": {q1["id"]: answer_ids(q1, 0, 2), q2["id"]: answer_ids(q2, 1)},
+            "timestamp": "2024-01-01T10:00:00",
+        },
+        {
+            "answers": {q1["id"]: answer_ids(q1, 0)},
+        },
+    ]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def grading_backend(request, monkeypatch):
+    if request.param == "numpy":
+        if quiz.grading.np is None:
+            pytest.skip("NumPy is not installed")
+    else:
+        monkeypatch.setattr(quiz.grading, "np", None)
+    return request.param
+
+
+def test_sheets_are_graded_like_a_taken_test(grading_backend):
+    graded = grade_answer_sheets(QUESTIONS, answer_sheets(), "70%")
+
+    assert [sheet["candidate"] for sheet in graded] == ["all right", "one wrong", "3"]
+    assert [(sheet["score"], sheet["total"]) for sheet in graded] == [
+        (3, 3),
+        (1, 3),
+        (0, 1),
+    ]
+    assert [sheet["passed"] for sheet in graded] == [True, False, False]
+    assert graded[1]["percentage"] == pytest.approx(100 / 3)
+    q1, q2, q3 = QUESTIONS
+    assert graded[1]["correct"] == {q1["id"]: True, q2["id"]: False, q3["id"]: False}
+    exam = graded[1]["exam"]
+    assert exam["timestamp"] == "2024-01-01T10:00:00"
+    assert exam["questions"][2] == {"question": q3, "user_answer": []}
+    for sheet in graded:
+        assert sheet["exam"]["score"] == grade_results(sheet["exam"]["questions"])
+
+
+def test_pass_condition_by_count(grading_backend):
+    graded = grade_answer_sheets(QUESTIONS, answer_sheets(), "1")
+    assert [sheet["passed"] for sheet in graded] == [True, True, False]
+
+
+def test_unknown_ids_are_rejected(grading_backend):
+    q1 = QUESTIONS[0]
+    with pytest.raises(ValueError, match="Sheet 1: unknown question id"):
+        grade_answer_sheets(QUESTIONS, [{"answers": {"missing": []}}], "70%")
+    sheet = {"answers": {q1["id"]: ["missing"]}}
+    with pytest.raises(ValueError, match="Sheet 2: unknown answer id missing"):
+        grade_answer_sheets(QUESTIONS, [answer_sheets()[0], sheet], "70%")
+
+
+def test_sheets_are_read_from_json_or_json_lines(tmp_path):
+    sheets = answer_sheets()
+    array_file = tmp_path / "sheets.json"
+    array_file.write_text(json.dumps(sheets, indent=4), encoding="utf-8")
+    lines_file = tmp_path / "sheets.jsonl"
+    lines_file.write_text(
+        "\n".join(json.dumps(sheet) for sheet in sheets) + "\n\n", encoding="utf-8"
+    )
+
+    assert read_answer_sheets(str(array_file)) == sheets
+    assert read_answer_sheets(str(lines_file)) == sheets
+
+
+def unusual_questions():
+    """Questions with fields and ids the table's columns cannot hold."""
+    tagged = make_question(4)
+    tagged["tags"] = ["storage"]
+    tagged["answers"][1]["explanation"] = "Not this one."
+    renamed = make_question(5)
+    renamed["id"] = "custom-id"
+    renamed["answers"][3]["id"] = 7
+    # Zeros, as packed for an id without a digest
+    zero = make_question(6)
+    zero["id"] = "0" * 32
+    duplicate = duplicate_answers_question()
+    duplicate["description"] = "Question 7?"
+    duplicate["id"] = md5_hash(duplicate["description"])
+    return [*QUESTIONS, duplicate, tagged, renamed, zero]
+
+
+def test_question_table_holds_the_questions():
+    questions = unusual_questions()
+    table = QuestionTable(questions)
+
+    assert len(table) == len(questions)
+    assert table.to_questions() == questions
+    for position, question in enumerate(questions):
+        assert table.question_id(position) == question["id"]
+        assert table.find(question["id"]) == position
+    assert table.find(md5_hash("Not in the table?")) is None
+    assert table.find("missing") is None
+    excluded = {questions[0]["id"], "custom-id", "0" * 32}
+    assert table.positions(excluded) == [1, 2, 3, 4]
+    with pytest.raises(IndexError):
+        table.question(len(questions))
+
+
+def test_compact_exam_grades_like_the_results():
+    questions = unusual_questions()
+    exam = make_exam(questions)
+    selections = [
+        answer_ids(questions[0], 2, 0),  # Out of order
+        answer_ids(questions[1], 1),
+        [],
+        [md5_hash("Same"), md5_hash("Same")],
+        answer_ids(questions[4], 0) + ["unknown"],
+        answer_ids(questions[5], 0),
+        answer_ids(questions[6], 0, 0),
+    ]
+    for result, user_answer in zip(exam["questions"], selections):
+        result["user_answer"] = user_answer
+
+    compact = CompactExam.from_exam(exam)
+
+    assert compact.to_exam() == exam
+    assert list(compact.to_exam()) == list(exam)
+    assert compact.correct() == [
+        is_answer_correct(result["question"], result["user_answer"])
+        for result in exam["questions"]
+    ]
+    assert compact.score() == grade_results(exam["questions"]) == 4
@@ -0,0 +1,202 @@
+import json
+import os
+
+from conftest import make_exam, make_question, run_session
+from quiz.constants import CATALOG_FILE
+from quiz.files import append_lines
+from quiz.history import rebuild_stats_index, save_exams, scan_history
+from quiz.storage import (
+    _catalogs,
+    _history_logs,
+    _question_stores,
+    append_to_catalog,
+    catalog_entry,
+    get_done_tests,
+    get_test_catalog,
+    history_record,
+    history_shards,
+    load_exam,
+    read_catalog,
+    store_questions,
+)
+
+SAVE_EXAM = """
+exams_dir, name, number = sys.argv[1], sys.argv[2], int(sys.argv[3])
+from conftest import make_exam, make_question
+from quiz.history import save_exams
+save_exams(exams_dir, [make_exam([make_question(number)])], [name])
+"""
+
+
+def log_lines(exams_dir):
+    lines = []
+    for file in history_shards(exams_dir):
+        with open(os.path.join(exams_dir, file), "rb") as f:
+            lines.extend(f.read().splitlines(keepends=True))
+    return lines
+
+
+def session(code, *args):
+    return run_session(f"sys.path.insert(0, 'tests')\n{code}", *args)
+
+
+def test_saved_exam_loads_back(exams_dir):
+    exam = make_exam([make_question(1), make_question(2)])
+    [path] = save_exams(exams_dir, [exam], ["exam_a"])
+    assert get_done_tests(exams_dir) == [path]
+    loaded = load_exam(path)
+    assert {k: v for k, v in loaded.items() if k != "questions"} == {
+        k: v for k, v in exam.items() if k != "questions"
+    }
+    for result, saved in zip(loaded["questions"], exam["questions"]):
+        assert result["question"]["id"] == saved["question"]["id"]
+        assert result["user_answer"] == saved["user_answer"]
+
+
+def test_save_keeps_exams_saved_by_another_session(exams_dir):
+    save_exams(exams_dir, [make_exam([make_question(1)])], ["exam_a"])
+    # Another session appends while this one still has the old sizes cached
+    assert session(SAVE_EXAM, exams_dir, "exam_b", 2).wait() == 0
+    save_exams(exams_dir, [make_exam([make_question(3)])], ["exam_c"])
+
+    names = [json.loads(line)["name"] for line in log_lines(exams_dir)]
+    assert names == ["exam_a", "exam_b", "exam_c"]
+    _catalogs.clear()
+    _history_logs.clear()
+    _question_stores.clear()
+    tests = get_test_catalog(exams_dir, "oldest")
+    assert [entry["name"] for entry in tests] == names
+    for entry in tests:
+        assert load_exam(entry["path"])["total"] == 1
+
+
+def test_save_keeps_exam_not_catalogued_yet(exams_dir):
+    save_exams(exams_dir, [make_exam([make_question(1)])], ["exam_a"])
+    [shard] = history_shards(exams_dir)
+    # Another session has appended to the exam log but not yet to the catalog
+    exam = make_exam([make_question(2)])
+    keys = store_questions(exams_dir, [exam["questions"][0]["question"]])
+    record = history_record("exam_b", exam, 1.0, keys)
+    with open(os.path.join(exams_dir, shard), "ab") as f:
+        f.write(record.encode("utf-8"))
+
+    save_exams(exams_dir, [make_exam([make_question(3)])], ["exam_c"])
+    names = [json.loads(line)["name"] for line in log_lines(exams_dir)]
+    assert names == ["exam_a", "exam_b", "exam_c"]
+
+
+def test_concurrent_sessions_keep_every_exam(exams_dir):
+    os.makedirs(exams_dir)
+    code = SAVE_EXAM.replace(
+        "save_exams(",
+        "for i in range(10):\n    save_exams(",
+    ).replace("[name])", "[f'{name}_{i}'])")
+    processes = [session(code, exams_dir, f"exam_{p}", p) for p in range(4)]
+    assert [process.wait() for process in processes] == [0] * 4
+
+    lines = log_lines(exams_dir)
+    assert all(line.endswith(b"\n") for line in lines)
+    expected = {f"exam_{p}_{i}" for p in range(4) for i in range(10)}
+    assert {json.loads(line)["name"] for line in lines} == expected
+    assert {entry["name"] for entry in get_test_catalog(exams_dir)} == expected
+
+
+def test_append_cuts_off_partial_last_line(exams_dir):
+    save_exams(exams_dir, [make_exam([make_question(1)])], ["exam_a"])
+    [shard] = history_shards(exams_dir)
+    # A crash in the middle of an append leaves half a line behind
+    with open(os.path.join(exams_dir, shard), "ab") as f:
+        f.write(b'{"name":"exam_crashed","sav')
+
+    save_exams(exams_dir, [make_exam([make_question(2)])], ["exam_b"])
+    names = [json.loads(line)["name"] for line in log_lines(exams_dir)]
+    assert names == ["exam_a", "exam_b"]
+    _catalogs.clear()
+    _history_logs.clear()
+    for path in get_done_tests(exams_dir):
+        assert load_exam(path)["total"] == 1
+
+
+def test_append_lines_keeps_complete_lines(tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    assert append_lines(path, "a\n") == 0
+    assert append_lines(path, "b\nc\n") == 2
+    with open(path, "ab") as f:
+        f.write(b"partial")
+    assert append_lines(path, "d\n") == 6
+    with open(path, "rb") as f:
+        assert f.read() == b"a\nb\nc\nd\n"
+
+
+def test_catalog_recovers_exam_left_out_by_crash(exams_dir):
+    save_exams(exams_dir, [make_exam([make_question(1)])], ["exam_a"])
+    [shard] = history_shards(exams_dir)
+    # Two sessions catalog their tests in the other order than they logged them
+    exams = [make_exam([make_question(number)]) for number in (2, 3)]
+    records = [
+        (
+            name,
+            exam,
+            1.0,
+            store_questions(exams_dir, [exam["questions"][0]["question"]]),
+        )
+        for name, exam in zip(["exam_b", "exam_c"], exams)
+    ]
+    shard_path = os.path.join(exams_dir, shard)
+    entries = []
+    for name, exam, saved_at, keys in records:
+        append_lines(shard_path, history_record(name, exam, saved_at, keys))
+        entries.append(
+            catalog_entry(name, shard, saved_at, exam, os.path.getsize(shard_path))
+        )
+    append_to_catalog(exams_dir, entries[::-1])
+    # A third session crashes between logging its test and cataloguing it
+    exam = make_exam([make_question(4)])
+    keys = store_questions(exams_dir, [exam["questions"][0]["question"]])
+    append_lines(shard_path, history_record("exam_d", exam, 2.0, keys))
+
+    _catalogs.clear()
+    _history_logs.clear()
+    tests = read_catalog(exams_dir)["tests"]
+    assert sorted(tests) == ["exam_a", "exam_b", "exam_c", "exam_d"]
+    with open(os.path.join(exams_dir, CATALOG_FILE), "rb") as f:
+        names = [json.loads(line)["name"] for line in f]
+    assert sorted(names) == sorted(tests)
+    assert load_exam(tests["exam_d"]["path"])["total"] == 1
+
+
+def test_catalog_lists_exam_files_copied_in(exams_dir):
+    save_exams(exams_dir, [make_exam([make_question(1)])], ["exam_a"])
+    assert len(get_done_tests(exams_dir)) == 1
+    # A test from another machine, in the per-exam JSON format
+    path = os.path.join(exams_dir, "exam_copied.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(make_exam([make_question(2)], "2023-05-01T10:00:00"), f)
+    # Let the directory's modification time tick on coarse filesystems
+    stat = os.stat(exams_dir)
+    os.utime(exams_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert get_done_tests(exams_dir, "oldest") == [
+        path,
+        read_catalog(exams_dir)["tests"]["exam_a"]["path"],
+    ]
+    assert load_exam(path)["total"] == 1
+
+
+def test_deleted_exam_file_is_skipped_and_uncatalogued(exams_dir):
+    os.makedirs(exams_dir)
+    paths = []
+    for number in (1, 2):
+        paths.append(os.path.join(exams_dir, f"exam_{number}.json"))
+        with open(paths[-1], "w", encoding="utf-8") as f:
+            json.dump(make_exam([make_question(number)]), f)
+    assert sorted(get_done_tests(exams_dir)) == paths
+    # Deleted behind the catalog's back, on a filesystem whose directory
+    # modification time did not tick
+    stat = os.stat(exams_dir)
+    os.remove(paths[0])
+    os.utime(exams_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert [scanned["name"] for scanned in scan_history(paths)] == ["exam_2.json"]
+    assert get_done_tests(exams_dir) == [paths[1]]
+    assert list(rebuild_stats_index(exams_dir)["exams"]) == ["exam_2.json"]
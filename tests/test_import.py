@@ -0,0 +1,161 @@
+import json
+
+import pytest
+
+from quiz.bank import load_questions
+from quiz.importer import import_questions
+
+
+def write_json_bank(path, descriptions):
+    questions = [
+        {
+            "description": description,
+            "answers": [
+                {"value": "Yes", "correct": True},
+                {"value": "No", "correct": False},
+            ],
+        }
+        for description in descriptions
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(questions, f, indent=2)
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = str(tmp_path / "data.json")
+    write_json_bank(path, ["Old question 1?", "Old question 2?"])
+    return path
+
+
+@pytest.fixture
+def sources(tmp_path):
+    csv_file = tmp_path / "new.csv"
+    csv_file.write_text(
+        "Description,Answer A,Answer B,Answer C,Correct,Tags\n"
+        "CSV question?,Red,Green,Blue,B,colours; csv\n"
+        "Old question 1?,Yes,No,,A,\n"
+        "No correct answer?,Red,Green,,D,\n",
+        encoding="utf-8",
+    )
+    jsonl_file = tmp_path / "new.jsonl"
+    jsonl_file.write_text(
+        json.dumps(
+            {
+                "description": "JSONL question?",
+                "answers": [
+                    {"value": "A1", "correct": False},
+                    {"value": "A2", "correct": True},
+                ],
+            }
+        )
+        + "\n{not json\n\n"
+        + json.dumps({"description": "Only one answer?", "answers": []})
+        + "\n",
+        encoding="utf-8",
+    )
+    json_file = tmp_path / "new.json"
+    write_json_bank(str(json_file), ["JSON question?", "CSV question?"])
+    return [str(csv_file), str(jsonl_file), str(json_file)]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_import_adds_valid_new_questions(data_file, sources, tmp_path, workers):
+    with open(data_file, "rb") as f:
+        original = f.read()
+    error_file = str(tmp_path / "errors.jsonl")
+
+    counts = import_questions(
+        data_file, sources, workers=workers, error_file=error_file
+    )
+
+    assert (counts["read"], counts["added"], counts["existing"], counts["invalid"]) == (
+        8,
+        3,
+        1,
+        4,
+    )
+    questions = load_questions(data_file)
+    assert [question["description"] for question in questions] == [
+        "Old question 1?",
+        "Old question 2?",
+        "CSV question?",
+        "JSONL question?",
+        "JSON question?",
+    ]
+    assert questions[2]["tags"] == ["colours", "csv"]
+    assert [answer["correct"] for answer in questions[2]["answers"]] == [
+        False,
+        True,
+        False,
+    ]
+    # The existing questions are kept byte for byte
+    with open(data_file, "rb") as f:
+        assert f.read().startswith(original.rstrip()[:-1].rstrip())
+
+    with open(error_file, encoding="utf-8") as f:
+        errors = [json.loads(line) for line in f]
+    assert [(error["source"], error["record"]) for error in errors] == [
+        (sources[0], 4),
+        (sources[1], 2),
+        (sources[1], 4),
+        (sources[2], 2),
+    ]
+    assert "Repeats question" in errors[-1]["error"]
+    assert errors == [
+        {"source": source, "record": number, "error": error}
+        for source, number, error in counts["errors"]
+    ]
+
+
+def test_import_without_new_questions_leaves_bank_alone(data_file, tmp_path):
+    with open(data_file, "rb") as f:
+        original = f.read()
+    source = str(tmp_path / "same.json")
+    write_json_bank(source, ["Old question 2?"])
+
+    counts = import_questions(data_file, [source], workers=1)
+    assert (counts["added"], counts["existing"]) == (0, 1)
+    with open(data_file, "rb") as f:
+        assert f.read() == original
+    assert not (tmp_path / "data.json.tmp").exists()
+
+
+def test_import_creates_missing_bank(tmp_path, sources):
+    data_file = str(tmp_path / "bank" / "data.json")
+    (tmp_path / "bank").mkdir()
+    assert import_questions(data_file, sources[2:], workers=1)["added"] == 2
+    assert len(load_questions(data_file)) == 2
+
+
+def test_csv_correct_letters_name_answer_columns(data_file, tmp_path):
+    source = tmp_path / "gaps.csv"
+    source.write_text(
+        "Description,Answer A,Answer B,Answer C,Correct\n"
+        "Gap before the correct answer?,X,,Y,C\n"
+        "Correct answer left blank?,X,,Y,B\n",
+        encoding="utf-8",
+    )
+
+    counts = import_questions(data_file, [str(source)], workers=1)
+
+    assert (counts["added"], counts["invalid"]) == (1, 1)
+    assert "'B' is not one of the answers" in counts["errors"][0][2]
+    question = load_questions(data_file)[-1]
+    assert [(answer["value"], answer["correct"]) for answer in question["answers"]] == [
+        ("X", False),
+        ("Y", True),
+    ]
+
+
+def test_import_rejects_csv_without_required_columns(data_file, tmp_path):
+    source = tmp_path / "bad.csv"
+    source.write_text("Question,Answer A,Answer B\nWhy?,Yes,No\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="description"):
+        import_questions(data_file, [str(source)], workers=1)
+    assert not (tmp_path / "data.json.tmp").exists()
+
+
+def test_import_rejects_unknown_extension(data_file, tmp_path):
+    with pytest.raises(ValueError, match="Cannot tell the format"):
+        import_questions(data_file, [str(tmp_path / "questions.txt")], workers=1)
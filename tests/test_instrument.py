@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+import quiz.instrument
+from quiz.instrument import phase, run_instrumented, timed
+
+
+@timed("grading")
+def grade(calls):
+    calls.append("grade")
+    return len(calls)
+
+
+def session(calls):
+    with phase("exam"):
+        grade(calls)
+        grade(calls)
+    return "done"
+
+
+def read_report(report_file):
+    with open(report_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_report_times_each_phase(tmp_path):
+    report_file = str(tmp_path / "report.json")
+    calls = []
+
+    assert run_instrumented(lambda: session(calls), report_file) == "done"
+
+    report = read_report(report_file)
+    assert list(report["phases"]) == ["exam", "grading"]
+    assert report["phases"]["grading"]["count"] == 2
+    assert report["phases"]["exam"]["total"] >= report["phases"]["grading"]["total"]
+    assert report["session_time"] >= report["phases"]["exam"]["total"]
+    # Events are listed as they end, each with its start in the session
+    assert [event["phase"] for event in report["events"]] == [
+        "grading",
+        "grading",
+        "exam",
+    ]
+    assert "memory" not in report
+    assert not os.path.exists(report_file + ".prof")
+    # Nothing is timed outside an instrumented run
+    assert quiz.instrument._phase_timings is None
+    assert grade(calls) == 3
+
+
+def test_report_is_written_when_the_session_fails(tmp_path):
+    report_file = str(tmp_path / "report.json")
+
+    def failing_session():
+        with phase("exam"):
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        run_instrumented(failing_session, report_file)
+    assert read_report(report_file)["phases"]["exam"]["count"] == 1
+    assert quiz.instrument._phase_timings is None
+
+
+def test_profile_writes_the_profiler_output(tmp_path):
+    report_file = str(tmp_path / "report.json")
+
+    run_instrumented(lambda: session([]), report_file, profile=True)
+
+    report = read_report(report_file)
+    assert report["memory"]["peak"] > 0
+    assert os.path.getsize(report_file + ".prof") > 0
+    with open(report_file + ".txt", encoding="utf-8") as f:
+        assert "function calls" in f.read()
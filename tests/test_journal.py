@@ -0,0 +1,47 @@
+from conftest import make_question
+from quiz.journal import AnswerJournal, get_interrupted_tests
+from quiz.model import md5_hash
+
+
+def duplicate_answers_question():
+    """Question with two answers of the same text, only the second correct."""
+    question = make_question(1)
+    for ans, value, correct in zip(
+        question["answers"], ["Same", "Other", "Same", "Last"], [0, 0, 1, 0]
+    ):
+        ans.update(value=value, id=md5_hash(value), correct=bool(correct))
+    return question
+
+
+def test_resumed_test_keeps_its_questions_and_answers(exams_dir):
+    questions = [duplicate_answers_question(), make_question(2)]
+    # Displayed in an order other than the stored one
+    questions[0]["answers"].reverse()
+    results = [{"question": q, "user_answer": []} for q in questions]
+    journal = AnswerJournal.start(exams_dir, results, 30, "70%")
+    journal.record_answer(0, [md5_hash("Same")], 1.5)
+    journal.record_answer(1, [questions[1]["answers"][2]["id"]], 2.5)
+    journal.close()
+
+    [path] = get_interrupted_tests(exams_dir)
+    resumed = AnswerJournal.open(exams_dir, path)
+
+    assert [result["question"] for result in resumed.results] == questions
+    assert [result["user_answer"] for result in resumed.results] == [
+        [md5_hash("Same")],
+        [questions[1]["answers"][2]["id"]],
+    ]
+    assert resumed.elapsed == 2.5
+    assert (resumed.time_limit, resumed.pass_condition) == (30, "70%")
+
+
+def test_both_answers_of_the_same_text_can_be_given(exams_dir):
+    question = duplicate_answers_question()
+    results = [{"question": question, "user_answer": []}]
+    journal = AnswerJournal.start(exams_dir, results, 30, "70%")
+    journal.record_answer(0, [md5_hash("Same"), md5_hash("Same")], 1.0)
+    journal.close()
+
+    resumed = AnswerJournal.open(exams_dir, journal.path)
+    assert resumed.results[0]["question"] == question
+    assert resumed.results[0]["user_answer"] == [md5_hash("Same")] * 2
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def run_menu(workdir, keys):
+    env = dict(os.environ, PYTHONPATH=ROOT, TERM="dumb")
+    return subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from quiz.cli import main; sys.exit(main())",
+        ],
+        cwd=workdir,
+        env=env,
+        input=keys,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+
+
+def test_exit_keeps_its_key(tmp_path):
+    result = run_menu(tmp_path, "5\n")
+    assert result.returncode == 0
+    menu = result.stdout.split("Welcome to the testing system!")[1].splitlines()
+    options = [line for line in menu if line[:1].isdigit()]
+    assert options[4] == "5. Exit"
+    assert [option[:2] for option in options] == [f"{i}." for i in range(1, 10)]
+    assert "See you again!" in result.stdout
+
+
+def test_menu_exits_on_q(tmp_path):
+    result = run_menu(tmp_path, "q\n")
+    assert result.returncode == 0
+    assert "See you again!" in result.stdout
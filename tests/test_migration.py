@@ -0,0 +1,62 @@
+import json
+import os
+
+from conftest import make_exam, make_question
+from quiz.constants import MIGRATED_DIR
+from quiz.history import load_stats_index
+from quiz.storage import get_done_tests, get_test_catalog, load_exam, migrate_exams
+
+
+def write_baseline_exam(exams_dir, name, exam_data):
+    """Save a test as the first versions did: one indented JSON file per test."""
+    os.makedirs(exams_dir, exist_ok=True)
+    path = os.path.join(exams_dir, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(exam_data, f, ensure_ascii=False, indent=4)
+    return path
+
+
+def test_migrate_converts_exam_files(exams_dir):
+    exams = [
+        make_exam([make_question(1), make_question(2)], "2024-01-01T10:00:00"),
+        make_exam([make_question(2), make_question(3)], "2024-01-02T10:00:00"),
+    ]
+    for i, exam in enumerate(exams):
+        write_baseline_exam(exams_dir, f"exam_{i}", exam)
+
+    assert migrate_exams(exams_dir) == 2
+    assert sorted(os.listdir(os.path.join(exams_dir, MIGRATED_DIR))) == [
+        "exam_0.json",
+        "exam_1.json",
+    ]
+    catalog = get_test_catalog(exams_dir, "oldest")
+    assert [entry["name"] for entry in catalog] == ["exam_0", "exam_1"]
+    for entry, exam in zip(catalog, exams):
+        loaded = load_exam(entry["path"])
+        assert loaded["timestamp"] == exam["timestamp"]
+        assert [result["user_answer"] for result in loaded["questions"]] == [
+            result["user_answer"] for result in exam["questions"]
+        ]
+    assert migrate_exams(exams_dir) == 0
+
+
+def test_migrate_exam_with_skipped_question(exams_dir):
+    questions = [make_question(1), make_question(2), make_question(3)]
+    exam = make_exam(questions)
+    # A question skipped on a retake was saved as "NEXT" instead of a list
+    exam["questions"][1]["user_answer"] = "NEXT"
+    exam["questions"][2]["user_answer"].append("unknown answer id")
+    exam["score"] = 1
+    write_baseline_exam(exams_dir, "exam_skipped", exam)
+
+    assert migrate_exams(exams_dir) == 1
+    [path] = get_done_tests(exams_dir)
+    loaded = load_exam(path)
+    assert [result["user_answer"] for result in loaded["questions"]] == [
+        [questions[0]["answers"][0]["id"]],
+        [],
+        [questions[2]["answers"][0]["id"]],
+    ]
+    stats = load_stats_index(exams_dir)["questions"]
+    assert stats[questions[1]["id"]]["attempts"] == 1
+    assert stats[questions[1]["id"]]["correct_count"] == 0
@@ -0,0 +1,85 @@
+import datetime
+
+import pytest
+
+from conftest import make_question
+from test_stats import answered
+from quiz.constants import REVIEW_INITIAL_EASE, REVIEW_MIN_EASE
+from quiz.history import get_due_question_keys, import_database, save_exams
+from quiz.model import canonical_question, question_key
+from quiz.scheduling import ReviewQueue, review_question
+
+DAY = 86400
+START = datetime.datetime(2024, 1, 1, 10).timestamp()
+
+
+def new_stats():
+    return {"repetitions": 0, "interval": 0, "ease": REVIEW_INITIAL_EASE}
+
+
+def test_review_intervals_follow_sm2():
+    stats = new_stats()
+    intervals = []
+    for is_correct in (True, True, True, False, True):
+        review_question(stats, is_correct, START)
+        intervals.append((stats["repetitions"], stats["interval"], stats["ease"]))
+    assert intervals == [
+        (1, 1, 2.5),
+        (2, 6, 2.5),
+        (3, 15.0, 2.5),
+        (0, 1, 2.18),
+        (1, 1, 2.18),
+    ]
+    assert stats["due"] == START + DAY
+
+    for _ in range(10):
+        review_question(stats, False, START)
+    assert stats["ease"] == REVIEW_MIN_EASE
+
+
+def test_queue_picks_the_most_overdue_questions():
+    questions = {name: {"due": due} for name, due in [("a", 3), ("b", 1), ("c", 9)]}
+    queue = ReviewQueue(questions)
+    assert queue.due(questions, 5, now=5) == ["b", "a"]
+    assert queue.due(questions, 1, now=5) == ["b"]
+
+    # Rescheduled questions are picked by their new due time only
+    questions["b"]["due"] = 8
+    queue.push("b", 8)
+    questions["c"]["due"] = 2
+    queue.push("c", 2)
+    assert queue.due(questions, 5, now=8) == ["c", "a", "b"]
+    for _ in range(10):
+        questions["a"]["due"] += 10
+        queue.push("a", questions["a"]["due"])
+    assert queue.due(questions, 5, now=8) == ["c", "b"]
+
+
+@pytest.mark.parametrize("use_database", [False, True])
+def test_due_questions_of_the_history(exams_dir, use_database):
+    q1, q2 = make_question(1), make_question(2)
+    keys = {q["id"]: question_key(canonical_question(q)) for q in (q1, q2)}
+    save_exams(
+        exams_dir,
+        [
+            answered([q1, q2], [True, True], "2024-01-01T10:00:00"),
+            answered([q1, q2], [True, False], "2024-01-02T10:00:00"),
+        ],
+        ["exam_a", "exam_b"],
+    )
+    if use_database:
+        import_database(exams_dir)
+
+    # The first question is due again in 6 days, the second in one
+    assert get_due_question_keys(exams_dir, 5, now=START + DAY) == []
+    assert get_due_question_keys(exams_dir, 5, now=START + 2 * DAY) == [keys[q2["id"]]]
+    assert get_due_question_keys(exams_dir, 5, now=START + 7 * DAY) == [
+        keys[q2["id"]],
+        keys[q1["id"]],
+    ]
+    assert get_due_question_keys(exams_dir, 1, now=START + 7 * DAY) == [keys[q2["id"]]]
+
+    save_exams(exams_dir, [answered([q2], [True], "2024-01-03T10:00:00")], ["exam_c"])
+    # Answered correctly after a wrong answer, it is due a day later again
+    assert get_due_question_keys(exams_dir, 5, now=START + 2 * DAY) == []
+    assert get_due_question_keys(exams_dir, 5, now=START + 3 * DAY) == [keys[q2["id"]]]
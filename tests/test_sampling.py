@@ -0,0 +1,106 @@
+import collections
+import itertools
+import json
+import random
+
+import pytest
+
+from quiz.bank import sample_questions
+from quiz.model import md5_hash
+
+# Chi-square critical values at p = 0.001, by degrees of freedom
+CHI_SQUARE_CRITICAL = {9: 27.877, 119: 172.47}
+
+
+def write_bank(path, num_questions):
+    questions = [
+        {
+            "description": f"Question {i}?",
+            "answers": [
+                {"value": f"Answer {i}.{j}", "correct": j == 0} for j in range(4)
+            ],
+        }
+        for i in range(num_questions)
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(questions, f)
+    return [md5_hash(question["description"]) for question in questions]
+
+
+def chi_square(counts, expected):
+    return sum((count - expected) ** 2 / expected for count in counts)
+
+
+@pytest.fixture
+def bank(tmp_path):
+    data_file = str(tmp_path / "data.json")
+    return data_file, write_bank(data_file, 10)
+
+
+def test_sample_is_uniform(bank):
+    data_file, ids = bank
+    runs = 6000
+    subsets = collections.Counter()
+    first = collections.Counter()
+    for seed in range(runs):
+        random.seed(seed)
+        selected, candidates = sample_questions(data_file, 3)
+        assert candidates == 10
+        subsets[frozenset(question["id"] for question in selected)] += 1
+        first[selected[0]["id"]] += 1
+
+    # Every 3-question subset is equally likely, as with random.sample
+    counts = [subsets[frozenset(c)] for c in itertools.combinations(ids, 3)]
+    assert sum(counts) == runs
+    assert chi_square(counts, runs / len(counts)) < CHI_SQUARE_CRITICAL[119]
+    # And so is every order of the selected questions
+    counts = [first[question_id] for question_id in ids]
+    assert chi_square(counts, runs / len(ids)) < CHI_SQUARE_CRITICAL[9]
+
+
+def test_sample_skips_excluded_questions(bank):
+    data_file, ids = bank
+    exclude = set(ids[::2])
+    for seed in range(200):
+        random.seed(seed)
+        selected, candidates = sample_questions(data_file, 3, exclude)
+        assert candidates == 5
+        assert not exclude & {question["id"] for question in selected}
+
+
+def test_sample_adds_answer_ids(bank):
+    data_file, _ = bank
+    selected, _ = sample_questions(data_file, 2)
+    for question in selected:
+        for answer in question["answers"]:
+            assert answer["id"] == md5_hash(answer["value"])
+
+
+@pytest.mark.parametrize("num_questions", [10, 25])
+def test_sample_from_small_bank_returns_every_question(bank, num_questions):
+    data_file, ids = bank
+    orders = set()
+    for seed in range(20):
+        random.seed(seed)
+        selected, candidates = sample_questions(data_file, num_questions)
+        assert candidates == 10
+        assert sorted(question["id"] for question in selected) == sorted(ids)
+        orders.add(tuple(question["id"] for question in selected))
+    assert len(orders) > 1  # Shuffled, not in bank order
+
+
+def test_sample_when_everything_is_excluded(bank):
+    data_file, ids = bank
+    assert sample_questions(data_file, 3, set(ids)) == ([], 0)
+
+
+def test_sample_from_empty_bank(tmp_path):
+    data_file = str(tmp_path / "data.json")
+    write_bank(data_file, 0)
+    assert sample_questions(data_file, 3) == ([], 0)
+    assert sample_questions(data_file, 0) == ([], 0)
+
+
+def test_sample_of_no_questions(bank):
+    data_file, _ = bank
+    assert sample_questions(data_file, 0) == ([], 10)
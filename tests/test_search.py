@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+
+import pytest
+
+import quiz.search
+from quiz.bank import load_questions, read_bank_cache, write_bank_cache
+from quiz.constants import SEARCH_INDEX_SUFFIX, SEARCH_INDEX_VERSION
+from quiz.search import _search_indexes, open_search_index
+
+QUESTIONS = [
+    ("Which BigQuery dataset holds the billing export?", ["billing"]),
+    ("How do you share a BigQuery table with another project?", ["IAM"]),
+    ("Which Cloud Storage class suits archives?", ["Cloud Storage"]),
+    ("What does a dataset location control?", []),
+]
+
+
+def write_tagged_bank(path, questions):
+    bank = [
+        {
+            "description": description,
+            "answers": [
+                {"value": "Yes", "correct": True},
+                {"value": "No", "correct": False},
+            ],
+            "tags": tags,
+        }
+        for description, tags in questions
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(bank, f)
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = str(tmp_path / "data.json")
+    write_tagged_bank(path, QUESTIONS)
+    return path
+
+
+def test_search_queries(data_file):
+    index = open_search_index(data_file)
+    assert index.search("bigquery") == [0, 1]
+    assert index.search("bigquery -billing") == [1]
+    assert index.search("(table OR class) AND NOT storage") == [1]
+    assert index.search("data*") == [0, 3]
+    assert index.search('tag:"cloud storage"') == [2]
+    assert index.search("tag:iam OR location") == [1, 3]
+    with pytest.raises(ValueError):
+        index.search("(bigquery")
+    # Positions are those of load_questions
+    ids = [question["id"] for question in load_questions(data_file)]
+    assert index.ids == ids
+
+
+def test_index_is_read_back_from_its_file(data_file, monkeypatch):
+    built = open_search_index(data_file)
+    assert os.path.exists(data_file + SEARCH_INDEX_SUFFIX)
+    _search_indexes.clear()
+
+    def no_build(data_file):
+        raise AssertionError("index rebuilt")
+
+    monkeypatch.setattr(quiz.search, "build_search_index", no_build)
+    loaded = open_search_index(data_file)
+    assert loaded is not built
+    assert (loaded.ids, loaded.terms) == (built.ids, built.terms)
+    assert loaded.search("bigquery -billing") == [1]
+
+
+def test_index_is_rebuilt_when_the_bank_changes(data_file):
+    assert open_search_index(data_file).search("archives") == [2]
+    write_tagged_bank(data_file, QUESTIONS[2:])
+    _search_indexes.clear()
+    assert open_search_index(data_file).search("archives") == [0]
+
+
+def test_index_of_another_version_is_rebuilt(data_file):
+    index_file = data_file + SEARCH_INDEX_SUFFIX
+    open_search_index(data_file)
+    key, data = read_bank_cache(index_file)
+    # As written by another Python version, whose marshal data may not load
+    key["version"] = "2-2.7"
+    data["count"] = 0
+    write_bank_cache(index_file, key, data)
+    _search_indexes.clear()
+
+    assert open_search_index(data_file).search("bigquery") == [0, 1]
+    version = read_bank_cache(index_file, key_only=True)[0]["version"]
+    assert version == SEARCH_INDEX_VERSION
+    assert version.endswith(f"-{sys.version_info[0]}.{sys.version_info[1]}")
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import os
+import threading
+
+from test_sampling import write_bank
+from quiz.constants import ALIASES_FILE
+from quiz.history import get_questions_from_done_tests
+from quiz.journal import AnswerJournal, get_interrupted_tests
+from quiz.server import (
+    QuizServer,
+    open_server_connection,
+    receive_message,
+    send_message,
+)
+from quiz.storage import load_exam
+
+START = {"op": "start", "questions": 3, "time_limit": 5, "pass_condition": "70%"}
+
+
+async def connect(server, exchange):
+    """Run exchange(reader, writer) over a connection to the server."""
+    listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await open_server_connection("127.0.0.1", port)
+    try:
+        return await exchange(reader, writer)
+    finally:
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+
+
+async def take_test(server, answers):
+    async def exchange(reader, writer):
+        await send_message(writer, START)
+        started = await receive_message(reader)
+        for index, question in enumerate(started["questions"]):
+            answer = [question["answers"][answers[index]]["id"]]
+            await send_message(
+                writer, {"op": "answer", "index": index, "answer": answer}
+            )
+            assert (await receive_message(reader))["ok"]
+        await send_message(writer, {"op": "submit"})
+        return await receive_message(reader)
+
+    return await connect(server, exchange)
+
+
+def test_server_journals_answers_on_io_thread(tmp_path, exams_dir, monkeypatch):
+    data_file = str(tmp_path / "data.json")
+    write_bank(data_file, 10)
+    threads = []
+    record_answer = AnswerJournal.record_answer
+
+    def recording(journal, *args):
+        threads.append(threading.get_ident())
+        record_answer(journal, *args)
+
+    monkeypatch.setattr(AnswerJournal, "record_answer", recording)
+    server = QuizServer(data_file, exams_dir)
+    try:
+        submitted = asyncio.run(take_test(server, [0, 1, 0]))
+    finally:
+        server.close()
+
+    assert len(threads) == 3
+    assert threading.get_ident() not in threads
+    assert submitted["ok"]
+    exam = load_exam(submitted["saved_at"])
+    assert exam["total"] == 3
+    assert all(len(result["user_answer"]) == 1 for result in exam["questions"])
+    assert get_interrupted_tests(exams_dir) == []
+
+
+def test_server_rejects_malformed_requests(tmp_path, exams_dir):
+    data_file = str(tmp_path / "data.json")
+    write_bank(data_file, 10)
+
+    async def exchange(reader, writer):
+        responses = []
+        for line in ("[]", "1", '"start"'):
+            writer.write(line.encode("utf-8") + b"\n")
+            responses.append(await receive_message(reader))
+        await send_message(writer, START)
+        started = await receive_message(reader)
+        answer = [started["questions"][0]["answers"][0]["id"]]
+        for index in (-1, 3):
+            await send_message(
+                writer, {"op": "answer", "index": index, "answer": answer}
+            )
+            responses.append(await receive_message(reader))
+        await send_message(writer, {"op": "answer", "index": 0, "answer": answer * 2})
+        responses.append(await receive_message(reader))
+        # The connection is still usable after the rejected requests
+        await send_message(writer, {"op": "answer", "index": 0, "answer": answer})
+        responses.append(await receive_message(reader))
+        await send_message(writer, {"op": "submit"})
+        return responses, await receive_message(reader)
+
+    server = QuizServer(data_file, exams_dir)
+    try:
+        responses, submitted = asyncio.run(connect(server, exchange))
+    finally:
+        server.close()
+
+    assert [response["ok"] for response in responses] == [False] * 6 + [True]
+    assert submitted["ok"]
+    exam = load_exam(submitted["saved_at"])
+    assert [len(result["user_answer"]) for result in exam["questions"]] == [1, 0, 0]
+
+
+def test_seen_questions_follow_aliases(tmp_path, exams_dir):
+    data_file = str(tmp_path / "data.json")
+    ids = write_bank(data_file, 3)
+    os.makedirs(exams_dir)
+    with open(os.path.join(exams_dir, ALIASES_FILE), "w", encoding="utf-8") as f:
+        json.dump({question_id: f"new-{question_id}" for question_id in ids}, f)
+
+    server = QuizServer(data_file, exams_dir)
+    try:
+        assert asyncio.run(take_test(server, [0, 0, 0]))["ok"]
+        seen = server.seen_questions
+    finally:
+        server.close()
+
+    assert seen == {f"new-{question_id}" for question_id in ids}
+    assert seen == get_questions_from_done_tests(exams_dir)
@@ -0,0 +1,168 @@
+import json
+import os
+
+import quiz.history
+from conftest import make_exam, make_question
+from quiz.analysis import get_low_accuracy_question_keys, get_low_accuracy_questions
+from quiz.constants import STATS_INDEX_FILE
+from quiz.history import _scanned_exams, load_stats_index, save_exams, scan_history
+
+
+def answered(questions, correct, timestamp):
+    """Completed test with each question answered correctly or not."""
+    exam = make_exam(questions, timestamp)
+    for result, is_correct in zip(exam["questions"], correct):
+        if not is_correct:
+            answers = result["question"]["answers"]
+            result["user_answer"] = [answers[-1]["id"]]
+    exam["score"] = sum(correct)
+    return exam
+
+
+def touch_dir(path):
+    """Let the directory's modification time tick on coarse filesystems."""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def no_scan(exam_paths, workers=None):
+    raise AssertionError(f"rescanned {exam_paths}")
+
+
+def saved_and_copied(exams_dir):
+    """Paths of two tests in the exam log and one test file copied in by hand."""
+    paths = save_exams(
+        exams_dir,
+        [
+            answered([make_question(1), make_question(2)], [True, False], "2024-01-01"),
+            answered([make_question(2)], [True], "2024-01-02"),
+        ],
+        ["exam_a", "exam_b"],
+    )
+    paths.append(os.path.join(exams_dir, "exam_copied.json"))
+    with open(paths[-1], "w", encoding="utf-8") as f:
+        json.dump(answered([make_question(3)], [False], "2024-01-03"), f)
+    return paths
+
+
+def test_index_counts_answers_per_question(exams_dir):
+    q1, q2 = make_question(1), make_question(2)
+    save_exams(
+        exams_dir,
+        [
+            answered([q1, q2], [True, False], "2024-01-01T10:00:00"),
+            answered([q2], [True], "2024-01-02T10:00:00"),
+        ],
+        ["exam_a", "exam_b"],
+    )
+
+    index = load_stats_index(exams_dir)
+    assert index["exams"] == ["exam_a", "exam_b"]
+    stats = index["questions"]
+    assert (stats[q1["id"]]["attempts"], stats[q1["id"]]["correct_count"]) == (1, 1)
+    assert (stats[q2["id"]]["attempts"], stats[q2["id"]]["correct_count"]) == (2, 1)
+    assert stats[q2["id"]]["results"] == "01"
+    assert stats[q2["id"]]["last_seen"] == "2024-01-02T10:00:00"
+    with open(os.path.join(exams_dir, STATS_INDEX_FILE), encoding="utf-8") as f:
+        assert json.load(f) == index
+
+    assert get_low_accuracy_question_keys(exams_dir, 60) == [stats[q2["id"]]["key"]]
+    [question] = get_low_accuracy_questions(exams_dir, 60)
+    assert question["description"] == q2["description"]
+
+
+def test_saving_updates_the_index_without_rescanning(exams_dir, monkeypatch):
+    save_exams(exams_dir, [make_exam([make_question(1)])], ["exam_a"])
+    load_stats_index(exams_dir)
+    monkeypatch.setattr(quiz.history, "scan_history", no_scan)
+
+    save_exams(exams_dir, [make_exam([make_question(1)])], ["exam_b"])
+
+    index = load_stats_index(exams_dir)
+    assert index["exams"] == ["exam_a", "exam_b"]
+    assert index["questions"][make_question(1)["id"]]["attempts"] == 2
+
+
+def test_tests_added_by_hand_are_folded_in(exams_dir, monkeypatch):
+    save_exams(exams_dir, [make_exam([make_question(1)])], ["exam_a"])
+    path = os.path.join(exams_dir, "exam_copied.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(make_exam([make_question(2)], "2024-01-03T10:00:00"), f)
+    touch_dir(exams_dir)
+    scanned = []
+    scan = quiz.history.scan_history
+
+    def scan_history(exam_paths, workers=None):
+        scanned.extend(exam_paths)
+        return scan(exam_paths, workers)
+
+    monkeypatch.setattr(quiz.history, "scan_history", scan_history)
+
+    index = load_stats_index(exams_dir)
+    assert scanned == [path]
+    assert index["exams"] == ["exam_a", "exam_copied.json"]
+    assert make_question(2)["id"] in index["questions"]
+
+
+def test_index_is_rebuilt_when_a_test_is_removed(exams_dir):
+    os.makedirs(exams_dir)
+    paths = []
+    for number in (1, 2):
+        paths.append(os.path.join(exams_dir, f"exam_{number}.json"))
+        with open(paths[-1], "w", encoding="utf-8") as f:
+            json.dump(make_exam([make_question(number)]), f)
+    assert len(load_stats_index(exams_dir)["exams"]) == 2
+
+    os.remove(paths[0])
+    touch_dir(exams_dir)
+
+    index = load_stats_index(exams_dir)
+    assert index["exams"] == ["exam_2.json"]
+    assert list(index["questions"]) == [make_question(2)["id"]]
+
+
+def test_parallel_scan_matches_serial_scan(exams_dir, monkeypatch):
+    paths = saved_and_copied(exams_dir)
+    serial = scan_history(paths, workers=1)
+    assert [scanned["name"] for scanned in serial] == [
+        "exam_a",
+        "exam_b",
+        "exam_copied.json",
+    ]
+    assert [correct for _, _, correct in serial[0]["results"]] == [True, False]
+    _scanned_exams.clear()
+    monkeypatch.setattr(quiz.history, "PARALLEL_SCAN_MIN_TESTS", 1)
+    pools = []
+    process_pool = quiz.history.process_pool
+
+    def counted_pool(workers):
+        pools.append(workers)
+        return process_pool(workers)
+
+    monkeypatch.setattr(quiz.history, "process_pool", counted_pool)
+
+    assert scan_history(paths, workers=2) == serial
+    assert pools == [2]
+
+
+def test_scans_are_reused_until_a_test_changes(exams_dir, monkeypatch):
+    paths = saved_and_copied(exams_dir)
+    first = scan_history(paths, workers=1)
+    # A fresh scan of a test file carries its questions for the store
+    assert [len(scanned["questions"]) for scanned in first] == [0, 0, 1]
+    scan_exam = quiz.history.scan_exam
+    scanned = []
+
+    def scan_once(exam_path):
+        scanned.append(exam_path)
+        return scan_exam(exam_path)
+
+    monkeypatch.setattr(quiz.history, "scan_exam", scan_once)
+
+    assert scan_history(paths, workers=1) == [
+        {**scanned, "questions": []} for scanned in first
+    ]
+    assert scanned == []
+    touch_dir(paths[-1])
+    scan_history(paths, workers=1)
+    assert scanned == [paths[-1]]
@@ -0,0 +1,170 @@
+import asyncio
+import io
+import os
+import time
+
+import pytest
+
+from conftest import make_question
+from quiz.journal import AnswerJournal
+from quiz.terminal import Screen, run_session
+
+
+class Terminal(io.StringIO):
+    """Output stream of a terminal, taking the frames drawn since last read."""
+
+    def isatty(self):
+        return True
+
+    def take(self):
+        text = self.getvalue()
+        self.seek(0)
+        self.truncate()
+        return text
+
+
+@pytest.fixture
+def terminal(monkeypatch):
+    size = [(80, 24)]
+    monkeypatch.setattr("shutil.get_terminal_size", lambda: os.terminal_size(size[0]))
+    monkeypatch.delenv("TERM", raising=False)
+    stream = Terminal()
+    stream.size = size
+    return stream
+
+
+class Keys:
+    """Keyboard typing the given texts, then nothing more."""
+
+    def __init__(self, texts, live=False):
+        self.texts = list(texts)
+        self.live = live
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    async def read(self):
+        if self.texts:
+            return self.texts.pop(0)
+        await asyncio.Event().wait()
+
+
+def frame(header, body, prompt="Answer: "):
+    return [("header", header), ("body", body), ("prompt", [prompt])]
+
+
+def test_only_the_changed_regions_are_redrawn(terminal):
+    screen = Screen(terminal)
+    assert screen.ansi
+
+    screen.draw(frame(["Question 1 of 2"], ["Question 1?", "A. Answer"]))
+    assert terminal.take() == (
+        "\x1b[1;1H\x1b[J" "Question 1 of 2\n" "Question 1?\n" "A. Answer\n" "Answer: "
+    )
+    # The prompt is always rewritten, below the unchanged regions
+    screen.draw(frame(["Question 1 of 2"], ["Question 1?", "A. Answer"], "Answer: a"))
+    assert terminal.take() == "\x1b[4;1H\x1b[J" "Answer: a"
+    screen.draw(frame(["Question 1 of 2"], ["Question 2?"]))
+    assert terminal.take() == "\x1b[2;1H\x1b[J" "Question 2?\n" "Answer: "
+
+
+def test_wrapped_lines_take_several_rows(terminal):
+    screen = Screen(terminal)
+    screen.draw(frame(["x" * 81], ["Question 1?"]))
+    terminal.take()
+
+    screen.draw(frame(["x" * 81], ["Question 2?"]))
+    assert terminal.take().startswith("\x1b[3;1H")
+
+
+def test_frame_is_redrawn_in_full(terminal):
+    screen = Screen(terminal)
+    screen.draw(frame(["Header"], ["Question 1?"]))
+    terminal.take()
+
+    terminal.size[0] = (100, 30)
+    screen.draw(frame(["Header"], ["Question 1?"]))
+    assert terminal.take().startswith("\x1b[1;1H\x1b[J" "Header\n")
+
+    screen.clear()
+    assert terminal.take() == "\x1b[H\x1b[2J"
+    screen.draw(frame(["Header"], ["Question 1?"]))
+    assert terminal.take().startswith("\x1b[1;1H\x1b[J" "Header\n")
+
+    # A frame taller than the terminal scrolls it, so positions are lost
+    body = [f"Line {i}" for i in range(30)]
+    screen.draw(frame(["Header"], body))
+    terminal.take()
+    screen.draw(frame(["Header"], body, "Answer: a"))
+    assert terminal.take().startswith("\x1b[1;1H\x1b[J" "Header\n")
+
+
+def test_plain_text_without_a_terminal(terminal, monkeypatch):
+    monkeypatch.setenv("TERM", "dumb")
+    screen = Screen(terminal)
+    assert not screen.ansi
+
+    screen.clear()
+    screen.draw(frame(["Header"], ["Question 1?"]))
+    screen.draw(frame(["Header"], ["Question 1?"], "Answer: a"))
+    assert terminal.take() == (
+        "\nHeader\nQuestion 1?\nAnswer: " "\nHeader\nQuestion 1?\nAnswer: a"
+    )
+    assert not Screen(io.StringIO()).ansi
+
+
+def test_session_reads_answers_key_by_key(monkeypatch):
+    monkeypatch.delenv("TERM", raising=False)
+    questions = [make_question(1), make_question(2)]
+    results = [{"question": q, "user_answer": []} for q in questions]
+    keys = Keys(
+        [
+            "z\n",
+            "b",
+            "\r",
+            "back\n",
+            "a\x1b[Ac\n",
+            "next\n",
+            "a\x7fb\n",
+        ]
+    )
+    output = Terminal()
+
+    timed_out = asyncio.run(run_session(results, 30, time.time(), keys, Screen(output)))
+
+    assert not timed_out
+    assert [result["user_answer"] for result in results] == [
+        [questions[0]["answers"][0]["id"], questions[0]["answers"][2]["id"]],
+        [questions[1]["answers"][1]["id"]],
+    ]
+    assert "Invalid answer, please try again." in output.getvalue()
+    assert "You haven't selected any answer." in output.getvalue()
+    assert "Your previous answer: B" in output.getvalue()
+
+
+def test_test_is_submitted_when_the_time_runs_out(terminal, exams_dir):
+    questions = [make_question(1), make_question(2)]
+    results = [{"question": q, "user_answer": []} for q in questions]
+    journal = AnswerJournal.start(exams_dir, results, 1, "70%")
+    # About a second is left, and one question is answered before it runs out
+    start_time = time.time() - 58.8
+
+    timed_out = asyncio.run(
+        run_session(
+            results, 1, start_time, Keys(["a\n"], live=True), Screen(terminal), journal
+        )
+    )
+    journal.close()
+
+    assert timed_out
+    assert time.time() - start_time >= 59.9
+    assert results[0]["user_answer"] == [questions[0]["answers"][0]["id"]]
+    assert results[1]["user_answer"] == []
+    # The timer was redrawn on its own, and the time spent kept in the journal
+    assert "Remaining time: 00:00" in terminal.getvalue()
+    resumed = AnswerJournal.open(exams_dir, journal.path)
+    assert resumed.results[0]["user_answer"] == results[0]["user_answer"]
+    assert resumed.elapsed >= 58.8